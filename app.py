@@ -1,24 +1,46 @@
 # app.py
+import startup  # first, so the boot time covers every import below
 import os
 import json
 import datetime
 import re
 import base64
 import io
-import cv2
-import numpy as np
-from PIL import Image
-from flask import Flask, redirect, url_for, session, render_template, jsonify, request, flash, send_from_directory
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, redirect, url_for, session, render_template, jsonify, request, flash, send_from_directory, Response, g
 from authlib.integrations.flask_client import OAuth
 from functools import wraps
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaInMemoryUpload
+from google.auth.transport.requests import Request as GoogleAuthRequest
 import requests
 import secrets  # Add this import at the top
 
 # Import Cerebras integration
-from cerebras_integration import process_slide_with_cerebras
+from cerebras_integration import (process_slide_with_cerebras, get_ocr_pipeline, get_ocr_input_stage, ocr_engine_order,
+                                  cerebras_stats)
+from google_services import service_pool, token_fingerprint, get_discovery_document
+from http_transport import transport_pool
+from ocr_jobs import ocr_queue, QueueFull, DONE
+from ocr_cache import ocr_cache
+from capture_index import capture_index
+from image_hash import perceptual_hash
+from image_normalization import normalize_image, ARCHIVE_TARGET, PREVIEW_TARGET
+from capture_store import capture_store
+from doc_writer import doc_writer, DocWriteFailed, WRITTEN, FAILED
+from doc_names import doc_names
+from calendar_store import calendar_store
+from push_channels import push_channels, CALENDAR, DRIVE
+from session_store import create_session_interface
+from workflows import Workflow, workflow_stats
+from google_calls import google_calls
+from metrics import metrics, observe_request, timed_call
+from startup import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+googleapiclient_http = lazy_import('googleapiclient.http')
 
 # Initialize Flask app
 app = Flask(__name__, static_url_path='/static')
@@ -31,6 +53,15 @@ app.config.update(
     PERMANENT_SESSION_LIFETIME=datetime.timedelta(days=1)
 )
 
+# Sessions live server-side; the cookie only carries a signed session id
+app.session_interface = create_session_interface()
+
+
+# OAuth endpoints; overridable so the app can run against a local stand-in
+GOOGLE_OAUTH_METADATA_URL = os.environ.get(
+    "GOOGLE_OAUTH_METADATA_URL", 'https://accounts.google.com/.well-known/openid-configuration'
+)
+GOOGLE_TOKEN_URI = os.environ.get("GOOGLE_TOKEN_URI", 'https://oauth2.googleapis.com/token')
 
 # OAuth Configuration with full permissions for Calendar and Docs
 oauth = OAuth(app)
@@ -38,7 +69,7 @@ google = oauth.register(
     name='google',
     client_id=os.environ.get("GOOGLE_CLIENT_ID"),
     client_secret=os.environ.get("GOOGLE_CLIENT_SECRET"),
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+    server_metadata_url=GOOGLE_OAUTH_METADATA_URL,
     client_kwargs={
         'scope': 'openid email profile https://www.googleapis.com/auth/calendar https://www.googleapis.com/auth/documents https://www.googleapis.com/auth/drive'
     },
@@ -59,11 +90,7 @@ def get_current_user():
     return session.get('user')
 
 # Helper function to build credentials object
-def get_credentials():
-    token = session.get('oauth_token')
-    if not token:
-        return None
-    
+def build_credentials(token):
     # Debug information - Print to console
     print("-------- CREDENTIALS DEBUG INFO --------")
     print(f"Token scopes: {token.get('scope', '')}")
@@ -72,45 +99,106 @@ def get_credentials():
     return Credentials(
         token=token.get('access_token'),
         refresh_token=token.get('refresh_token'),
-        token_uri='https://oauth2.googleapis.com/token',
+        token_uri=GOOGLE_TOKEN_URI,
         client_id=os.environ.get("GOOGLE_CLIENT_ID"),
         client_secret=os.environ.get("GOOGLE_CLIENT_SECRET"),
         scopes=token.get('scope', '').split(' ')
     )
 
+def refresh_oauth_token(token):
+    """Exchange the refresh token for a new access token; returns the updated token dict"""
+    credentials = build_credentials(token)
+    with timed_call('google', 'oauth.token.refresh'):
+        credentials.refresh(GoogleAuthRequest())
+    expires_at = credentials.expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return dict(
+        token,
+        access_token=credentials.token,
+        refresh_token=credentials.refresh_token or token.get('refresh_token'),
+        expires_at=int(expires_at),
+        expires_in=int(expires_at - datetime.datetime.now(datetime.timezone.utc).timestamp())
+    )
+
+def get_oauth_token():
+    """The session's OAuth token, refreshed first if it is about to expire"""
+    return app.session_interface.fresh_token(session, refresh_oauth_token)
+
+def get_credentials():
+    token = get_oauth_token()
+    if not token:
+        return None
+    return app.session_interface.credentials(token, build_credentials)
+
+# Helper function to get a pooled Google service for the current user
+def get_google_service(api_name, api_version):
+    """Get an authorized Google API service, reusing a pooled handle when possible"""
+    token = get_oauth_token()
+    if not token:
+        return None
+    user_key = (get_current_user() or {}).get('sub')
+    token_key = token_fingerprint(token)
+    return service_pool.get(user_key or token_key, api_name, api_version, token_key, get_credentials)
+
 # Helper functions to get Google services
 def get_calendar_service():
     """Get Google Calendar service"""
-    credentials = get_credentials()
-    if not credentials:
-        return None
-    return build('calendar', 'v3', credentials=credentials)
+    return get_google_service('calendar', 'v3')
 
 def get_drive_service():
     """Get Google Drive service"""
-    credentials = get_credentials()
-    if not credentials:
-        return None
-    return build('drive', 'v3', credentials=credentials)
+    return get_google_service('drive', 'v3')
 
 def get_docs_service():
     """Get Google Docs service"""
-    credentials = get_credentials()
-    if not credentials:
-        return None
-    return build('docs', 'v1', credentials=credentials)
+    return get_google_service('docs', 'v1')
 
 def get_people_service():
     """Get Google People API service"""
-    credentials = get_credentials()
-    if not credentials:
-        return None
-    return build('people', 'v1', credentials=credentials)
+    return get_google_service('people', 'v1')
+
+# A capture only counts as saved once the write-behind buffer has written it;
+# one Docs rejected for good may be captured and saved again
+def record_doc_write(saved):
+    def record(owner, doc_id, meta):
+        if meta and meta.get('hash') is not None:
+            capture_index.record(owner, doc_id, meta['hash'], text=meta.get('text'), saved=saved, saving=False)
+    return record
+
+doc_writer.on_outcome(WRITTEN, record_doc_write(True))
+doc_writer.on_outcome(FAILED, record_doc_write(False))
+
+# Push notifications invalidate the per-user caches when Google reports a change
+push_channels.on_change(CALENDAR, lambda owner, target: calendar_store.invalidate(owner))
+push_channels.on_change(DRIVE, lambda owner, target: doc_names.invalidate(owner, target))
+
+def watch_calendar(owner, calendar_service):
+    """Apply pushed changes for a user and keep their calendar's push channel alive"""
+    push_channels.apply_changes(owner)
+    calendar_store.set_watched(owner, push_channels.watch_calendar(owner, calendar_service))
+
+def watch_doc(owner, drive_service, doc_id):
+    """Keep a push channel on a notes document so its cached name can live longer"""
+    doc_names.set_watched(owner, doc_id, push_channels.watch_file(owner, drive_service, doc_id))
 
 @app.before_request
 def make_session_permanent():
     session.permanent = True
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Labelled by route pattern, not path, so /ocr-jobs/<job_id> is one series.
+    # Timed when the server closes the response, so streamed bodies count in full.
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method, status = request.method, response.status_code
+        response.call_on_close(lambda: observe_request(route, method, status, time.perf_counter() - started))
+    return response
+
 # Routes
 @app.route('/')
 def index():
@@ -121,42 +209,9 @@ def index():
         try:
             calendar_service = get_calendar_service()
             if calendar_service:
-                now = datetime.datetime.utcnow()
-                now_str = now.isoformat() + 'Z'  # 'Z' indicates UTC time
-
-                # Get events happening now or upcoming (next 24 hours)
-                events_result = calendar_service.events().list(
-                    calendarId='primary',
-                    timeMin=now_str,
-                    timeMax=(now + datetime.timedelta(hours=24)).isoformat() + 'Z',
-                    maxResults=5,
-                    singleEvents=True,
-                    orderBy='startTime',
-                    fields='items(id,summary,description,start,end,attachments)'
-                ).execute()
-
-                events = events_result.get('items', [])
-                
-                # First check for an event happening right now
-                for event in events:
-                    start_time = event.get('start', {}).get('dateTime')
-                    end_time = event.get('end', {}).get('dateTime')
-                    
-                    if start_time and end_time:
-                        start_dt = datetime.datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                        end_dt = datetime.datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                        
-                        now_aware = now.replace(tzinfo=datetime.timezone.utc)
-                        
-                        if start_dt <= now_aware <= end_dt:
-                            current_event = event
-                            current_event['status'] = 'in_progress'
-                            break
-
-                # If no event is happening now, take the next upcoming one
-                if not current_event and events:
-                    current_event = events[0]  # First upcoming event
-                    current_event['status'] = 'upcoming'
+                # Event happening now, or else the next one in the next 24 hours
+                watch_calendar(user.get('sub'), calendar_service)
+                current_event = calendar_store.current_event(user.get('sub'), calendar_service)
 
                 # Check for associated document
                 if current_event:
@@ -193,12 +248,21 @@ def login():
     redirect_uri = url_for('authorize', _external=True)
     
     # Pass the state parameter explicitly
-    return google.authorize_redirect(redirect_uri, state=state)
+    # Offline access so the server can refresh the access token before it
+    # expires instead of sending the user through login again. The consent
+    # screen is only needed when we hold no refresh token for the user yet
+    # (see authorize)
+    params = {'access_type': 'offline'}
+    if request.args.get('consent'):
+        session['oauth_consent'] = True
+        params['prompt'] = 'consent'
+    return google.authorize_redirect(redirect_uri, state=state, **params)
 
 @app.route('/authorize')
 def authorize():
     try:    
-        token = google.authorize_access_token()
+        with timed_call('google', 'oauth.token.exchange'):
+            token = google.authorize_access_token()
         
         # Debug information - Print to console
         print("-------- TOKEN DEBUG INFO --------")
@@ -209,9 +273,17 @@ def authorize():
         # Save credentials in session
         session['oauth_token'] = token
         
-        # Get user info
-        resp = google.get('https://openidconnect.googleapis.com/v1/userinfo')
-        user_info = resp.json()
+        # Get user info from the provider's userinfo endpoint
+        with timed_call('google', 'oauth.userinfo'):
+            user_info = dict(google.userinfo())
+        
+        # Reusing an existing grant returns no refresh token; take the one
+        # stored for this user, or go through the consent screen once to get one
+        consented = session.pop('oauth_consent', False)
+        if not app.session_interface.complete_token(user_info.get('sub'), token) and not consented:
+            session.clear()
+            return redirect(url_for('login', consent=1))
+        session['oauth_token'] = token
         
         # Add profile picture URL to user info
         if 'sub' in user_info:
@@ -219,10 +291,10 @@ def authorize():
             try:
                 people_service = get_people_service()
                 if people_service:
-                    person = people_service.people().get(
+                    person = google_calls.execute(people_service.people().get(
                         resourceName=f'people/{user_info["sub"]}',
                         personFields='photos'
-                    ).execute()
+                    ), user=user_info['sub'])
                     
                     if 'photos' in person and len(person['photos']) > 0:
                         # Find the photo with the highest resolution
@@ -244,7 +316,18 @@ def authorize():
 
 @app.route('/logout')
 def logout():
-    # Clear the entire session
+    # Flush buffered notes, stop push channels and drop pooled Google
+    # services for this user, then clear the entire session
+    user = get_current_user()
+    if user and user.get('sub'):
+        # Write any buffered captures before the credentials go away
+        doc_writer.attach(user['sub'], get_credentials())
+        doc_writer.flush_owner(user['sub'])
+        doc_writer.detach(user['sub'])
+        push_channels.stop_owner(user['sub'], get_calendar_service(), get_drive_service())
+        service_pool.invalidate_user(user['sub'])
+        doc_names.invalidate(user['sub'])
+        calendar_store.drop(user['sub'])
     session.clear()
     return redirect('/')
 
@@ -260,18 +343,10 @@ def get_calendar():
         return redirect(url_for('logout'))
     
     # Get upcoming events
-    now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
+    now = datetime.datetime.now(datetime.timezone.utc)
     try:
-        events_result = calendar_service.events().list(
-            calendarId='primary', 
-            timeMin=now,
-            maxResults=20, 
-            singleEvents=True,
-            orderBy='startTime',
-            fields='items(id,summary,description,start,end,attachments)'  # Include attachments field
-        ).execute()
-        
-        events = events_result.get('items', [])
+        watch_calendar(get_current_user().get('sub'), calendar_service)
+        events = calendar_store.events(get_current_user().get('sub'), calendar_service, time_min=now, limit=20)
         
         # Check for associated docs
         for event in events:
@@ -300,14 +375,14 @@ def get_calendar():
             if doc_id:
                 event['has_doc'] = True
                 event['doc_id'] = doc_id
-                
-                # Try to get document name
-                try:
-                    doc_info = drive_service.files().get(fileId=doc_id, fields='name').execute()
-                    event['doc_name'] = doc_info.get('name', 'Linked Document')
-                except Exception as e:
-                    print(f"Error getting doc info: {e}")
-                    event['doc_name'] = 'Linked Document'
+        
+        # Get all document names at once (cached, or one Drive batch request)
+        linked = [event['doc_id'] for event in events if event['has_doc']]
+        if linked:
+            names = doc_names.lookup(get_current_user().get('sub'), drive_service, linked)
+            for event in events:
+                if event['has_doc']:
+                    event['doc_name'] = names[event['doc_id']]
         
         return render_template('calendar.html', events=events, user=get_current_user(), active_page='calendar')
     
@@ -328,13 +403,13 @@ def get_docs():
         print("Attempting to list Drive files...")
         
         # List documents (using Drive API)
-        results = drive_service.files().list(
+        results = google_calls.execute(drive_service.files().list(
             q="mimeType='application/vnd.google-apps.document'",
             spaces='drive',
             fields='files(id, name, createdTime, modifiedTime)',
             pageSize=20,
             orderBy='modifiedTime desc'
-        ).execute()
+        ), user=get_current_user().get('sub'))
         
         documents = results.get('files', [])
         print(f"Found {len(documents)} documents")
@@ -355,7 +430,8 @@ def view_doc(doc_id):
     
     try:
         # Get document content
-        document = docs_service.documents().get(documentId=doc_id).execute()
+        document = google_calls.execute(docs_service.documents().get(documentId=doc_id),
+                                        user=get_current_user().get('sub'))
         return render_template('document.html', document=document, user=get_current_user())
     except Exception as e:
         error_message = f"Error accessing document: {str(e)}"
@@ -385,6 +461,86 @@ def debug_token():
     <p><a href="/logout">Logout and try again</a></p>
     """
 
+def doc_url(doc_id):
+    return f"https://docs.google.com/document/d/{doc_id}/edit"
+
+def create_notes_doc(owner, drive_service, title):
+    """Create an empty Google Doc in Drive; returns the Drive file (id, name)"""
+    document = {
+        'name': title,
+        'mimeType': 'application/vnd.google-apps.document',
+    }
+    return google_calls.execute(drive_service.files().create(body=document), user=owner)
+
+def insert_doc_text(owner, docs_service, doc_id, text):
+    """Write the initial text at the start of a new document"""
+    return google_calls.execute(docs_service.documents().batchUpdate(
+        documentId=doc_id,
+        body={'requests': [{'insertText': {'location': {'index': 1}, 'text': text}}]}
+    ), user=owner)
+
+def linked_description(description, label, doc_id):
+    """Event description with a link to the notes document appended"""
+    if description:
+        return f"{description}\n\n{label}: {doc_url(doc_id)}"
+    return f"{label}: {doc_url(doc_id)}"
+
+def linked_notes_workflow(name, owner, calendar_service, drive_service, docs_service, event_id, known_event,
+                          title_for, text_for, link_label, required=True):
+    """
+    Workflow creating a notes document for an existing event and linking it from the event
+
+    The event is fetched (for its current description) while the document is
+    created, whenever the title can come from the calendar store; the
+    document's text and the event link are then written concurrently. Only
+    the description is patched, so the event is fetched once.
+
+    Args:
+        name: Workflow name, used in the timing stats
+        owner: User the calls are made for ('sub')
+        event_id: Calendar event to link the document from
+        known_event: The event as held by the calendar store, or None
+        title_for: Callable(event or None) returning the document title
+        text_for: Callable(event or None, title) returning the initial text
+        link_label: Label of the link line added to the description
+        required: If False, failing to read or update the event is only
+            logged and the document is still created
+
+    Returns:
+        Workflow with steps get_event, create_doc, write_text and link_event
+    """
+    flow = Workflow(name)
+    flow.step(
+        'get_event',
+        lambda: google_calls.execute(calendar_service.events().get(calendarId='primary', eventId=event_id),
+                                     user=owner),
+        optional=not required
+    )
+    if known_event is not None:
+        flow.step('create_doc', lambda: create_notes_doc(owner, drive_service, title_for(known_event)))
+    else:
+        flow.step('create_doc', lambda get_event: create_notes_doc(owner, drive_service, title_for(get_event)),
+                  after=('get_event',))
+    flow.step(
+        'write_text',
+        lambda get_event, create_doc: insert_doc_text(
+            owner, docs_service, create_doc['id'], text_for(get_event or known_event, create_doc['name'])
+        ),
+        after=('get_event', 'create_doc')
+    )
+
+    def link_event(get_event, create_doc):
+        if get_event is None:
+            return None
+        return google_calls.execute(calendar_service.events().patch(
+            calendarId='primary',
+            eventId=event_id,
+            body={'description': linked_description(get_event.get('description', ''), link_label, create_doc['id'])}
+        ), user=owner, idempotent=True)  # sets the whole description, so a second send changes nothing
+
+    flow.step('link_event', link_event, after=('get_event', 'create_doc'), optional=not required)
+    return flow
+
 @app.route('/create-doc-for-event/<event_id>', methods=['GET', 'POST'])
 @login_required
 def create_doc_for_event(event_id):
@@ -396,53 +552,35 @@ def create_doc_for_event(event_id):
         return redirect(url_for('logout'))
     
     try:
-        # Get event details
-        event = calendar_service.events().get(calendarId='primary', eventId=event_id).execute()
-        
         if request.method == 'POST':
-            # Create a new Google Doc
-            doc_title = f"Notes: {event.get('summary', 'Meeting')} - {datetime.datetime.now().strftime('%Y-%m-%d')}"
-            
-            # Create new document in Drive
-            document = {
-                'name': doc_title,
-                'mimeType': 'application/vnd.google-apps.document',
-            }
-            doc_file = drive_service.files().create(body=document).execute()
-            doc_id = doc_file.get('id')
-            
-            # Prepare content for the document
-            doc_content = {
-                'requests': [
-                    {
-                        'insertText': {
-                            'location': {
-                                'index': 1
-                            },
-                            'text': f"Meeting Notes: {event.get('summary', 'Meeting')}\n\n"
-                                f"Date: {event.get('start', {}).get('dateTime', 'N/A')}\n\n"
-                                f"Attendees: \n\n"
-                                f"Agenda: \n\n"
-                                f"Discussion: \n\n"
-                                f"Action Items: \n\n"
-                        }
-                    }
-                ]
-            }
-            
-            # Update the document
-            docs_service.documents().batchUpdate(documentId=doc_id, body=doc_content).execute()
-            
-            # Update the calendar event with a link to the document
-            event_description = event.get('description', '')
-            doc_link = f"https://docs.google.com/document/d/{doc_id}/edit"
-            updated_description = f"{event_description}\n\nMeeting notes: {doc_link}"
-            
-            event['description'] = updated_description
-            calendar_service.events().update(calendarId='primary', eventId=event_id, body=event).execute()
+            sub = get_current_user().get('sub')
+            today = datetime.datetime.now().strftime('%Y-%m-%d')
+
+            def title_for(event):
+                return f"Notes: {event.get('summary', 'Meeting')} - {today}"
+
+            def text_for(event, title):
+                return (f"Meeting Notes: {event.get('summary', 'Meeting')}\n\n"
+                        f"Date: {event.get('start', {}).get('dateTime', 'N/A')}\n\n"
+                        f"Attendees: \n\n"
+                        f"Agenda: \n\n"
+                        f"Discussion: \n\n"
+                        f"Action Items: \n\n")
+
+            results, timings = linked_notes_workflow(
+                'create_doc_for_event', sub, calendar_service, drive_service, docs_service, event_id,
+                calendar_store.cached_event(sub, event_id), title_for, text_for, 'Meeting notes'
+            ).run()
+            doc_file = results['create_doc']
+            doc_names.put(sub, doc_file['id'], doc_file['name'])
+            calendar_store.invalidate(sub)
+            print(f"create_doc_for_event took {timings['total_ms']} ms: {timings['steps']}")
             
-            return redirect(f"https://docs.google.com/document/d/{doc_id}/edit")
+            return redirect(doc_url(doc_file['id']))
         
+        # Get event details
+        event = google_calls.execute(calendar_service.events().get(calendarId='primary', eventId=event_id),
+                                     user=get_current_user().get('sub'))
         return render_template('create_doc.html', event=event, user=get_current_user())
     
     except Exception as e:
@@ -476,47 +614,9 @@ def slidesync():
             return redirect(url_for('logout'))
             
         # Get current event
-        now = datetime.datetime.utcnow()
-        now_str = now.isoformat() + 'Z'  # 'Z' indicates UTC time
-
         print("Fetching events")
-        # Get events happening now or upcoming (next 24 hours)
-        events_result = calendar_service.events().list(
-            calendarId='primary',
-            timeMin=now_str,
-            timeMax=(now + datetime.timedelta(hours=24)).isoformat() + 'Z',  # Look ahead 24 hours
-            maxResults=5,
-            singleEvents=True,
-            orderBy='startTime',
-            fields='items(id,summary,description,start,end,attachments)'  # Include attachments
-        ).execute()
-
-        events = events_result.get('items', [])
-        current_event = None
-
-        # First check for an event happening right now
-        for event in events:
-            # Check if event is happening now
-            start_time = event.get('start', {}).get('dateTime')
-            end_time = event.get('end', {}).get('dateTime')
-            
-            if start_time and end_time:
-                # Convert to datetime objects, ensuring timezone consistency
-                start_dt = datetime.datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                end_dt = datetime.datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                
-                # Make now timezone-aware for comparison
-                now_aware = now.replace(tzinfo=datetime.timezone.utc)
-                
-                if start_dt <= now_aware <= end_dt:
-                    current_event = event
-                    current_event['status'] = 'in_progress'
-                    break
-
-        # If no event is happening now, take the next upcoming one
-        if not current_event and events:
-            current_event = events[0]  # First upcoming event
-            current_event['status'] = 'upcoming'
+        watch_calendar(user.get('sub'), calendar_service)
+        current_event = calendar_store.current_event(user.get('sub'), calendar_service)
         
         # If there's a current event, check for associated document
         if current_event:
@@ -547,13 +647,9 @@ def slidesync():
                 current_event['has_doc'] = True
                 current_event['doc_id'] = doc_id
                 
-                # Try to get document name
-                try:
-                    doc_info = drive_service.files().get(fileId=doc_id, fields='name').execute()
-                    current_event['doc_name'] = doc_info.get('name', 'Linked Document')
-                except Exception as e:
-                    print(f"Error getting doc info: {e}")
-                    current_event['doc_name'] = 'Linked Document'
+                # Get document name (usually cached from the calendar page)
+                watch_doc(user.get('sub'), drive_service, doc_id)
+                current_event['doc_name'] = doc_names.lookup(user.get('sub'), drive_service, [doc_id])[doc_id]
         
         return render_template('slidesync.html', current_event=current_event, user=user, active_page='slidesync')
     
@@ -562,30 +658,218 @@ def slidesync():
         print(f"Exception in slidesync route: {error_message}")
         return f"<h1>Error</h1><p>{error_message}</p><p><a href='/logout'>Logout and try again</a></p>"
 
+# OCR pipeline shared by the synchronous and job-based modes
+def store_capture(image, slide_hash, owner=None):
+    """Keep the archive rendition of a capture server-side and return its id"""
+    archive_bytes, info = normalize_image(image, ARCHIVE_TARGET)
+    return capture_store.put(owner, archive_bytes, meta={'hash': slide_hash, 'image': info})
+
+def run_slide_ocr(image, slide_hash, owner=None, doc_id=None, on_text=None):
+    """Run OCR on a decoded slide image and build the client response"""
+    result = process_slide_with_cerebras(image, slide_hash, on_text)
+    result['capture_id'] = store_capture(image, slide_hash, owner)
+
+    # Remember the capture so repeats of this slide can skip OCR
+    if doc_id:
+        text = result.get('text') if result.get('ocr_source') else None
+        capture_index.record(owner, doc_id, slide_hash, text=text)
+    return result
+
+def duplicate_capture_result(image, slide_hash, owner, doc_id):
+    """Response for a repeat of a slide already captured for doc_id, or None"""
+    if not doc_id:
+        return None
+    match = capture_index.find(owner, doc_id, slide_hash)
+    if not match or not match['text']:
+        return None
+    capture_index.count_duplicate(saving=False)
+    buffer, _ = normalize_image(image, PREVIEW_TARGET)
+    return {
+        'success': True,
+        'processed_image': f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}",
+        'capture_id': store_capture(image, slide_hash, owner),
+        'text': match['text'],
+        'ocr_source': 'duplicate',
+        'duplicate': True,
+        'already_saved': match['saved'],
+        'save_pending': match['saving']
+    }
+
+def dispatch_ocr(image, mode=None, doc_id=None):
+    """
+    Queue OCR for an image.
+
+    In 'async' mode the job id is returned straight away and the client polls
+    /ocr-jobs/<job_id>; otherwise we wait for the job and return its result.
+    Repeats of a slide already captured for doc_id are answered immediately.
+    """
+    owner = (get_current_user() or {}).get('sub')
+    slide_hash = perceptual_hash(image)
+
+    duplicate = duplicate_capture_result(image, slide_hash, owner, doc_id)
+    if duplicate:
+        return jsonify(duplicate)
+
+    try:
+        job = ocr_queue.submit(run_slide_ocr, image, slide_hash, owner, doc_id, owner=owner)
+    except QueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+
+    if mode == 'async':
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('ocr_job_status', job_id=job.id)
+        }), 202
+
+    job.wait()
+    if job.error:
+        return jsonify({'success': False, 'error': job.error})
+    return jsonify(job.result)
+
+@app.route('/ocr-jobs/<job_id>')
+@login_required
+def ocr_job_status(job_id):
+    """
+    Report the state of an OCR job.
+    Pass ?wait=<seconds> to block until the job finishes (up to 30 seconds).
+    """
+    job = ocr_queue.get(job_id, owner=(get_current_user() or {}).get('sub'))
+    if not job:
+        return jsonify({'success': False, 'error': 'Unknown OCR job'}), 404
+
+    wait = request.args.get('wait', type=float)
+    if wait:
+        job.wait(min(max(wait, 0), 30))
+
+    data = job.to_dict()
+    data['success'] = job.status != 'failed'
+    return jsonify(data)
+
+@app.route('/ocr-stats')
+@login_required
+def ocr_stats():
+    """OCR queue and result cache counters for this worker"""
+    return jsonify({
+        'success': True,
+        'queue': ocr_queue.stats(),
+        'cache': ocr_cache.stats(),
+        'duplicates': capture_index.stats(),
+        'captures': capture_store.stats(),
+        'doc_writes': doc_writer.stats(),
+        'calendar': calendar_store.stats(),
+        'doc_names': doc_names.stats(),
+        'push': push_channels.stats(),
+        'sessions': app.session_interface.stats(),
+        'transport': transport_pool.stats(),
+        'workflows': workflow_stats.stats(),
+        'google_calls': google_calls.stats(),
+        'cerebras': cerebras_stats(),
+        'startup': startup.stats(),
+        'engines': ocr_engine_order(),
+        'preprocessing': {
+            'stages': get_ocr_pipeline().names,
+            'ocr_input': get_ocr_input_stage(),
+            'timings': get_ocr_pipeline().stats()
+        }
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request and outbound-call counters and latency histograms for all workers, for Prometheus"""
+    metrics_token = os.environ.get("METRICS_TOKEN")
+    if metrics_token and not secrets.compare_digest(request.headers.get('Authorization', ''), f"Bearer {metrics_token}"):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/process-slide', methods=['POST'])
 @login_required
 def process_slide():
     try:
-        # Get image data from request
-        data = request.get_json()
-        image_data = data.get('image', '')
-        
-        # Decode base64 image
-        if image_data.startswith('data:image/'):
-            # Extract the base64 part
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Get image data from request (raw binary, multipart or base64 JSON)
+        image, _, params = read_request_image()
+        if image is None:
+            return jsonify({'success': False, 'error': 'No image provided'})
         
         # Process with Cerebras or fallback
-        return jsonify(process_slide_with_cerebras(image))
+        return dispatch_ocr(image, params.get('mode') or request.args.get('mode'), params.get('doc_id'))
     
     except Exception as e:
         print(f"Error processing slide: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+def sse_event(event, data):
+    """One server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/process-slide/stream', methods=['POST'])
+@login_required
+def process_slide_stream():
+    """
+    Streaming variant of /process-slide, as server-sent events.
+
+    'text' events carry partial OCR text ({"delta": ...}) as Cerebras produces
+    it, then a 'result' event carries exactly what /process-slide returns
+    and a 'timing' event the time to first text and to the result in ms.
+    """
+    started = time.perf_counter()
+    try:
+        image, _, params = read_request_image()
+        if image is None:
+            return jsonify({'success': False, 'error': 'No image provided'})
+
+        owner = (get_current_user() or {}).get('sub')
+        doc_id = params.get('doc_id')
+        slide_hash = perceptual_hash(image)
+        deltas = queue.Queue()
+
+        duplicate = duplicate_capture_result(image, slide_hash, owner, doc_id)
+        if duplicate:
+            job = None
+            deltas.put(None)
+        else:
+            def stream_ocr():
+                try:
+                    return run_slide_ocr(image, slide_hash, owner, doc_id, deltas.put)
+                finally:
+                    deltas.put(None)
+            job = ocr_queue.submit(stream_ocr, owner=owner)
+    except QueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except Exception as e:
+        print(f"Error processing slide: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+
+    def events():
+        first_text_ms = None
+        while True:
+            try:
+                delta = deltas.get(timeout=15)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if delta is None:
+                break
+            if first_text_ms is None:
+                first_text_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield sse_event('text', {'delta': delta})
+
+        if job is None:
+            result = duplicate
+        else:
+            job.wait()
+            result = job.result if job.status == DONE else {'success': False, 'error': job.error}
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        yield sse_event('result', result)
+        yield sse_event('timing', {'first_text_ms': first_text_ms, 'total_ms': total_ms})
+        ocr_queue.record_stream(first_text_ms, total_ms)
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # let proxies pass events through unbuffered
+    })
+
 @app.route('/create-slidesync-doc', methods=['POST'])
 @login_required
 def create_slidesync_doc():
@@ -603,65 +887,45 @@ def create_slidesync_doc():
     try:
         data = request.get_json()
         event_id = data.get('event_id')
-        
-        # Default document title
-        doc_title = "SlideSync Captures - " + datetime.datetime.now().strftime('%Y-%m-%d')
-        
-        # If event_id is provided, get the event title for a better doc name
-        if event_id:
-            try:
-                event = calendar_service.events().get(calendarId='primary', eventId=event_id).execute()
-                doc_title = f"SlideSync: {event.get('summary', 'Class')} - {datetime.datetime.now().strftime('%Y-%m-%d')}"
-            except Exception as e:
-                print(f"Error getting event info: {e}")
-        
-        # Create new document in Drive
-        document = {
-            'name': doc_title,
-            'mimeType': 'application/vnd.google-apps.document',
-        }
-        doc_file = drive_service.files().create(body=document).execute()
-        doc_id = doc_file.get('id')
-        
-        # Prepare content for the document
-        doc_content = {
-            'requests': [
-                {
-                    'insertText': {
-                        'location': {
-                            'index': 1
-                        },
-                        'text': f"{doc_title}\n\nCreated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                    }
-                }
-            ]
-        }
-        
-        # Update the document
-        docs_service.documents().batchUpdate(documentId=doc_id, body=doc_content).execute()
-        
-        # If event_id is provided, update the calendar event with a link to the document
+        sub = get_current_user().get('sub')
+        today = datetime.datetime.now().strftime('%Y-%m-%d')
+
+        # Name the document after the event when there is one
+        def title_for(event):
+            if event:
+                return f"SlideSync: {event.get('summary', 'Class')} - {today}"
+            return "SlideSync Captures - " + today
+
+        def text_for(event, title):
+            return f"{title}\n\nCreated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+
         if event_id:
-            try:
-                event = calendar_service.events().get(calendarId='primary', eventId=event_id).execute()
-                event_description = event.get('description', '')
-                doc_link = f"https://docs.google.com/document/d/{doc_id}/edit"
-                
-                if event_description:
-                    updated_description = f"{event_description}\n\nSlideSync notes: {doc_link}"
-                else:
-                    updated_description = f"SlideSync notes: {doc_link}"
-                
-                event['description'] = updated_description
-                calendar_service.events().update(calendarId='primary', eventId=event_id, body=event).execute()
-            except Exception as e:
-                print(f"Error updating event: {e}")
+            # Reading or linking the event may fail; the document is still created
+            flow = linked_notes_workflow(
+                'create_slidesync_doc', sub, calendar_service, drive_service, docs_service, event_id,
+                calendar_store.cached_event(sub, event_id), title_for, text_for, 'SlideSync notes',
+                required=False
+            )
+        else:
+            flow = Workflow('create_slidesync_doc')
+            flow.step('create_doc', lambda: create_notes_doc(sub, drive_service, title_for(None)))
+            flow.step('write_text', lambda create_doc: insert_doc_text(
+                sub, docs_service, create_doc['id'], text_for(None, create_doc['name'])
+            ), after=('create_doc',))
+
+        results, timings = flow.run()
+        doc_id = results['create_doc']['id']
+        doc_title = results['create_doc']['name']
+        doc_names.put(sub, doc_id, doc_title)
+        if results.get('link_event') is not None:
+            calendar_store.invalidate(sub)
         
         return jsonify({
             'success': True,
             'doc_id': doc_id,
             'doc_name': doc_title,
-            'doc_url': f"https://docs.google.com/document/d/{doc_id}/edit"
+            'doc_url': doc_url(doc_id),
+            'timings': timings
         })
     
     except Exception as e:
@@ -696,14 +960,131 @@ def upload_image():
             image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
             
             # Process with Cerebras or fallback
-            result = process_slide_with_cerebras(image)
-            
-            return jsonify(result)
+            return dispatch_ocr(image, request.form.get('mode') or request.args.get('mode'), request.form.get('doc_id'))
     
     except Exception as e:
         print(f"Error processing uploaded image: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+# Helper function to read a capture from the request body
+def read_request_image():
+    """
+    Read the slide image from the current request.
+
+    Accepts a raw image body (Content-Type image/* or application/octet-stream),
+    a form with an optional 'image' file part, or the original JSON body with
+    a base64 data URL in 'image'. Binary bodies are decoded straight from the
+    request buffer without a base64 round trip.
+
+    Returns:
+        (image, image_bytes, params) where image is the decoded OpenCV image
+        (None if nothing usable was sent), image_bytes the encoded bytes and
+        params the remaining request fields
+    """
+    mimetype = request.mimetype or ''
+
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        image_bytes = request.get_data(cache=False)
+        params = request.args
+    elif mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        file = request.files.get('image')
+        image_bytes = file.read() if file else b''
+        params = request.form
+    else:
+        params = request.get_json() or {}
+        image_data = params.get('image', '')
+        if image_data.startswith('data:image/'):
+            # Extract the base64 part
+            image_data = image_data.split(',')[1]
+        image_bytes = base64.b64decode(image_data) if image_data else b''
+
+    if not image_bytes:
+        return None, b'', params
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    return image, image_bytes, params
+
+def append_text_request(text):
+    """Docs batchUpdate request that appends text at the end of the body"""
+    return {
+        'insertText': {
+            'endOfSegmentLocation': {},
+            'text': text
+        }
+    }
+
+def upload_capture_image(owner, drive_service, image, image_bytes):
+    """
+    Upload a capture to Drive and make it readable by Google Docs
+    
+    Args:
+        drive_service: Drive API service for the current user
+        image: Decoded OpenCV image, or None when image_bytes is already normalized
+        image_bytes: Encoded image bytes
+    
+    Returns:
+        Direct image URL that can be embedded in a document
+    """
+    # Store a downscaled JPEG rather than the full camera frame
+    if image is not None:
+        image_bytes, _ = normalize_image(image, ARCHIVE_TARGET)
+    
+    # Upload image to Drive
+    file_metadata = {
+        'name': f'Slide_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg',
+        'mimeType': 'image/jpeg'
+    }
+    
+    media = googleapiclient_http.MediaInMemoryUpload(
+        image_bytes,
+        mimetype='image/jpeg',
+        resumable=True
+    )
+    
+    file = google_calls.execute(drive_service.files().create(
+        body=file_metadata,
+        media_body=media,
+        fields='id,webContentLink'
+    ), user=owner)
+    
+    image_file_id = file.get('id')
+    
+    # Change permissions to make it accessible to Google Docs
+    google_calls.execute(drive_service.permissions().create(
+        fileId=image_file_id,
+        body={'type': 'anyone', 'role': 'reader'},
+        fields='id'
+    ), user=owner)
+    
+    # Use a direct Drive image URL that works with Docs
+    return f"https://drive.google.com/uc?export=view&id={image_file_id}"
+
+def capture_image_requests(owner, drive_service, image, image_bytes):
+    """Docs requests that insert a capture's image, or a note if it could not be uploaded"""
+    try:
+        image_url = upload_capture_image(owner, drive_service, image, image_bytes)
+    except Exception as img_error:
+        print(f"Error saving image: {str(img_error)}")
+        # Add text note about image error
+        return [append_text_request(
+            "\n[Image could not be saved due to an error. Please try again or manually add the image.]\n\n"
+        )]
+    return [{
+        'insertInlineImage': {
+            'endOfSegmentLocation': {},
+            'uri': image_url,
+            'objectSize': {
+                'width': {
+                    'magnitude': 500,
+                    'unit': 'PT'
+                }
+            }
+        }
+    }]
+
+# Drive uploads for saved captures, run while their text waits in doc_writer
+save_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("SAVE_UPLOAD_WORKERS", 8)))
+
 @app.route('/save-to-doc', methods=['POST'])
 @login_required
 def save_to_doc():
@@ -714,133 +1095,104 @@ def save_to_doc():
         return jsonify({'success': False, 'error': 'Failed to initialize Google services'})
     
     try:
-        # Get data from request
-        data = request.get_json()
-        image_data = data.get('image', '')
+        # Get data from request (raw binary, multipart or base64 JSON)
+        image, image_bytes, data = read_request_image()
         text = data.get('text', '')
         doc_id = data.get('doc_id', '')
         
         if not doc_id:
             return jsonify({'success': False, 'error': 'No document ID provided'})
         
-        # Get the document's current content to find the end
-        document = docs_service.documents().get(documentId=doc_id).execute()
-        doc_end_index = document['body']['content'][-1]['endIndex'] - 1  # -1 to account for the trailing newline
+        owner = (get_current_user() or {}).get('sub')
+        slide_hash = perceptual_hash(image) if image is not None else None
+        
+        # Use the capture kept on the server when the client sends its id
+        capture_id = data.get('capture_id')
+        if capture_id and not image_bytes:
+            capture = capture_store.get(capture_id, owner)
+            if capture is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Capture expired, please send the image again',
+                    'error_code': 'capture_expired'
+                })
+            image_bytes = capture['data']
+            slide_hash = capture['meta'].get('hash')
+        
+        # Skip slides that were already saved, or are waiting to be written, to this document
+        force = str(data.get('force', '')).lower() in ('1', 'true')
+        if slide_hash is not None and not force:
+            match = capture_index.find(owner, doc_id, slide_hash)
+            if match and (match['saved'] or match['saving']):
+                capture_index.count_duplicate(saving=True)
+                return jsonify({'success': True, 'duplicate': True, 'skipped': True, 'pending': match['saving']})
         
         # Create timestamp for this capture
         timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # Create requests array starting with timestamp header
-        requests = [
-            {
-                'insertText': {
-                    'location': {
-                        'index': doc_end_index
-                    },
-                    'text': f"\n\n## Slide captured on {timestamp}\n\n"
-                }
-            }
-        ]
-        
-        # Add extracted text if available
+        # Everything is appended at the end of the body, so captures buffered
+        # for the same document can go out together in one batchUpdate
+        text_block = f"\n\n## Slide captured on {timestamp}\n\n"
         if text and text.strip():
-            requests.append({
-                'insertText': {
-                    'location': {
-                        'index': doc_end_index + 2 + len(f"## Slide captured on {timestamp}\n\n")
-                    },
-                    'text': f"{text}\n\n"
-                }
-            })
+            text_block += f"{text}\n\n"
+        requests = [append_text_request(text_block)]
         
-        # Try to save the image if provided
-        if image_data:
-            try:
-                # Decode base64 image
-                if image_data.startswith('data:image/'):
-                    # Extract the base64 part
-                    content_type = image_data.split(';')[0].split(':')[1]
-                    image_data = image_data.split(',')[1]
-                
-                image_bytes = base64.b64decode(image_data)
-                
-                # Upload image to Drive
-                file_metadata = {
-                    'name': f'Slide_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg',
-                    'mimeType': 'image/jpeg'
-                }
-                
-                media = MediaInMemoryUpload(
-                    image_bytes,
-                    mimetype='image/jpeg',
-                    resumable=True
-                )
-                
-                file = drive_service.files().create(
-                    body=file_metadata,
-                    media_body=media,
-                    fields='id,webContentLink'
-                ).execute()
-                
-                image_file_id = file.get('id')
-                
-                # Change permissions to make it accessible to Google Docs
-                drive_service.permissions().create(
-                    fileId=image_file_id,
-                    body={'type': 'anyone', 'role': 'reader'},
-                    fields='id'
-                ).execute()
-                
-                # Use a direct Drive image URL that works with Docs
-                image_url = f"https://drive.google.com/uc?export=view&id={image_file_id}"
-                
-                # Add image to the document
-                text_end_index = doc_end_index + 2 + len(f"## Slide captured on {timestamp}\n\n")
-                if text and text.strip():
-                    text_end_index += len(text) + 2
-                
-                requests.append({
-                    'insertInlineImage': {
-                        'location': {
-                            'index': text_end_index
-                        },
-                        'uri': image_url,
-                        'objectSize': {
-                            'width': {
-                                'magnitude': 500,
-                                'unit': 'PT'
-                            }
-                        }
-                    }
-                })
-            except Exception as img_error:
-                print(f"Error saving image: {str(img_error)}")
-                # Add text note about image error
-                text_end_index = doc_end_index + 2 + len(f"## Slide captured on {timestamp}\n\n")
-                if text and text.strip():
-                    text_end_index += len(text) + 2
-                
-                requests.append({
-                    'insertText': {
-                        'location': {
-                            'index': text_end_index
-                        },
-                        'text': "\n[Image could not be saved due to an error. Please try again or manually add the image.]\n\n"
-                    }
-                })
+        # The image uploads to Drive while the text is already buffered; the
+        # flush waits for it so the image lands right after its text
+        image_requests = None
+        if image_bytes:
+            image_requests = save_executor.submit(capture_image_requests, owner, drive_service, image, image_bytes)
+        
+        # Hand the inserts to the write-behind buffer; it flushes them with
+        # other captures for this document
+        flush_status = doc_writer.enqueue(owner, doc_id, requests, get_credentials(),
+                                          meta={'hash': slide_hash, 'text': text or None},
+                                          attachment=image_requests)
         
-        # Execute the batch update
-        docs_service.documents().batchUpdate(
-            documentId=doc_id,
-            body={'requests': requests}
-        ).execute()
+        # Marked saved once the buffer has written it (see record_doc_write)
+        if slide_hash is not None:
+            capture_index.record(owner, doc_id, slide_hash, text=text or None, saving=True)
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'queued': True, 'flush': flush_status})
     
     except Exception as e:
         print(f"Error saving to document: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/doc-writes/<doc_id>')
+@login_required
+def doc_write_status(doc_id):
+    """Captures still buffered for a notes document and the last flush outcome"""
+    owner = get_current_user().get('sub')
+    # Lets this worker flush captures recovered from the journal after a restart
+    doc_writer.attach(owner, get_credentials())
+    return jsonify({'success': True, **doc_writer.status(owner, doc_id)})
+
+@app.route('/doc-writes/<doc_id>/flush', methods=['POST'])
+@login_required
+def flush_doc_writes(doc_id):
+    """Write buffered captures now, e.g. when the user ends a SlideSync session"""
+    owner = get_current_user().get('sub')
+    doc_writer.attach(owner, get_credentials())
+    try:
+        flushed = doc_writer.flush(owner, doc_id)
+    except DocWriteFailed as e:
+        return jsonify({'success': False, 'error': str(e), 'error_code': 'write_failed',
+                        **doc_writer.status(owner, doc_id)})
+    except Exception as e:
+        print(f"Error flushing notes document {doc_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e), **doc_writer.status(owner, doc_id)})
+    return jsonify({'success': True, 'flushed': flushed, **doc_writer.status(owner, doc_id)})
+
+@app.route('/notifications/google', methods=['POST'])
+def google_notification():
+    """Receiver for Calendar and Drive push channel notifications"""
+    outcome = push_channels.handle_notification(request.headers)
+    if outcome == 'ignored':
+        print(f"Ignored push notification for channel {request.headers.get('X-Goog-Channel-ID')}")
+    # Always acknowledge; Google retries anything else with backoff
+    return '', 200
+
 @app.route('/about')
 def about():
     user = get_current_user()
@@ -883,73 +1235,45 @@ def create_event_and_doc():
         print(f"Formatted start time: {start_time}")
         print(f"Formatted end time: {end_time}")
         
-        # Create event in Google Calendar
-        event = {
-            'summary': data['name'],
-            'start': {
-                'dateTime': start_time,
-                'timeZone': 'UTC',  # Use UTC for consistency
-            },
-            'end': {
-                'dateTime': end_time,
-                'timeZone': 'UTC',  # Use UTC for consistency
-            },
-        }
-        
-        created_event = calendar_service.events().insert(
-            calendarId='primary',
-            body=event
-        ).execute()
-        
-        # Create a new Google Doc
+        sub = get_current_user().get('sub')
         doc_title = f"{data['name']} Notes - {datetime.datetime.now().strftime('%Y-%m-%d')}"
-        doc_metadata = {
-            'name': doc_title,
-            'mimeType': 'application/vnd.google-apps.document',
-        }
-        
-        doc = drive_service.files().create(body=doc_metadata).execute()
-        doc_id = doc.get('id')
-        
-        # Add initial content to the document
-        docs_service.documents().batchUpdate(
-            documentId=doc_id,
-            body={
-                'requests': [
-                    {
-                        'insertText': {
-                            'location': {
-                                'index': 1,
-                            },
-                            'text': f"# {data['name']}\nDate: {datetime.datetime.now().strftime('%Y-%m-%d')}\n\n"
-                        }
-                    }
-                ]
+
+        def insert_event(create_doc):
+            # The event is created with the notes link already in its description
+            event = {
+                'summary': data['name'],
+                'description': linked_description('', 'SlideSync notes', create_doc['id']),
+                'start': {
+                    'dateTime': start_time,
+                    'timeZone': 'UTC',  # Use UTC for consistency
+                },
+                'end': {
+                    'dateTime': end_time,
+                    'timeZone': 'UTC',  # Use UTC for consistency
+                },
             }
-        ).execute()
-        
-        # Link the document to the event
-        event_description = created_event.get('description', '')
-        doc_link = f"https://docs.google.com/document/d/{doc_id}/edit"
-        
-        if event_description:
-            updated_description = f"{event_description}\n\nSlideSync notes: {doc_link}"
-        else:
-            updated_description = f"SlideSync notes: {doc_link}"
-        
-        created_event['description'] = updated_description
-        calendar_service.events().update(
-            calendarId='primary', 
-            eventId=created_event['id'], 
-            body=created_event
-        ).execute()
+            return google_calls.execute(calendar_service.events().insert(calendarId='primary', body=event), user=sub)
+
+        # Create the doc first; its text and the linked event are then written concurrently
+        flow = Workflow('create_event_and_doc')
+        flow.step('create_doc', lambda: create_notes_doc(sub, drive_service, doc_title))
+        flow.step('write_text', lambda create_doc: insert_doc_text(
+            sub, docs_service, create_doc['id'], f"# {data['name']}\nDate: {datetime.datetime.now().strftime('%Y-%m-%d')}\n\n"
+        ), after=('create_doc',))
+        flow.step('insert_event', insert_event, after=('create_doc',))
+
+        results, timings = flow.run()
+        doc_id = results['create_doc']['id']
+        doc_names.put(sub, doc_id, doc_title)
+        calendar_store.invalidate(sub)
         
         # Return success with created event and doc info
         return jsonify({
             'success': True,
-            'event': created_event,
+            'event': results['insert_event'],
             'doc_id': doc_id,
-            'doc_url': f"https://docs.google.com/document/d/{doc_id}/edit"
+            'doc_url': doc_url(doc_id),
+            'timings': timings
         })
         
     except Exception as e:
@@ -984,6 +1308,16 @@ def google_images(filename):
     # This route can serve Google button images from a local directory
     return send_from_directory('static/img/google', filename)
 
+# Work the first capture or sign-in would otherwise do, run by the worker's
+# warm-up (see gunicorn.conf.py) once it is accepting requests
+startup.on_warm_up('discovery documents', lambda: [
+    get_discovery_document(api_name, api_version)
+    for api_name, api_version in (('calendar', 'v3'), ('drive', 'v3'), ('docs', 'v1'), ('people', 'v1'))
+])
+startup.on_warm_up('ocr pipeline', get_ocr_pipeline)
+
+startup.app_ready()
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,251 @@
+"""
+Benchmark: how many concurrent captures one SlideSync instance can serve.
+
+Starts gunicorn with the shipped gunicorn.conf.py (gthread workers) and, for
+comparison, with default sync workers. Cerebras is replaced by a local stand-in
+that answers every OCR call after --ocr-latency seconds, so the numbers show
+how the server overlaps waiting on the OCR API rather than the API's speed.
+For each concurrency level, that many clients post distinct camera frames to
+/process-slide back to back for --duration seconds.
+
+Reported per level: captures per second, p50/p95 latency, and the mean number
+of captures in flight (throughput x mean latency). A level "holds" when its
+p95 stays within --slo times the single-client latency; the highest such
+level is the instance's concurrent capture capacity.
+
+Usage:
+    python benchmarks/bench_concurrency.py [--workers 1 --threads 16 --levels 1,4,8,16,32]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_upload_paths import SECRET_KEY, free_port, session_cookie  # noqa: E402
+
+
+class FakeCerebras(BaseHTTPRequestHandler):
+    """
+    Answers chat completions (and the SDK's warm-up request) after a fixed delay
+
+    Streamed completions send their first word after first_token seconds and
+    the rest spread over the remaining latency.
+    """
+    latency = 0.5
+    first_token = 0.1
+    text = 'Lecture 5: Dynamic programming'
+
+    def do_GET(self):
+        self._reply({})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if request.get('stream'):
+            return self._stream()
+        time.sleep(self.latency)
+        self._reply({
+            'id': 'bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': 'llama3.1-8b',
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': self.text}}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        })
+
+    def _stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        words = self.text.split(' ')
+        time.sleep(self.first_token)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep((self.latency - self.first_token) / (len(words) - 1))
+            chunk = {
+                'id': 'bench', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': 'llama3.1-8b',
+                'system_fingerprint': 'bench',
+                'choices': [{'index': 0, 'finish_reason': None,
+                             'delta': {'role': 'assistant', 'content': word if i == 0 else ' ' + word}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_frames(count, width, height):
+    """Distinct JPEG slides: text blocks at random positions so no two hash alike"""
+    rng = np.random.default_rng(1)
+    frames = []
+    for _ in range(count):
+        img = np.full((height, width, 3), 245, np.uint8)
+        for _ in range(8):
+            x, y = int(rng.integers(0, width - 200)), int(rng.integers(30, height - 10))
+            cv2.putText(img, 'slide text', (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (30, 30, 30), 2)
+        frames.append(cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes())
+    return frames
+
+
+def start_server(mode, port, env, workers, threads, output=None):
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    if mode == 'gthread':
+        command += ['-c', 'gunicorn.conf.py', '--threads', str(threads)]
+    else:
+        # Default sync workers, as the app was deployed before gunicorn.conf.py
+        command += ['-c', '/dev/null', '--worker-class', 'sync']
+    command.append('app:app')
+    output = output or subprocess.DEVNULL
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=output, stderr=output)
+    for _ in range(300):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def post(port, cookie, body):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('POST', '/process-slide', body=body, headers={
+        'Content-Type': 'image/jpeg',
+        'Cookie': f'session={cookie}',
+    })
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response.status
+
+
+def run_level(port, cookie, frames, clients, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        n = index
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status = post(port, cookie, frames[n % len(frames)])
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+            n += clients
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    throughput = len(latencies) / wall
+    mean = sum(latencies) / len(latencies) if latencies else 0.0
+    return {
+        'clients': clients,
+        'captures': len(latencies),
+        'errors': errors[0],
+        'captures_per_s': round(throughput, 2),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+        'in_flight': round(throughput * mean, 1),
+    }
+
+
+def run_mode(mode, args, frames, cerebras_url):
+    port = free_port()
+    session_db = os.path.join(tempfile.mkdtemp(prefix='bench-sessions-'), 'sessions.sqlite3')
+    env = dict(
+        os.environ,
+        SECRET_KEY=SECRET_KEY,
+        SESSION_BACKEND='sqlite',
+        SESSION_DB=session_db,
+        CEREBRAS_API_KEY='bench',
+        CEREBRAS_BASE_URL=cerebras_url,
+        OCR_ENGINE='cerebras',
+        OCR_CACHE_MAX_DISTANCE='-1',  # every capture goes to OCR
+        CAPTURE_STORE_DIR=tempfile.mkdtemp(prefix='bench-captures-'),
+    )
+    server = start_server(mode, port, env, args.workers, args.threads)
+    try:
+        cookie = session_cookie(session_db)
+        post(port, cookie, frames[0])  # warm-up
+        levels = [run_level(port, cookie, frames, clients, args.duration) for clients in args.levels]
+    finally:
+        server.terminate()
+        server.wait()
+
+    single = levels[0]['p50_ms'] or 0.0
+    holding = [r['clients'] for r in levels if r['errors'] == 0 and r['p95_ms'] and r['p95_ms'] <= single * args.slo]
+    return {'mode': mode, 'levels': levels, 'capacity': max(holding) if holding else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='threads per gthread worker')
+    parser.add_argument('--levels', default='1,4,8,16,32', help='comma-separated client counts')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per level')
+    parser.add_argument('--ocr-latency', type=float, default=0.5, help='seconds the Cerebras stand-in takes')
+    parser.add_argument('--slo', type=float, default=2.0, help='p95 limit as a multiple of single-client p50')
+    parser.add_argument('--modes', default='sync,gthread')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+    args.levels = [int(n) for n in args.levels.split(',')]
+
+    FakeCerebras.latency = args.ocr_latency
+    cerebras = ThreadingHTTPServer(('127.0.0.1', 0), FakeCerebras)
+    cerebras.daemon_threads = True
+    threading.Thread(target=cerebras.serve_forever, daemon=True).start()
+    cerebras_url = f'http://127.0.0.1:{cerebras.server_address[1]}'
+
+    frames = make_frames(64, 1280, 720)
+    results = [run_mode(mode, args, frames, cerebras_url) for mode in args.modes.split(',')]
+    cerebras.shutdown()
+
+    if args.json:
+        print(json.dumps({'workers': args.workers, 'threads': args.threads, 'ocr_latency': args.ocr_latency,
+                          'results': results}, indent=2))
+        return
+
+    print(f"{args.workers} worker(s), OCR latency {args.ocr_latency}s, {args.duration}s per level")
+    for result in results:
+        print(f"\n{result['mode']}: holds {result['capacity']} concurrent captures "
+              f"(p95 <= {args.slo}x single-client p50)")
+        print(f"{'clients':>8}{'captures/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'in flight':>11}{'errors':>8}")
+        for r in result['levels']:
+            print(f"{r['clients']:>8}{r['captures_per_s']:>12}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+                  f"{r['in_flight']:>11}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Benchmark: where does each buffered capture end up when Docs fails?
+
+Runs doc_writer's flush against tools/fake_google_quota.py, whose documents
+keep the text inserted into them, and checks what happens to every capture
+in three cases:
+
+- rejected-image: of three captures, the second inserts an image Docs cannot
+  fetch, so the batch is refused with 400. The first and third are written
+  once, the second is moved to the dead-letter table, and the flush raises
+  DocWriteFailed.
+- applied-timeout: Docs carries out the batchUpdate but the answer does not
+  arrive before the transport times out. The captures stay buffered, marked
+  uncertain; the next flush finds them in the document and does not send
+  them again.
+- lost-timeout: the batchUpdate times out without being carried out. The
+  next flush does not find the capture in the document and sends it again.
+
+The report lists, per case, how each flush ended, how many copies of each
+capture's text the document holds, and what is left in the journal. The exit
+status is 1 if a check fails.
+
+Usage:
+    python benchmarks/bench_doc_writes.py [--timeout 1]
+    python benchmarks/bench_doc_writes.py --json --output doc-writes.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+from bench_upload_paths import free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import fake_google_quota  # noqa: E402
+
+
+def capture(doc_id, n, image_uri=None):
+    """Docs requests for one capture, as save_to_doc builds them"""
+    requests = [{'insertText': {'endOfSegmentLocation': {},
+                                'text': f"\n\n## Slide captured on 2026-10-18 10:00:0{n}\n\n{doc_id} slide {n}\n\n"}}]
+    if image_uri:
+        requests.append({'insertInlineImage': {'endOfSegmentLocation': {}, 'uri': image_uri}})
+    return requests
+
+
+def copies(doc_id, count):
+    """How many times each capture's text is in the fake document"""
+    with fake_google_quota.documents_lock:
+        text = fake_google_quota.documents.get(doc_id, '')
+    return [text.count(f"{doc_id} slide {n}\n") for n in range(1, count + 1)]
+
+
+def journal(path, doc_id):
+    """Captures of a document still pending (and how many are uncertain) or dead-lettered"""
+    with sqlite3.connect(path) as db:
+        pending, uncertain = db.execute(
+            "SELECT COUNT(*), COUNT(uncertain) FROM pending_writes WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        failed = [json.loads(meta)['n'] for meta, in db.execute(
+            "SELECT meta FROM failed_writes WHERE doc_id = ? ORDER BY id", (doc_id,)
+        )]
+    return {'pending': pending, 'uncertain': uncertain, 'failed': failed}
+
+
+def flush(buffer, owner, doc_id):
+    try:
+        return f"wrote {buffer.flush(owner, doc_id)}"
+    except Exception as e:
+        return type(e).__name__
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--timeout', type=float, default=1.0, help='transport timeout (HTTP_TIMEOUT) in seconds')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    port = free_port()
+    os.environ['GOOGLE_API_ROOT'] = f'http://127.0.0.1:{port}/'
+    os.environ['HTTP_TIMEOUT'] = str(args.timeout)
+    os.environ['GOOGLE_RATE_LIMITS'] = 'docs=100:100'  # the buckets are checked by bench_google_retries.py
+    server = fake_google_quota.serve(port=port, rate=100, burst=100, stall=args.timeout + 2)
+
+    from google.oauth2.credentials import Credentials
+    from doc_writer import DocWriteBuffer, WRITTEN, FAILED
+
+    path = os.path.join(tempfile.mkdtemp(), 'doc-writes.sqlite3')
+    buffer = DocWriteBuffer(path=path, max_batch=100, max_delay=3600)
+    outcomes = {WRITTEN: [], FAILED: []}
+    for kind in outcomes:
+        buffer.on_outcome(kind, lambda owner, doc_id, meta, kind=kind: outcomes[kind].append((doc_id, meta['n'])))
+    owner = 'bench-user'
+    credentials = Credentials(token='token-doc-writes')
+
+    def inject(fault):
+        with fake_google_quota.FakeGoogle.stats_lock:
+            fake_google_quota.FakeGoogle.faults.setdefault('docs', []).append(fault)
+
+    def result(doc_id, count, flushes):
+        return {
+            'flushes': flushes,
+            'copies': copies(doc_id, count),
+            'journal': journal(path, doc_id),
+            'written': [n for d, n in outcomes[WRITTEN] if d == doc_id],
+            'failed': [n for d, n in outcomes[FAILED] if d == doc_id],
+        }
+
+    cases = {}
+    failures = []
+
+    def check(name, condition, message):
+        if not condition:
+            failures.append(f"{name}: {message}")
+
+    try:
+        doc_id = 'rejected-image'
+        for n in (1, 2, 3):
+            image = 'http://unreachable.invalid/slide.jpg' if n == 2 else None
+            buffer.enqueue(owner, doc_id, capture(doc_id, n, image), credentials, meta={'n': n})
+        case = cases[doc_id] = result(doc_id, 3, [flush(buffer, owner, doc_id)])
+        check(doc_id, case['flushes'] == ['DocWriteFailed'], f"flush ended {case['flushes']}")
+        check(doc_id, case['copies'] == [1, 0, 1], f"document holds {case['copies']} copies of captures 1-3")
+        check(doc_id, case['journal'] == {'pending': 0, 'uncertain': 0, 'failed': [2]},
+              f"journal is {case['journal']}")
+        check(doc_id, (case['written'], case['failed']) == ([1, 3], [2]),
+              f"listeners heard written {case['written']}, failed {case['failed']}")
+        check(doc_id, '400' in (buffer.status(owner, doc_id).get('last_failure') or ''),
+              "status() does not report the 400")
+
+        doc_id = 'applied-timeout'
+        for n in (1, 2):
+            buffer.enqueue(owner, doc_id, capture(doc_id, n), credentials, meta={'n': n})
+        inject('applied-timeout')
+        flushes = [flush(buffer, owner, doc_id)]
+        after_timeout = journal(path, doc_id)
+        found_before = buffer.stats()['found_written']
+        flushes.append(flush(buffer, owner, doc_id))
+        case = cases[doc_id] = dict(result(doc_id, 2, flushes), after_timeout=after_timeout,
+                                    found_written=buffer.stats()['found_written'] - found_before)
+        check(doc_id, flushes == ['ReadTimeout', 'wrote 2'], f"flushes ended {flushes}")
+        check(doc_id, after_timeout == {'pending': 2, 'uncertain': 2, 'failed': []},
+              f"journal after the timeout is {after_timeout}")
+        check(doc_id, case['copies'] == [1, 1], f"document holds {case['copies']} copies of captures 1-2")
+        check(doc_id, case['found_written'] == 2, f"{case['found_written']} captures found already written")
+        check(doc_id, case['journal']['pending'] == 0, f"journal is {case['journal']}")
+
+        doc_id = 'lost-timeout'
+        buffer.enqueue(owner, doc_id, capture(doc_id, 1), credentials, meta={'n': 1})
+        inject('lost-timeout')
+        flushes = [flush(buffer, owner, doc_id)]
+        after_timeout = journal(path, doc_id)
+        flushes.append(flush(buffer, owner, doc_id))
+        case = cases[doc_id] = dict(result(doc_id, 1, flushes), after_timeout=after_timeout)
+        check(doc_id, flushes == ['ReadTimeout', 'wrote 1'], f"flushes ended {flushes}")
+        check(doc_id, after_timeout == {'pending': 1, 'uncertain': 1, 'failed': []},
+              f"journal after the timeout is {after_timeout}")
+        check(doc_id, case['copies'] == [1], f"document holds {case['copies']} copies of the capture")
+        check(doc_id, case['journal']['pending'] == 0, f"journal is {case['journal']}")
+    finally:
+        server.shutdown()
+
+    report = {'config': {'timeout': args.timeout}, 'cases': cases, 'failures': failures}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'case':<18}{'flushes':<30}{'copies':<12}{'pending':<9}{'dead-lettered'}")
+        for name, case in cases.items():
+            print(f"{name:<18}{', '.join(case['flushes']):<30}{str(case['copies']):<12}"
+                  f"{case['journal']['pending']:<9}{case['journal']['failed']}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+"""
+Benchmark: whole lecture sessions against local Google and Cerebras stand-ins.
+
+Starts the app under gunicorn (gunicorn.conf.py) with tools/fake_google_quota.py
+standing in for Calendar, Drive, Docs, People and Google sign-in, and the
+Cerebras stand-in from bench_concurrency.py, each answering after a
+configurable delay. Every simulated student:
+
+1. signs in through /login (authorization, code exchange, userinfo, People);
+2. opens /slidesync, which loads the current lecture and its notes document;
+3. captures --captures slides: /process-slide, then /save-to-doc with the
+   returned capture id. --repeat-rate of the captures photograph the previous
+   slide again, as when the lecturer stays on it: the same frame moved by a few
+   pixels, rotated by up to a degree or zoomed by up to 2%, then re-encoded;
+4. flushes the buffered notes with /doc-writes/<doc_id>/flush.
+
+--users students run at once. The report holds per-step counts, errors and
+p50/p95/p99 latency, captures and requests per second, server memory (summed
+RSS of the gunicorn processes, sampled) and the outbound calls the server
+made, taken from /metrics. It is printed as JSON with --json or written to
+--output. With --baseline, an earlier report is compared and the exit status
+is 1 when a p95, the throughput or peak memory got worse by more than
+--tolerance.
+
+The report also counts how many repeats the app answered as duplicates;
+the exit status is 1 when fewer than --min-repeat-match of them were.
+
+Usage:
+    python benchmarks/bench_e2e.py [--users 8 --captures 10 --google-latency 0.05 --ocr-latency 0.5]
+    python benchmarks/bench_e2e.py --output report.json
+    python benchmarks/bench_e2e.py --baseline report.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import requests
+
+from bench_concurrency import ROOT, FakeCerebras, make_frames, start_server
+from bench_image_hash import move
+from bench_upload_paths import SECRET_KEY, free_port
+
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+import fake_google_quota  # noqa: E402
+
+STEPS = ('login', 'slidesync', 'process_slide', 'save_to_doc', 'flush')
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.error_samples = []
+        self.repeats = 0
+        self.repeats_matched = 0
+        self._lock = threading.Lock()
+
+    def timed(self, step, call):
+        """Run call(), which returns (ok, value), and record its latency under step"""
+        started = time.perf_counter()
+        try:
+            ok, value = call()
+        except requests.RequestException as e:
+            ok, value = False, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[step].append(elapsed)
+            if not ok:
+                self.errors[step] += 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(f"{step}: {str(value)[:200]}")
+        return value if ok else None
+
+    def repeat(self, matched):
+        with self._lock:
+            self.repeats += 1
+            self.repeats_matched += bool(matched)
+
+
+def recapture(frame, rng):
+    """The JPEG frame photographed again: slightly moved, rotated or zoomed"""
+    image = cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR)
+    kind = rng.choice(('shift', 'rotate', 'zoom'))
+    if kind == 'shift':
+        image = move(image, dx=rng.uniform(-5, 5), dy=rng.uniform(-5, 5))
+    elif kind == 'rotate':
+        image = move(image, angle=rng.uniform(-1, 1))
+    else:
+        image = move(image, scale=rng.uniform(0.98, 1.02))
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+def json_result(response):
+    if response.status_code != 200:
+        return False, f"HTTP {response.status_code}"
+    data = response.json()
+    return bool(data.get('success')), data if data.get('success') else data.get('error')
+
+
+def lecture_session(base, frames, args, recorder, rng):
+    """One student: sign in, open SlideSync, capture and save slides, flush the notes"""
+    client = requests.Session()
+    doc_id = fake_google_quota.LECTURE_DOC_ID
+
+    def login():
+        # /login -> fake authorization endpoint -> /authorize -> home page
+        response = client.get(f"{base}/login", timeout=60)
+        return response.status_code == 200 and response.url.rstrip('/') == base, response.url
+
+    def open_slidesync():
+        response = client.get(f"{base}/slidesync", timeout=60, allow_redirects=False)
+        ok = response.status_code == 200 and doc_id in response.text and '<h1>Error</h1>' not in response.text
+        return ok, f"HTTP {response.status_code}"
+
+    if recorder.timed('login', login) is None:
+        return
+    recorder.timed('slidesync', open_slidesync)
+
+    frame = None
+    for frame_index in range(args.captures):
+        repeat = frame is not None and rng.random() < args.repeat_rate
+        frame = recapture(frame, rng) if repeat else frames.pop()
+        capture = recorder.timed('process_slide', lambda: json_result(client.post(
+            f"{base}/process-slide", params={'doc_id': doc_id}, data=frame,
+            headers={'Content-Type': 'image/jpeg'}, timeout=120)))
+        if capture is None:
+            continue
+        if repeat:
+            recorder.repeat(capture.get('duplicate'))
+        if not capture.get('already_saved'):
+            recorder.timed('save_to_doc', lambda: json_result(client.post(
+                f"{base}/save-to-doc", json={'doc_id': doc_id, 'capture_id': capture['capture_id'],
+                                             'text': capture.get('text', '')}, timeout=120)))
+        if args.think_time:
+            time.sleep(args.think_time)
+
+    recorder.timed('flush', lambda: json_result(client.post(f"{base}/doc-writes/{doc_id}/flush", timeout=120)))
+
+
+class MemorySampler:
+    """Sums the RSS of the gunicorn master and its workers every interval"""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def current(self):
+        return sum(_status_kb(pid, 'VmRSS') for pid in self.pids())
+
+    def pids(self):
+        try:
+            with open(f"/proc/{self.pid}/task/{self.pid}/children") as f:
+                return [self.pid] + [int(pid) for pid in f.read().split()]
+        except OSError:
+            return [self.pid]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+
+def _status_kb(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 1)
+
+
+def outbound_calls(metrics_text):
+    """Per (service, operation): calls, failed calls and mean duration, from /metrics"""
+    calls = {}
+    pattern = r'slidesync_external_call_duration_seconds_(count|sum)\{service="([^"]+)",operation="([^"]+)"\} (\S+)'
+    for kind, service, operation, value in re.findall(pattern, metrics_text):
+        calls.setdefault(f"{service} {operation}", {})[kind] = float(value)
+    failed = {}
+    pattern = r'slidesync_external_calls_total\{service="([^"]+)",operation="([^"]+)",outcome="([^"]+)"\} (\S+)'
+    for service, operation, outcome, value in re.findall(pattern, metrics_text):
+        if outcome != 'ok':
+            key = f"{service} {operation}"
+            failed[key] = failed.get(key, 0) + int(float(value))
+    return {
+        key: {'calls': int(c.get('count', 0)), 'failed': failed.get(key, 0),
+              'mean_ms': round(c['sum'] / c['count'] * 1000, 1) if c.get('count') else None}
+        for key, c in sorted(calls.items())
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of report against baseline, as readable strings"""
+    regressions = []
+    for step, current in report['steps'].items():
+        before = baseline.get('steps', {}).get(step, {}).get('p95_ms')
+        if before and current['p95_ms'] and current['p95_ms'] > before * (1 + tolerance):
+            regressions.append(f"{step} p95 {current['p95_ms']} ms vs {before} ms")
+        if current['errors'] > baseline.get('steps', {}).get(step, {}).get('errors', 0):
+            regressions.append(f"{step} errors {current['errors']} vs {baseline['steps'][step]['errors']}")
+    before = baseline.get('throughput', {}).get('captures_per_s')
+    if before and report['throughput']['captures_per_s'] < before * (1 - tolerance):
+        regressions.append(f"captures/s {report['throughput']['captures_per_s']} vs {before}")
+    before = baseline.get('memory', {}).get('rss_peak_mb')
+    if before and report['memory']['rss_peak_mb'] > before * (1 + tolerance):
+        regressions.append(f"peak RSS {report['memory']['rss_peak_mb']} MB vs {before} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=8, help='students in the lecture at once')
+    parser.add_argument('--captures', type=int, default=10, help='slides captured per student')
+    parser.add_argument('--repeat-rate', type=float, default=0.2, help='fraction of captures repeating the last slide')
+    parser.add_argument('--min-repeat-match', type=float, default=0.8,
+                        help='share of repeats that must be answered as duplicates')
+    parser.add_argument('--think-time', type=float, default=0.0, help='seconds between captures')
+    parser.add_argument('--google-latency', default='0.05', help='seconds per Google call, e.g. "0.05,docs=0.3"')
+    parser.add_argument('--google-rate', type=float, default=1000.0, help='fake Google quota per user and API')
+    parser.add_argument('--google-error-rate', type=float, default=0.0, help='fraction of Google calls failing with 503')
+    parser.add_argument('--ocr-latency', type=float, default=0.5, help='seconds the Cerebras stand-in takes')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='threads per gunicorn worker')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression against --baseline')
+    parser.add_argument('--server-log', help='file for the server output (default: discarded)')
+    args = parser.parse_args()
+
+    google_port = free_port()
+    google = fake_google_quota.serve(port=google_port, rate=args.google_rate, burst=args.google_rate,
+                                     error_rate=args.google_error_rate, latency=args.google_latency)
+    google_root = f"http://127.0.0.1:{google_port}"
+    FakeCerebras.latency = args.ocr_latency
+    cerebras = ThreadingHTTPServer(('127.0.0.1', 0), FakeCerebras)
+    cerebras.daemon_threads = True
+    threading.Thread(target=cerebras.serve_forever, daemon=True).start()
+
+    state = tempfile.mkdtemp(prefix='bench-e2e-')
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        SECRET_KEY=SECRET_KEY,
+        GOOGLE_CLIENT_ID='bench',
+        GOOGLE_CLIENT_SECRET='bench',
+        GOOGLE_API_ROOT=google_root + '/',
+        GOOGLE_OAUTH_METADATA_URL=f"{google_root}/.well-known/openid-configuration",
+        GOOGLE_TOKEN_URI=f"{google_root}/token",
+        AUTHLIB_INSECURE_TRANSPORT='1',  # the stand-ins speak plain HTTP
+        CEREBRAS_API_KEY='bench',
+        CEREBRAS_BASE_URL=f"http://127.0.0.1:{cerebras.server_address[1]}",
+        OCR_ENGINE='cerebras',
+        SESSION_BACKEND='sqlite',
+        SESSION_DB=os.path.join(state, 'sessions.sqlite3'),
+        CAPTURE_STORE_DIR=os.path.join(state, 'captures'),
+        DOC_WRITE_JOURNAL=os.path.join(state, 'doc-writes.sqlite3'),
+        PUSH_CHANNEL_DB=os.path.join(state, 'push-channels.sqlite3'),
+        METRICS_DIR=os.path.join(state, 'metrics'),
+        METRICS_FLUSH_INTERVAL='0.2',
+    )
+
+    # Distinct slides for every capture that is not a repeat
+    rng = random.Random(args.seed)
+    frames = make_frames(args.users * args.captures, args.width, args.height)
+    server_log = open(args.server_log, 'w') if args.server_log else None
+    server = start_server('gthread', port, env, args.workers, args.threads, output=server_log)
+    recorder = Recorder()
+    try:
+        requests.get(f"{base}/about", timeout=60)  # warm-up: imports, templates
+        sampler = MemorySampler(server.pid).start()
+        rss_start = sampler.current()
+
+        per_user = [frames[i::args.users] for i in range(args.users)]
+        students = [threading.Thread(target=lecture_session,
+                                     args=(base, per_user[i], args, recorder, random.Random(rng.random())))
+                    for i in range(args.users)]
+        started = time.perf_counter()
+        for student in students:
+            student.start()
+        for student in students:
+            student.join()
+        wall = time.perf_counter() - started
+
+        sampler.stop()
+        rss_end = sampler.current()
+        time.sleep(4 * float(env['METRICS_FLUSH_INTERVAL']))  # let every worker write its snapshot
+        calls = outbound_calls(requests.get(f"{base}/metrics", timeout=60).text)
+    finally:
+        server.terminate()
+        server.wait()
+        google.shutdown()
+        cerebras.shutdown()
+        if server_log:
+            server_log.close()
+
+    steps = {
+        step: {
+            'count': len(samples),
+            'errors': recorder.errors[step],
+            'p50_ms': percentile(samples, 0.50),
+            'p95_ms': percentile(samples, 0.95),
+            'p99_ms': percentile(samples, 0.99),
+            'max_ms': round(max(samples) * 1000, 1) if samples else None,
+        }
+        for step, samples in recorder.latencies.items()
+    }
+    captures = steps['process_slide']['count'] - steps['process_slide']['errors']
+    report = {
+        'config': {key: getattr(args, key) for key in
+                   ('users', 'captures', 'repeat_rate', 'think_time', 'google_latency', 'google_rate',
+                    'google_error_rate', 'ocr_latency', 'workers', 'threads', 'width', 'height', 'seed')},
+        'wall_s': round(wall, 2),
+        'throughput': {
+            'captures_per_s': round(captures / wall, 2),
+            'requests_per_s': round(sum(s['count'] for s in steps.values()) / wall, 2),
+        },
+        'steps': steps,
+        'memory': {
+            'rss_start_mb': round(rss_start / 1024, 1),
+            'rss_peak_mb': round(max(sampler.peak, rss_end) / 1024, 1),
+            'rss_end_mb': round(rss_end / 1024, 1),
+        },
+        'outbound_calls': calls,
+        'repeats': {
+            'sent': recorder.repeats,
+            'matched': recorder.repeats_matched,
+            'match_rate': round(recorder.repeats_matched / recorder.repeats, 3) if recorder.repeats else None,
+        },
+        'error_samples': recorder.error_samples,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{args.users} students x {args.captures} captures, Google {args.google_latency}s, "
+              f"OCR {args.ocr_latency}s, {args.workers} worker(s) x {args.threads} threads")
+        print(f"{'step':<15}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for step, s in steps.items():
+            print(f"{step:<15}{s['count']:>7}{s['errors']:>8}{s['p50_ms']!s:>10}{s['p95_ms']!s:>10}{s['p99_ms']!s:>10}")
+        print(f"{report['throughput']['captures_per_s']} captures/s, {report['throughput']['requests_per_s']} "
+              f"requests/s over {report['wall_s']} s; server RSS {report['memory']['rss_start_mb']} MB at start, "
+              f"{report['memory']['rss_peak_mb']} MB peak")
+        print(f"repeats answered as duplicates: {recorder.repeats_matched} of {recorder.repeats}")
+        for line in recorder.error_samples:
+            print(f"  error: {line}")
+
+    failures = []
+    rate = report['repeats']['match_rate']
+    if rate is not None and rate < args.min_repeat_match:
+        failures.append(f"FAIL: only {rate:.0%} of repeated slides were recognised as duplicates")
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += [f"REGRESSION: {line}" for line in compare(report, json.load(f), args.tolerance)]
+    for line in failures:
+        print(line, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
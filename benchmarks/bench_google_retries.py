@@ -0,0 +1,212 @@
+"""
+Benchmark: does google_calls.execute() retry, wait and refuse the way it should?
+
+Runs the real GoogleCallScheduler and the app's pooled transport against
+tools/fake_google_quota.py and checks each policy end to end:
+
+- retry-after: Google answers 429 with a Retry-After header; the call waits
+  at least that long, is sent once more and succeeds
+- write-5xx: a documents.batchUpdate (POST) gets a 503; it is sent once and
+  the error is raised, since Google may have applied it
+- idempotent-5xx: the same 503 on a documents.get, and on a POST marked
+  idempotent, is retried until GOOGLE_RETRY_MAX is used up
+- bucket-wait, bucket-full: calls beyond the local token bucket wait for a
+  token when it refills within GOOGLE_RATE_MAX_WAIT, and fail with
+  RateLimited, without reaching Google, when it does not
+
+Each case uses its own access token, so the fake's quotas do not carry over,
+and its own scheduler. The report lists what the fake saw and the
+scheduler's counters for each case; the exit status is 1 if a check fails.
+
+Usage:
+    python benchmarks/bench_google_retries.py [--retry-after 1]
+    python benchmarks/bench_google_retries.py --json --output retries.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from bench_upload_paths import free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import fake_google_quota  # noqa: E402
+
+
+def configure(rate, burst, error_rate):
+    """Change the fake's quota and 503 rate between cases"""
+    fake_google_quota.FakeGoogle.quota = fake_google_quota.Quota(rate, burst)
+    fake_google_quota.FakeGoogle.options.error_rate = error_rate
+
+
+def fake_docs_stats():
+    with fake_google_quota.FakeGoogle.stats_lock:
+        return dict(fake_google_quota.FakeGoogle.stats.get('docs', {'served': 0, 'throttled': 0, 'errors': 0}))
+
+
+def docs_service(token):
+    from googleapiclient import discovery
+    from google.oauth2.credentials import Credentials
+    from google_services import get_discovery_document
+    from http_transport import transport_pool
+    return discovery.build_from_document(
+        get_discovery_document('docs', 'v1'),
+        http=transport_pool.authorized_http(Credentials(token=token))
+    )
+
+
+def append_request(service):
+    return service.documents().batchUpdate(
+        documentId=fake_google_quota.LECTURE_DOC_ID,
+        body={'requests': [{'insertText': {'endOfSegmentLocation': {}, 'text': 'bench\n'}}]}
+    )
+
+
+def read_request(service):
+    return service.documents().get(documentId=fake_google_quota.LECTURE_DOC_ID)
+
+
+def run_case(name, scheduler, calls):
+    """
+    Send calls (callables returning (request, execute kwargs)) one after another
+
+    Returns:
+        Report dict: outcome and seconds per call, what the fake saw and the
+        scheduler's docs counters
+    """
+    before = fake_docs_stats()
+    results = []
+    for make in calls:
+        request, options = make()
+        started = time.perf_counter()
+        try:
+            scheduler.execute(request, user=name, **options)
+            outcome = 'ok'
+        except Exception as e:
+            status = getattr(getattr(e, 'resp', None), 'status', None)
+            outcome = f"{type(e).__name__} {status}" if status else type(e).__name__
+        results.append({'outcome': outcome, 'seconds': round(time.perf_counter() - started, 3)})
+    after = fake_docs_stats()
+    counters = scheduler.stats()['apis'].get('docs', {})
+    return {
+        'calls': results,
+        'google': {key: after[key] - before.get(key, 0) for key in after},
+        'scheduler': {key: counters.get(key) for key in
+                      ('calls', 'retries', 'retried_statuses', 'failures', 'writes_not_retried',
+                       'throttled', 'rate_limited')},
+    }
+
+
+def check(failures, name, condition, message):
+    if not condition:
+        failures.append(f"{name}: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds the fake sends with 429')
+    parser.add_argument('--retries', type=int, default=2, help='GOOGLE_RETRY_MAX for the 5xx cases')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    port = free_port()
+    os.environ['GOOGLE_API_ROOT'] = f'http://127.0.0.1:{port}/'
+    server = fake_google_quota.serve(port=port, retry_after=args.retry_after)
+    from google_calls import GoogleCallScheduler, RateLimited  # noqa: F401 (after GOOGLE_API_ROOT is set)
+
+    def scheduler(**overrides):
+        options = dict(limits='docs=100:100', max_wait=5, max_retries=args.retries, retry_base=0.05, retry_cap=1)
+        options.update(overrides)
+        return GoogleCallScheduler(**options)
+
+    cases = {}
+    failures = []
+    try:
+        # Google allows one call; the second is refused with Retry-After
+        configure(rate=1, burst=1, error_rate=0.0)
+        service = docs_service('token-retry-after')
+        case = cases['retry-after'] = run_case('retry-after', scheduler(), [
+            lambda: (read_request(service), {}),
+            lambda: (append_request(service), {}),
+        ])
+        check(failures, 'retry-after', [call['outcome'] for call in case['calls']] == ['ok', 'ok'],
+              f"calls ended {[call['outcome'] for call in case['calls']]}")
+        check(failures, 'retry-after', case['google']['throttled'] == 1,
+              f"Google refused {case['google']['throttled']} calls, expected 1")
+        check(failures, 'retry-after', case['scheduler']['retried_statuses'] == {'429': 1},
+              f"retried {case['scheduler']['retried_statuses']}")
+        check(failures, 'retry-after', case['calls'][1]['seconds'] >= args.retry_after,
+              f"retried after {case['calls'][1]['seconds']}s, before Retry-After {args.retry_after}s")
+
+        # Every call fails with 503
+        configure(rate=100, burst=100, error_rate=1.0)
+        service = docs_service('token-write-5xx')
+        case = cases['write-5xx'] = run_case('write-5xx', scheduler(), [lambda: (append_request(service), {})])
+        check(failures, 'write-5xx', case['calls'][0]['outcome'] == 'HttpError 503',
+              f"ended {case['calls'][0]['outcome']}")
+        check(failures, 'write-5xx', case['google']['errors'] == 1,
+              f"sent {case['google']['errors']} times, expected once")
+        check(failures, 'write-5xx', case['scheduler']['writes_not_retried'] == 1,
+              f"writes_not_retried is {case['scheduler']['writes_not_retried']}")
+
+        service = docs_service('token-idempotent-5xx')
+        case = cases['idempotent-5xx'] = run_case('idempotent-5xx', scheduler(), [
+            lambda: (read_request(service), {}),
+            lambda: (append_request(service), {'idempotent': True}),
+        ])
+        attempts = 2 * (args.retries + 1)
+        check(failures, 'idempotent-5xx', [call['outcome'] for call in case['calls']] == ['HttpError 503'] * 2,
+              f"calls ended {[call['outcome'] for call in case['calls']]}")
+        check(failures, 'idempotent-5xx', case['google']['errors'] == attempts,
+              f"sent {case['google']['errors']} times, expected {attempts}")
+        check(failures, 'idempotent-5xx', case['scheduler']['writes_not_retried'] == 0,
+              "an idempotent call was counted as a write left unretried")
+
+        # Local bucket of 2 calls refilling at 2 per second; the third call needs 0.5 s
+        configure(rate=100, burst=100, error_rate=0.0)
+        service = docs_service('token-bucket-full')
+        three_reads = [lambda: (read_request(service), {})] * 3
+        case = cases['bucket-wait'] = run_case('bucket-wait', scheduler(limits='docs=2:2', max_wait=1), three_reads)
+        check(failures, 'bucket-wait', [call['outcome'] for call in case['calls']] == ['ok'] * 3,
+              f"calls ended {[call['outcome'] for call in case['calls']]}")
+        check(failures, 'bucket-wait', case['scheduler']['throttled'] == 1,
+              f"{case['scheduler']['throttled']} calls waited for a token, expected 1")
+
+        case = cases['bucket-full'] = run_case('bucket-full', scheduler(limits='docs=2:2', max_wait=0.2), three_reads)
+        check(failures, 'bucket-full', [call['outcome'] for call in case['calls']] == ['ok', 'ok', 'RateLimited'],
+              f"calls ended {[call['outcome'] for call in case['calls']]}")
+        check(failures, 'bucket-full', case['google']['served'] == 2,
+              f"Google saw {case['google']['served']} calls, expected 2")
+    finally:
+        server.shutdown()
+
+    report = {
+        'config': {'retry_after': args.retry_after, 'retries': args.retries},
+        'cases': cases,
+        'failures': failures,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'case':<16}{'outcomes':<40}{'seconds':<20}google (served/throttled/errors)")
+        for name, case in cases.items():
+            outcomes = ', '.join(call['outcome'] for call in case['calls'])
+            seconds = ', '.join(str(call['seconds']) for call in case['calls'])
+            google = case['google']
+            print(f"{name:<16}{outcomes:<40}{seconds:<20}"
+                  f"{google['served']}/{google['throttled']}/{google['errors']}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Benchmark: does the perceptual hash tell re-captures of a slide from different slides?
+
+Generates a corpus of synthetic slides with random layouts (title bar or
+plain title, one or two columns of bullets, sometimes a chart) plus a
+progressive reveal, where each slide adds one bullet to the one before. Every
+slide is then re-captured the ways a phone re-captures it:
+
+- shift<px>: moved by 2, 8 or 20 pixels
+- rot<deg>: rotated by 0.5 to 3 degrees; rot1-black fills the corners with black
+- scale<factor>: zoomed in or out by 1 to 5%
+- combo: a random mix of the three
+- photo: a small move plus exposure change, sensor noise and JPEG
+- room: photographed on a wall in a darker room, compared with the slide itself
+- room-room: two such photos of the same slide compared with each other
+
+Blank and dark frames (a projector between slides, a covered lens) are
+hashed too. The benchmark reports the Hamming distance between each capture
+and its slide, the distances between different slides and the time per hash,
+then checks the thresholds the app uses, OCR_CACHE_MAX_DISTANCE for the OCR
+cache and DUPLICATE_MAX_DISTANCE for repeat captures (or --threshold):
+
+- no two different slides are within the larger of them
+- at least --min-match of each kind of re-capture is within the smaller
+- blank frames are refused (is_blank_hash) and slides never are
+
+It exits with status 1 if a check fails.
+
+Usage:
+    python benchmarks/bench_image_hash.py [--slides 30 --size 1280x720]
+    python benchmarks/bench_image_hash.py --json --output hash.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from image_hash import perceptual_hash, hamming_distance, is_blank_hash, HASH_WIDTH, HASH_HEIGHT  # noqa: E402
+from capture_index import DUPLICATE_MAX_DISTANCE  # noqa: E402
+from ocr_cache import OCR_CACHE_MAX_DISTANCE  # noqa: E402
+
+WORDS = ("graph tree heap sort merge quick binary search hash table queue stack vertex edge path cost time space "
+         "proof lemma theorem induction invariant loop array list pointer node root leaf depth height balance "
+         "rotate").split()
+
+# Reported but not held to --min-match: next to a screenshot of the slide, a
+# photo of the wall loses any title bar that is as dark as the room around it
+REPORT_ONLY = ('room',)
+
+
+def make_slide(rng, width, height, title=None, bullets=None):
+    """
+    A lecture slide with a random layout
+
+    Args:
+        rng: NumPy random generator
+        width, height: Frame size in pixels
+        title: Title text (random if None)
+        bullets: Bullet lines (random if None)
+
+    Returns:
+        BGR image as a NumPy array
+    """
+    scale = min(width, height) / 720
+    thick = lambda weight: max(1, int(weight * scale))  # noqa: E731
+    img = np.full((height, width, 3), rng.integers(230, 255), np.uint8)
+    title = title or ' '.join(rng.choice(WORDS, rng.integers(2, 5))).capitalize()
+    if rng.random() < 0.5:
+        cv2.rectangle(img, (0, 0), (width, int(110 * scale)), tuple(int(c) for c in rng.integers(0, 160, 3)), -1)
+        cv2.putText(img, title, (int(40 * scale), int(75 * scale)), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.6 * scale, (255, 255, 255), thick(3))
+    else:
+        cv2.putText(img, title, (int(rng.integers(40, 200) * scale), int(80 * scale)), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.5 * scale, (20, 20, 20), thick(3))
+
+    columns = 1 if bullets else 2 if rng.random() < 0.3 else 1
+    for column in range(columns):
+        lines = bullets or [' '.join(rng.choice(WORDS, rng.integers(2, 7 if columns == 1 else 4)))
+                            for _ in range(rng.integers(1, 8))]
+        for i, line in enumerate(lines):
+            cv2.putText(img, f"- {line}", (int((60 + column * 600) * scale), int((190 + i * 62) * scale)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.9 * scale, (30, 30, 30), thick(2))
+
+    if not bullets and rng.random() < 0.3:
+        left, bottom = int(width * rng.uniform(0.5, 0.65)), int(height * 0.92)
+        for i, value in enumerate(rng.uniform(0.2, 1.0, 6)):
+            x = left + int(i * 55 * scale)
+            cv2.rectangle(img, (x, bottom - int(value * 220 * scale)), (x + int(40 * scale), bottom),
+                          (40, 120 + 20 * i, 200), -1)
+    return img
+
+
+def build_slides(count, width, height, seed=0):
+    """(name, image) for count random slides and a progressive reveal of 2 to 7 bullets"""
+    rng = np.random.default_rng(seed)
+    slides = [(f"slide-{i}", make_slide(rng, width, height)) for i in range(count)]
+    title = ' '.join(rng.choice(WORDS, 3)).capitalize()
+    bullets = [' '.join(rng.choice(WORDS, rng.integers(3, 7))) for _ in range(7)]
+    # Same generator state for every step, so only the bullets differ
+    slides += [(f"reveal-{n}", make_slide(np.random.default_rng([seed, 1]), width, height, title, bullets[:n]))
+               for n in range(2, 8)]
+    return slides
+
+
+def move(image, dx=0, dy=0, angle=0, scale=1.0, border=cv2.BORDER_REPLICATE):
+    """The same frame shifted, rotated (degrees) and scaled about its centre"""
+    h, w = image.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), angle, scale)
+    m[:, 2] += (dx, dy)
+    return cv2.warpAffine(image, m, (w, h), flags=cv2.INTER_LINEAR, borderMode=border)
+
+
+def photograph(image, rng, noise=6, quality=85):
+    """Exposure change, sensor noise and JPEG"""
+    photo = image.astype(np.float32) * rng.uniform(0.8, 1.1) + rng.normal(0, noise, image.shape)
+    photo = np.clip(photo, 0, 255).astype(np.uint8)
+    return cv2.imdecode(cv2.imencode('.jpg', photo, [cv2.IMWRITE_JPEG_QUALITY, quality])[1], cv2.IMREAD_COLOR)
+
+
+def room_shot(image, rng):
+    """The slide projected on a wall in a darker room, photographed by hand"""
+    h, w = image.shape[:2]
+    level = rng.uniform(25, 50)
+    room = level + rng.normal(0, 5, (h, w, 3)) + np.linspace(-10, 10, w)[None, :, None]
+    room = np.clip(room, 0, 255).astype(np.uint8)
+    projected = np.clip(40 + 0.82 * image.astype(np.float32), 0, 255).astype(np.uint8)  # projector black level
+
+    fill = rng.uniform(0.55, 0.85)
+    sw, sh = w * fill * rng.uniform(0.95, 1.05), h * fill * rng.uniform(0.95, 1.05)
+    cx, cy = w / 2 + rng.uniform(-0.04, 0.04) * w, h / 2 + rng.uniform(-0.04, 0.04) * h
+    corners = np.float32([[cx - sw / 2, cy - sh / 2], [cx + sw / 2, cy - sh / 2],
+                          [cx + sw / 2, cy + sh / 2], [cx - sw / 2, cy + sh / 2]])
+    corners += rng.uniform(-0.02, 0.02, (4, 2)).astype(np.float32) * w  # hand-held perspective
+    corners = np.clip(corners, [0.02 * w, 0.02 * h], [0.98 * w, 0.98 * h]).astype(np.float32)
+
+    m = cv2.getPerspectiveTransform(np.float32([[0, 0], [w, 0], [w, h], [0, h]]), corners)
+    warped = cv2.warpPerspective(projected, m, (w, h))
+    inside = cv2.warpPerspective(np.full((h, w), 255, np.uint8), m, (w, h))
+    return photograph(np.where(inside[..., None] > 0, warped, room), rng, noise=3, quality=90)
+
+
+def recaptures(image, rng):
+    """(kind, image) re-captures of one slide"""
+    sign = lambda: rng.choice([-1, 1])  # noqa: E731
+    out = [(f"shift{d}", move(image, dx=d * sign(), dy=d * sign())) for d in (2, 8, 20)]
+    out += [(f"rot{a}", move(image, angle=a * sign())) for a in (0.5, 1, 2, 3)]
+    out.append(('rot1-black', move(image, angle=sign(), border=cv2.BORDER_CONSTANT)))
+    out += [(f"scale{s}", move(image, scale=s)) for s in (0.95, 0.97, 0.99, 1.01, 1.03)]
+    out.append(('combo', move(image, dx=rng.uniform(-15, 15), dy=rng.uniform(-15, 15),
+                              angle=rng.uniform(-2, 2), scale=rng.uniform(0.97, 1.03))))
+    out.append(('photo', photograph(move(image, dx=rng.uniform(-10, 10), angle=rng.uniform(-1.5, 1.5),
+                                         scale=rng.uniform(0.98, 1.02)), rng)))
+    return out
+
+
+def blank_frames(width, height, seed=0):
+    """(name, image) frames without a slide"""
+    rng = np.random.default_rng(seed)
+    noisy = lambda level, noise: np.clip(  # noqa: E731
+        level + rng.normal(0, noise, (height, width, 3)), 0, 255).astype(np.uint8)
+    return [
+        ('black', np.zeros((height, width, 3), np.uint8)),
+        ('dark-noisy', noisy(12, 4)),
+        ('gray-noisy', noisy(128, 3)),
+        ('white', np.full((height, width, 3), 250, np.uint8)),
+        ('white-noisy', noisy(240, 5)),
+    ]
+
+
+def summarize(distances, threshold):
+    """Distance statistics and the share within threshold"""
+    distances = sorted(distances)
+    return {
+        'count': len(distances),
+        'min': distances[0],
+        'median': statistics.median(distances),
+        'p95': distances[min(len(distances) - 1, int(0.95 * len(distances)))],
+        'max': distances[-1],
+        'within': round(sum(d <= threshold for d in distances) / len(distances), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--slides', type=int, default=30, help='random slides (a 6-slide reveal is added)')
+    parser.add_argument('--size', default='1280x720', help='frame size, WIDTHxHEIGHT')
+    parser.add_argument('--threshold', type=int,
+                        help='largest distance counted as the same slide '
+                             '(default: OCR_CACHE_MAX_DISTANCE and DUPLICATE_MAX_DISTANCE)')
+    parser.add_argument('--min-match', type=float, default=0.9,
+                        help='share of each kind of re-capture that must be within the threshold')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    thresholds = [args.threshold] if args.threshold is not None else [OCR_CACHE_MAX_DISTANCE, DUPLICATE_MAX_DISTANCE]
+    match_within, apart_beyond = min(thresholds), max(thresholds)
+
+    slides = build_slides(args.slides, width, height, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    timings = []
+
+    def timed_hash(image):
+        started = time.perf_counter()
+        value = perceptual_hash(image)
+        timings.append((time.perf_counter() - started) * 1000)
+        return value
+
+    hashes = {name: timed_hash(image) for name, image in slides}
+    same = {}
+    worst = []
+    for name, image in slides:
+        captures = recaptures(image, rng) + [('room', room_shot(image, rng))]
+        for kind, capture in captures:
+            distance = hamming_distance(hashes[name], timed_hash(capture))
+            same.setdefault(kind, []).append(distance)
+            worst.append((distance, kind, name))
+        first, second = timed_hash(room_shot(image, rng)), timed_hash(room_shot(image, rng))
+        same.setdefault('room-room', []).append(hamming_distance(first, second))
+        worst.append((same['room-room'][-1], 'room-room', name))
+
+    names = [name for name, _ in slides]
+    different = sorted((hamming_distance(hashes[a], hashes[b]), a, b)
+                       for i, a in enumerate(names) for b in names[i + 1:])
+    blanks = {name: perceptual_hash(image) for name, image in blank_frames(width, height, args.seed)}
+
+    kinds = {kind: summarize(distances, match_within) for kind, distances in same.items()}
+    failures = []
+    false_matches = [pair for pair in different if pair[0] <= apart_beyond]
+    if false_matches:
+        failures.append(f"{len(false_matches)} pairs of different slides within {apart_beyond} bits, "
+                        f"closest {false_matches[0]}")
+    for kind, summary in kinds.items():
+        if kind not in REPORT_ONLY and summary['within'] < args.min_match:
+            failures.append(f"only {summary['within']:.0%} of {kind} re-captures within {match_within} bits")
+    failures += [f"{name} frame is not refused as blank" for name, value in blanks.items() if not is_blank_hash(value)]
+    failures += [f"{name} is refused as blank" for name, value in hashes.items() if is_blank_hash(value)]
+
+    report = {
+        'config': {
+            'slides': len(slides),
+            'size': args.size,
+            'hash_bits': HASH_WIDTH * HASH_HEIGHT - 1,
+            'ocr_cache_max_distance': OCR_CACHE_MAX_DISTANCE,
+            'duplicate_max_distance': DUPLICATE_MAX_DISTANCE,
+            'threshold': args.threshold,
+            'min_match': args.min_match,
+        },
+        'hash_ms': {'median': round(statistics.median(timings), 1), 'max': round(max(timings), 1)},
+        'same_slide': kinds,
+        'different_slides': dict(summarize([d for d, _, _ in different], apart_beyond),
+                                 closest=[list(pair) for pair in different[:5]]),
+        'worst_recaptures': [list(item) for item in sorted(worst, reverse=True)[:5]],
+        'blank_bits': {name: bin(value).count('1') for name, value in blanks.items()},
+        'failures': failures,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        threshold = match_within if match_within == apart_beyond else f"{match_within}-{apart_beyond}"
+        print(f"{len(slides)} slides at {args.size}, {report['config']['hash_bits']}-bit hash, "
+              f"threshold {threshold} bits, hash {report['hash_ms']['median']} ms median")
+        print(f"{'re-capture':<12}{'median':>8}{'p95':>6}{'max':>6}{'within':>9}")
+        for kind, s in kinds.items():
+            print(f"{kind:<12}{s['median']:>8g}{s['p95']:>6}{s['max']:>6}{s['within']:>9.0%}")
+        d = report['different_slides']
+        print(f"{'different':<12}{d['median']:>8g}{'':>6}{'':>6}{d['within']:>9.0%}   min {d['min']}, "
+              f"closest {different[0][1]} / {different[0][2]}")
+        print("worst re-captures: " + ', '.join(f"{k} of {n} {v}" for v, k, n in report['worst_recaptures']))
+        print("blank frames, bits set: " + ', '.join(f"{n} {b}" for n, b in report['blank_bits'].items()))
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
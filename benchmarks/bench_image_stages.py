@@ -0,0 +1,251 @@
+"""
+Benchmark: CPU time and allocations of each image-processing stage a capture goes through.
+
+Generates a corpus of synthetic slide photos: a title bar, bullet text and a
+chart, uneven lighting as from a projector, and sensor noise. The corpus
+covers several resolutions (up to a 12-megapixel phone frame) and noise
+levels, and each photo is JPEG-encoded as a phone would upload it. Every
+stage then runs on every photo:
+
+- decode: cv2.imdecode of the uploaded JPEG
+- perceptual_hash: the duplicate / OCR cache key
+- stage:<name>: each registered preprocessing stage on its own
+  (grayscale, clahe, otsu, adaptive_threshold, denoise, basic_enhancement, ...)
+- pipeline: the configured PREPROCESS_STAGES chain end to end
+- normalize:<target>: downscale and JPEG encode for OCR, preview and archive
+- encode_png: the PNG encode of the enhanced image in enhance_image_with_cerebras
+- base64: encoding the OCR payload for the API request
+
+Stages are timed over --repeat runs after a warm-up. CPU time is process
+time, so OpenCV's worker threads count; wall time is reported alongside.
+Allocations are measured in a separate pass under tracemalloc, so tracing
+does not slow down the timed runs. They cover Python objects and NumPy
+arrays, including arrays OpenCV returns. OpenCV's internal scratch buffers
+are not visible to tracemalloc.
+
+Usage:
+    python benchmarks/bench_image_stages.py [--resolutions 1280x720,1920x1080,4032x3024 --noise 0,8,20]
+    python benchmarks/bench_image_stages.py --output before.json
+    python benchmarks/bench_image_stages.py --baseline before.json
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cerebras_integration import basic_image_enhancement  # noqa: E402  (also registers its stages)
+from image_hash import perceptual_hash  # noqa: E402
+from image_normalization import normalize_image, OCR_TARGET, PREVIEW_TARGET, ARCHIVE_TARGET  # noqa: E402
+from preprocessing import Pipeline, available_stages, PREPROCESS_STAGES  # noqa: E402
+
+# Stages that call out to an API rather than doing local image work
+REMOTE_STAGES = ('cerebras_enhancement',)
+
+
+def make_slide(width, height, noise, seed=0):
+    """
+    A photographed lecture slide
+
+    Args:
+        width, height: Frame size in pixels
+        noise: Standard deviation of the Gaussian sensor noise (0-255 scale)
+        seed: Seed for the noise and layout
+
+    Returns:
+        BGR image as a NumPy array
+    """
+    rng = np.random.default_rng(seed)
+    scale = min(width, height) / 720
+    img = np.full((height, width, 3), 245, np.uint8)
+    cv2.rectangle(img, (0, 0), (width, int(110 * scale)), (120, 60, 20), -1)
+    cv2.putText(img, "Lecture 5: Dynamic programming", (int(40 * scale), int(75 * scale)),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.6 * scale, (255, 255, 255), max(1, int(3 * scale)))
+    for i in range(7):
+        cv2.putText(img, f"- Bullet point {i + 1}: overlapping subproblems and memoisation",
+                    (int(60 * scale), int((190 + i * 62) * scale)), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.9 * scale, (30, 30, 30), max(1, int(2 * scale)))
+    # A bar chart in the lower right
+    left, bottom = int(width * 0.62), int(height * 0.92)
+    for i, value in enumerate(rng.uniform(0.2, 1.0, 6)):
+        x = left + int(i * 55 * scale)
+        cv2.rectangle(img, (x, bottom - int(value * 220 * scale)), (x + int(40 * scale), bottom),
+                      (40, 120 + 20 * i, 200), -1)
+
+    # Projector hot spot: brighter in the middle, darker towards the corners
+    ys, xs = np.ogrid[:height, :width]
+    falloff = ((xs - width / 2) / width) ** 2 + ((ys - height / 2) / height) ** 2
+    lighting = (1.0 - 0.5 * falloff).astype(np.float32)[..., None]
+    photo = img.astype(np.float32) * lighting
+    if noise:
+        photo += rng.normal(0, noise, photo.shape).astype(np.float32)
+    return np.clip(photo, 0, 255).astype(np.uint8)
+
+
+def build_corpus(resolutions, noise_levels, quality=90):
+    """One JPEG-encoded slide photo per (resolution, noise level)"""
+    corpus = []
+    for seed, (width, height) in enumerate(resolutions):
+        for noise in noise_levels:
+            image = make_slide(width, height, noise, seed)
+            jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            corpus.append({
+                'name': f"{width}x{height} noise={noise:g}",
+                'width': width,
+                'height': height,
+                'noise': noise,
+                'jpeg_bytes': len(jpeg),
+                'jpeg': jpeg,
+                'image': cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR),
+            })
+    return corpus
+
+
+def run_stage(name):
+    """A single preprocessing stage through the public pipeline interface"""
+    pipeline = Pipeline([(name, {})])
+    return lambda image: pipeline.run(image).output(name)
+
+
+def image_stages():
+    """(name, input from a corpus item, function) for every stage a capture can go through"""
+    source = lambda item: item['image']  # noqa: E731
+    configured = Pipeline.from_spec(PREPROCESS_STAGES)
+    stages = [
+        ('decode', lambda item: item['jpeg'], lambda data: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)),
+        ('perceptual_hash', source, perceptual_hash),
+    ]
+    stages += [(f"stage:{name}", source, run_stage(name))
+               for name in available_stages() if name not in REMOTE_STAGES]
+    stages += [
+        (f"pipeline:{PREPROCESS_STAGES}", source, lambda image: configured.run(image).output()),
+        ('normalize:ocr', source, lambda image: normalize_image(image, OCR_TARGET)),
+        ('normalize:preview', source, lambda image: normalize_image(image, PREVIEW_TARGET)),
+        ('normalize:archive', source, lambda image: normalize_image(image, ARCHIVE_TARGET)),
+        ('encode_png', lambda item: basic_image_enhancement(item['image']), lambda image: cv2.imencode('.png', image)),
+        ('base64', lambda item: normalize_image(item['image'], OCR_TARGET)[0], base64.b64encode),
+    ]
+    return stages
+
+
+def time_stage(fn, value, repeat):
+    fn(value)  # warm-up: lazy initialisation, caches
+    wall, cpu = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        fn(value)
+        cpu.append(time.process_time() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+    return {
+        'wall_ms': round(statistics.median(wall) * 1000, 3),
+        'cpu_ms': round(statistics.median(cpu) * 1000, 3),
+        'cpu_min_ms': round(min(cpu) * 1000, 3),
+    }
+
+
+def trace_stage(fn, value):
+    """Peak and retained bytes allocated by one call, from tracemalloc (already started)"""
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn(value)
+    current, peak = tracemalloc.get_traced_memory()
+    del result
+    return {
+        'alloc_peak_kb': round((peak - before) / 1024, 1),
+        'alloc_result_kb': round((current - before) / 1024, 1),
+    }
+
+
+def parse_resolutions(spec):
+    return [tuple(int(n) for n in item.lower().split('x')) for item in spec.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--resolutions', default='1280x720,1920x1080,4032x3024', help='comma-separated WxH')
+    parser.add_argument('--noise', default='0,8,20', help='comma-separated sensor noise levels (std dev)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per stage and image')
+    parser.add_argument('--stages', help='only stages whose name contains one of these comma-separated words')
+    parser.add_argument('--cv-threads', type=int, help='cv2.setNumThreads before running')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report to compare CPU time against')
+    args = parser.parse_args()
+
+    if args.cv_threads is not None:
+        cv2.setNumThreads(args.cv_threads)
+    corpus = build_corpus(parse_resolutions(args.resolutions), [float(n) for n in args.noise.split(',')])
+    stages = image_stages()
+    if args.stages:
+        words = args.stages.split(',')
+        stages = [stage for stage in stages if any(word in stage[0] for word in words)]
+
+    results = []
+    for item in corpus:
+        inputs = [(name, prepare(item), fn) for name, prepare, fn in stages]
+        timings = {name: time_stage(fn, value, args.repeat) for name, value, fn in inputs}
+        tracemalloc.start()
+        try:
+            allocations = {name: trace_stage(fn, value) for name, value, fn in inputs}
+        finally:
+            tracemalloc.stop()
+        results.append({
+            'image': item['name'],
+            'width': item['width'],
+            'height': item['height'],
+            'noise': item['noise'],
+            'jpeg_kb': round(item['jpeg_bytes'] / 1024, 1),
+            'stages': {name: dict(timings[name], **allocations[name]) for name, _, _ in inputs},
+        })
+
+    report = {
+        'config': {
+            'resolutions': args.resolutions,
+            'noise': args.noise,
+            'repeat': args.repeat,
+            'cv_threads': cv2.getNumThreads(),
+            'cpu_count': os.cpu_count(),
+            'preprocess_stages': PREPROCESS_STAGES,
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'results': results,
+    }
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r['image']: r['stages'] for r in json.load(f)['results']}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"OpenCV {cv2.__version__}, {cv2.getNumThreads()} OpenCV threads, {os.cpu_count()} CPUs, "
+          f"median of {args.repeat} runs")
+    for result in results:
+        print(f"\n{result['image']} ({result['jpeg_kb']} KB JPEG)")
+        header = f"{'stage':<32}{'cpu ms':>10}{'wall ms':>10}{'peak alloc KB':>15}{'result KB':>11}"
+        print(header + (f"{'vs base':>9}" if baseline else ''))
+        for name, s in result['stages'].items():
+            line = (f"{name:<32}{s['cpu_ms']:>10.2f}{s['wall_ms']:>10.2f}"
+                    f"{s['alloc_peak_kb']:>15.1f}{s['alloc_result_kb']:>11.1f}")
+            before = baseline.get(result['image'], {}).get(name)
+            if before and before['cpu_ms']:
+                line += f"{s['cpu_ms'] / before['cpu_ms']:>8.2f}x"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
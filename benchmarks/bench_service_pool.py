@@ -0,0 +1,98 @@
+"""
+Microbenchmark: per-request Google service setup cost.
+
+Compares the original helpers (new Credentials + googleapiclient build() for
+every service) against the pooled path in google_services. No network access
+is needed: build() reads the static discovery documents shipped with the
+client library and no API call is executed.
+
+Usage:
+    python benchmarks/bench_service_pool.py [--iterations N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from google_services import ServicePool, token_fingerprint
+
+# The three services /create-doc-for-event and /create-slidesync-doc need
+SERVICES = [('calendar', 'v3'), ('drive', 'v3'), ('docs', 'v1')]
+
+TOKEN = {
+    'access_token': 'bench-access-token',
+    'refresh_token': 'bench-refresh-token',
+    'scope': 'openid email profile https://www.googleapis.com/auth/calendar '
+             'https://www.googleapis.com/auth/documents https://www.googleapis.com/auth/drive',
+}
+
+
+def make_credentials():
+    return Credentials(
+        token=TOKEN['access_token'],
+        refresh_token=TOKEN['refresh_token'],
+        token_uri='https://oauth2.googleapis.com/token',
+        client_id='bench-client-id',
+        client_secret='bench-client-secret',
+        scopes=TOKEN['scope'].split(' ')
+    )
+
+
+def original_helpers():
+    # What every route paid before: one Credentials and one build() per service
+    for api_name, api_version in SERVICES:
+        build(api_name, api_version, credentials=make_credentials())
+
+
+def pooled_helpers(pool):
+    token_key = token_fingerprint(TOKEN)
+    for api_name, api_version in SERVICES:
+        pool.get('bench-user', api_name, api_version, token_key, make_credentials)
+
+
+def timeit(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p95_ms': samples[int(len(samples) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    pool = ServicePool()
+    # First pooled call pays for parsing discovery documents and building handles
+    start = time.perf_counter()
+    pooled_helpers(pool)
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    results = {
+        'original build() per request': timeit(original_helpers, args.iterations),
+        'pooled (warm)': timeit(lambda: pooled_helpers(pool), args.iterations),
+    }
+
+    print(f"Services per request: {', '.join(f'{n} {v}' for n, v in SERVICES)}")
+    print(f"Iterations: {args.iterations}")
+    print(f"Pooled cold start (first request in a worker): {cold_ms:.2f} ms")
+    print(f"{'path':<32}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<32}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}")
+    print(f"Pool stats: {pool.stats()}")
+
+
+if __name__ == '__main__':
+    main()
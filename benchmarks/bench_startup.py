@@ -0,0 +1,205 @@
+"""
+Benchmark: how long a fresh worker takes to import app.py and serve its first capture.
+
+Each scenario runs in a new Python process, the way gunicorn starts a worker:
+
+- eager: STARTUP_MODE=eager, everything loads while app.py is imported
+- lazy: STARTUP_MODE=lazy, heavy modules and the Cerebras client load on
+  first use, i.e. during the first capture
+- lazy+warm-up: STARTUP_MODE=lazy, then startup.warm_up() runs before the
+  first capture, as gunicorn.conf.py does once a worker is up
+
+The process reports the app.py import time, the warm-up time, and the time of
+its first and second capture: decode, duplicate hash, preprocessing, OCR
+normalisation and Cerebras OCR against the stand-in from bench_concurrency.py.
+The first capture minus the second is the first-use penalty. The stand-in
+answers the SDK's connection warm-up after --connect-latency seconds, standing
+in for the round trip to the real API that building the client costs.
+
+A separate `python -X importtime -c "import app"` per mode lists the
+top-level packages that take longest to import.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 3 --connect-latency 0.3]
+    python benchmarks/bench_startup.py --json --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+from bench_concurrency import ROOT, FakeCerebras, make_frames
+
+SCENARIOS = [
+    ('eager', 'eager', False),
+    ('lazy', 'lazy', False),
+    ('lazy+warm-up', 'lazy', True),
+]
+
+# Runs in the fresh process; prints one JSON line
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - started) * 1000
+import startup
+from cerebras_integration import get_ocr_pipeline, cerebras_slide_text
+from image_hash import perceptual_hash
+from image_normalization import normalize_image, OCR_TARGET
+
+warm_up_ms = None
+if sys.argv[2] == '1':
+    started = time.perf_counter()
+    startup.warm_up(background=False)
+    warm_up_ms = (time.perf_counter() - started) * 1000
+
+frames = [open(path, 'rb').read() for path in sys.argv[3:5]]
+
+def capture(jpeg):
+    started = time.perf_counter()
+    image = app.cv2.imdecode(app.np.frombuffer(jpeg, app.np.uint8), app.cv2.IMREAD_COLOR)
+    perceptual_hash(image)
+    result = get_ocr_pipeline().run(image)
+    normalize_image(image, OCR_TARGET)
+    cerebras_slide_text(result.output())
+    return (time.perf_counter() - started) * 1000
+
+first_ms = capture(frames[0])
+second_ms = capture(frames[1])
+print(json.dumps({
+    'import_ms': import_ms,
+    'warm_up_ms': warm_up_ms,
+    'first_capture_ms': first_ms,
+    'second_capture_ms': second_ms,
+    'loaded_by': {name: load['loaded_by'] for name, load in startup.stats()['loaded'].items()},
+}))
+"""
+
+
+class SlowConnect(FakeCerebras):
+    """Cerebras stand-in whose connection warm-up takes as long as a real round trip"""
+    connect_latency = 0.3
+
+    def do_GET(self):
+        threading.Event().wait(self.connect_latency)
+        self._reply({})
+
+
+def run_scenario(mode, warm_up, frame_paths, env):
+    env = dict(env, STARTUP_MODE=mode)
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, 'bench', '1' if warm_up else '0', *frame_paths],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile(mode, env, top):
+    """Top-level packages by cumulative import time (ms) under python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT, env=dict(env, STARTUP_MODE=mode), capture_output=True, text=True, check=True
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if not cumulative.strip().isdigit() or '.' in name or name == 'app':
+            continue
+        packages[name] = max(packages.get(name, 0), int(cumulative) / 1000)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{'module': name, 'ms': round(ms, 1)} for name, ms in ranked]
+
+
+def median(runs, key):
+    values = [run[key] for run in runs if run[key] is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per scenario')
+    parser.add_argument('--connect-latency', type=float, default=0.3,
+                        help='seconds the Cerebras stand-in takes to answer the client warm-up')
+    parser.add_argument('--ocr-latency', type=float, default=0.05, help='seconds the Cerebras stand-in takes per OCR')
+    parser.add_argument('--no-cerebras', action='store_true', help='start without a Cerebras key (OCR is skipped)')
+    parser.add_argument('--top', type=int, default=12, help='packages listed per import profile')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    SlowConnect.connect_latency = args.connect_latency
+    SlowConnect.latency = args.ocr_latency
+    cerebras = ThreadingHTTPServer(('127.0.0.1', 0), SlowConnect)
+    threading.Thread(target=cerebras.serve_forever, daemon=True).start()
+
+    frame_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    frame_paths = []
+    for i, frame in enumerate(make_frames(2, 1280, 720)):
+        frame_paths.append(os.path.join(frame_dir, f"frame-{i}.jpg"))
+        with open(frame_paths[-1], 'wb') as f:
+            f.write(frame)
+
+    env = dict(os.environ, OCR_ENGINE='cerebras')
+    if args.no_cerebras:
+        child_env = {key: value for key, value in env.items() if key != 'CEREBRAS_API_KEY'}
+    else:
+        child_env = dict(env, CEREBRAS_API_KEY='bench',
+                         CEREBRAS_BASE_URL=f"http://127.0.0.1:{cerebras.server_address[1]}")
+
+    scenarios = []
+    try:
+        for name, mode, warm_up in SCENARIOS:
+            runs = [run_scenario(mode, warm_up, frame_paths, child_env) for _ in range(args.repeat)]
+            first, second = median(runs, 'first_capture_ms'), median(runs, 'second_capture_ms')
+            scenarios.append({
+                'scenario': name,
+                'import_ms': median(runs, 'import_ms'),
+                'warm_up_ms': median(runs, 'warm_up_ms'),
+                'first_capture_ms': first,
+                'second_capture_ms': second,
+                'first_use_penalty_ms': round(first - second, 1),
+                'loaded_by': runs[-1]['loaded_by'],
+            })
+        profiles = {mode: import_profile(mode, child_env, args.top) for mode in ('eager', 'lazy')}
+    finally:
+        cerebras.shutdown()
+
+    report = {
+        'config': {
+            'repeat': args.repeat,
+            'connect_latency': args.connect_latency,
+            'ocr_latency': args.ocr_latency,
+            'cerebras': not args.no_cerebras,
+            'cpu_count': os.cpu_count(),
+        },
+        'scenarios': scenarios,
+        'import_profile': profiles,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"median of {args.repeat} fresh processes, Cerebras connect {args.connect_latency}s, "
+          f"OCR {args.ocr_latency}s")
+    print(f"{'scenario':<16}{'import ms':>11}{'warm-up ms':>12}{'1st capture':>13}{'2nd capture':>13}{'penalty':>10}")
+    for s in scenarios:
+        warm = f"{s['warm_up_ms']:.1f}" if s['warm_up_ms'] is not None else '-'
+        print(f"{s['scenario']:<16}{s['import_ms']:>11.1f}{warm:>12}{s['first_capture_ms']:>13.1f}"
+              f"{s['second_capture_ms']:>13.1f}{s['first_use_penalty_ms']:>10.1f}")
+    for mode, profile in profiles.items():
+        print(f"\nslowest imports ({mode}): " + ', '.join(f"{p['module']} {p['ms']:.0f} ms" for p in profile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: time to first OCR text for /process-slide versus /process-slide/stream.
+
+Runs the app under gunicorn (gunicorn.conf.py) against the Cerebras stand-in
+from bench_concurrency.py, which sends its first word after --first-token
+seconds and finishes after --ocr-latency seconds. Both routes get their own
+distinct frames (a repeated frame would be answered as a duplicate capture).
+For the JSON route, text only arrives with the full response. For the
+streaming route, the first 'text' event is timed. The final texts of the two
+routes are checked to be identical.
+
+Usage:
+    python benchmarks/bench_streaming.py [--requests 10 --ocr-latency 1.5 --first-token 0.2]
+"""
+import argparse
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from bench_concurrency import FakeCerebras, make_frames, start_server
+from bench_upload_paths import SECRET_KEY, free_port, session_cookie
+
+
+def post_json(port, cookie, body):
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('POST', '/process-slide', body=body,
+                 headers={'Content-Type': 'image/jpeg', 'Cookie': f'session={cookie}'})
+    result = json.loads(conn.getresponse().read())
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return result, elapsed, elapsed
+
+
+def post_stream(port, cookie, body):
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('POST', '/process-slide/stream', body=body,
+                 headers={'Content-Type': 'image/jpeg', 'Cookie': f'session={cookie}'})
+    response = conn.getresponse()
+    first_text = None
+    event = None
+    result = None
+    while True:
+        line = response.readline()
+        if not line:
+            break
+        line = line.decode().rstrip('\n')
+        if line.startswith('event: '):
+            event = line[7:]
+        elif line.startswith('data: '):
+            if event == 'text' and first_text is None:
+                first_text = time.perf_counter() - start
+            elif event == 'result':
+                result = json.loads(line[6:])
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return result, first_text if first_text is not None else elapsed, elapsed
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 1),
+        'max_ms': round(samples[-1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--ocr-latency', type=float, default=1.5, help='seconds until the completion is done')
+    parser.add_argument('--first-token', type=float, default=0.2, help='seconds until the first streamed word')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    FakeCerebras.latency = args.ocr_latency
+    FakeCerebras.first_token = args.first_token
+    FakeCerebras.text = ' '.join(['Lecture 5: Dynamic programming. Overlapping subproblems and optimal substructure.'] * 4)
+    cerebras = ThreadingHTTPServer(('127.0.0.1', 0), FakeCerebras)
+    cerebras.daemon_threads = True
+    threading.Thread(target=cerebras.serve_forever, daemon=True).start()
+
+    port = free_port()
+    session_db = os.path.join(tempfile.mkdtemp(prefix='bench-sessions-'), 'sessions.sqlite3')
+    env = dict(
+        os.environ,
+        SECRET_KEY=SECRET_KEY,
+        SESSION_BACKEND='sqlite',
+        SESSION_DB=session_db,
+        CEREBRAS_API_KEY='bench',
+        CEREBRAS_BASE_URL=f'http://127.0.0.1:{cerebras.server_address[1]}',
+        OCR_ENGINE='cerebras',
+        OCR_CACHE_MAX_DISTANCE='-1',  # every capture goes to OCR
+        CAPTURE_STORE_DIR=tempfile.mkdtemp(prefix='bench-captures-'),
+    )
+    frames = make_frames(2 * args.requests + 1, 1280, 720)
+    server = start_server('gthread', port, env, workers=1, threads=4)
+    routes = {'json': post_json, 'stream': post_stream}
+    timings = {name: {'first_text': [], 'total': []} for name in routes}
+    mismatches = 0
+    try:
+        cookie = session_cookie(session_db)
+        post_json(port, cookie, frames[-1])  # warm-up
+        for i in range(args.requests):
+            texts = {}
+            for offset, (name, post) in enumerate(routes.items()):
+                result, first_text, total = post(port, cookie, frames[2 * i + offset])
+                texts[name] = result['text']
+                timings[name]['first_text'].append(first_text)
+                timings[name]['total'].append(total)
+            mismatches += texts['json'] != texts['stream']
+    finally:
+        server.terminate()
+        server.wait()
+        cerebras.shutdown()
+
+    results = {
+        name: {'first_text': summarize(t['first_text']), 'total': summarize(t['total'])}
+        for name, t in timings.items()
+    }
+    if args.json:
+        print(json.dumps({'ocr_latency': args.ocr_latency, 'first_token': args.first_token,
+                          'mismatched_results': mismatches, 'results': results}, indent=2))
+        return
+
+    print(f"OCR latency {args.ocr_latency}s, first token after {args.first_token}s, {args.requests} frames")
+    print(f"{'route':<10}{'first text p50':>16}{'max':>10}{'result p50':>14}{'max':>10}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['first_text']['p50_ms']:>16}{r['first_text']['max_ms']:>10}"
+              f"{r['total']['p50_ms']:>14}{r['total']['max_ms']:>10}")
+    print(f"Final text identical for {args.requests - mismatches}/{args.requests} frames")
+
+
+if __name__ == '__main__':
+    main()
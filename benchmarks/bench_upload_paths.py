@@ -0,0 +1,181 @@
+"""
+Benchmark: bytes on the wire and server peak RSS for /process-slide upload paths.
+
+Starts app.py in a fresh subprocess per path (no Cerebras key, so OCR falls
+back immediately and the numbers reflect request handling), logs in by
+writing a session into the server's session database and signing its id
+with the same SECRET_KEY, and posts the same camera
+frame several times. Peak RSS is read from /proc (Linux only) as the high
+water mark minus the resident size after a warm-up request.
+
+Usage:
+    python benchmarks/bench_upload_paths.py [--width 1920 --height 1080 --requests 5]
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import cv2
+import numpy as np
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from session_store import ServerSessionInterface, SQLiteSessionBackend  # noqa: E402
+SECRET_KEY = 'bench-upload-paths'
+
+
+def make_frame(width, height):
+    """Synthetic camera frame: a slide with text plus sensor noise"""
+    rng = np.random.default_rng(0)
+    img = np.full((height, width, 3), 245, np.uint8)
+    cv2.rectangle(img, (0, 0), (width, height // 8), (120, 60, 20), -1)
+    scale = width / 1280
+    cv2.putText(img, "Lecture 5: Dynamic programming", (int(40 * scale), int(65 * scale)),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.4 * scale, (255, 255, 255), max(1, int(3 * scale)))
+    for i in range(6):
+        cv2.putText(img, f"- Bullet point number {i + 1} with some words", (int(60 * scale), int((170 + i * 70) * scale)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.1 * scale, (30, 30, 30), max(1, int(2 * scale)))
+    noise = rng.normal(0, 6, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def session_cookie(session_db):
+    """Create a logged-in server-side session and return its signed cookie value"""
+    app = Flask('bench')
+    app.secret_key = SECRET_KEY
+    interface = ServerSessionInterface(SQLiteSessionBackend(session_db))
+    sid = uuid.uuid4().hex
+    interface.backend.save(sid, {'user': {'sub': 'bench-user'}, '_permanent': True}, time.time() + 3600)
+    return interface.cookie_value(app, sid)
+
+
+def multipart_body(field, filename, content_type, payload):
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode()
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+    return head + payload + tail, f'multipart/form-data; boundary={boundary}'
+
+
+def build_request(path, png_bytes, jpeg_bytes):
+    if path == 'json-base64-png':
+        body = json.dumps({'image': 'data:image/png;base64,' + base64.b64encode(png_bytes).decode()}).encode()
+        return '/process-slide', body, 'application/json'
+    if path == 'raw-binary-png':
+        return '/process-slide', png_bytes, 'image/png'
+    if path == 'multipart-png':
+        body, content_type = multipart_body('image', 'slide.png', 'image/png', png_bytes)
+        return '/process-slide', body, content_type
+    if path == 'raw-binary-jpeg':
+        return '/process-slide', jpeg_bytes, 'image/jpeg'
+    raise ValueError(path)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def read_proc_kb(pid, field):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def post(port, cookie, url, body, content_type):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.request('POST', url, body=body, headers={
+        'Content-Type': content_type,
+        'Cookie': f'session={cookie}',
+    })
+    response = conn.getresponse()
+    payload = response.read()
+    conn.close()
+    return response.status, payload
+
+
+def run_path(path, png_bytes, jpeg_bytes, warm_png, warm_jpeg, n_requests):
+    port = free_port()
+    session_db = os.path.join(tempfile.mkdtemp(prefix='bench-sessions-'), 'sessions.sqlite3')
+    env = dict(os.environ, SECRET_KEY=SECRET_KEY, SESSION_BACKEND='sqlite', SESSION_DB=session_db)
+    env.pop('CEREBRAS_API_KEY', None)
+    server = subprocess.Popen(
+        [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port})"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        cookie = session_cookie(session_db)
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        url, body, content_type = build_request(path, warm_png, warm_jpeg)
+        post(port, cookie, url, body, content_type)
+        baseline_kb = read_proc_kb(server.pid, 'VmRSS')
+
+        url, body, content_type = build_request(path, png_bytes, jpeg_bytes)
+        start = time.perf_counter()
+        for _ in range(n_requests):
+            status, _ = post(port, cookie, url, body, content_type)
+            if status != 200:
+                raise RuntimeError(f"{path}: HTTP {status}")
+        elapsed = time.perf_counter() - start
+        peak_kb = read_proc_kb(server.pid, 'VmHWM')
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'path': path,
+        'request_bytes': len(body),
+        'peak_rss_delta_mb': round((peak_kb - baseline_kb) / 1024, 1),
+        'mean_request_ms': round(elapsed / n_requests * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    frame = make_frame(args.width, args.height)
+    png_bytes = cv2.imencode('.png', frame)[1].tobytes()
+    jpeg_bytes = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+    warm = make_frame(64, 36)
+    warm_png = cv2.imencode('.png', warm)[1].tobytes()
+    warm_jpeg = cv2.imencode('.jpg', warm)[1].tobytes()
+
+    paths = ['json-base64-png', 'raw-binary-png', 'multipart-png', 'raw-binary-jpeg']
+    results = [run_path(p, png_bytes, jpeg_bytes, warm_png, warm_jpeg, args.requests) for p in paths]
+
+    if args.json:
+        print(json.dumps({'frame': [args.width, args.height], 'results': results}, indent=2))
+        return
+
+    print(f"Frame: {args.width}x{args.height}, PNG {len(png_bytes)} bytes, JPEG q92 {len(jpeg_bytes)} bytes")
+    print(f"{'path':<20}{'request bytes':>15}{'peak RSS +MB':>15}{'mean ms':>10}")
+    for r in results:
+        print(f"{r['path']:<20}{r['request_bytes']:>15}{r['peak_rss_delta_mb']:>15}{r['mean_request_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""
+Per-user calendar event store kept current with Calendar sync tokens.
+
+The home, calendar and SlideSync pages all show events from the user's
+primary calendar. Rather than listing events on every page view, the store
+does one full sync per user and afterwards asks Calendar only for what
+changed since the last sync (events().list with the syncToken it returned).
+Reads between syncs are served from memory; a sync happens at most once per
+CALENDAR_REFRESH_INTERVAL, or on the next read after invalidate() when the
+app itself changed the calendar or a push notification reported a change.
+Calendars with a push channel only fall back to a slow safety-net refresh.
+"""
+import os
+import time
+import datetime
+import threading
+from collections import OrderedDict
+
+from google_calls import google_calls
+from startup import lazy_import
+
+errors = lazy_import('googleapiclient.errors')
+
+CALENDAR_REFRESH_INTERVAL = int(os.environ.get("CALENDAR_REFRESH_INTERVAL", 60))  # seconds
+# Safety-net refresh for calendars with a push channel (changes invalidate them)
+CALENDAR_WATCHED_REFRESH_INTERVAL = int(os.environ.get("CALENDAR_WATCHED_REFRESH_INTERVAL", 3600))
+CALENDAR_SYNC_PAST_DAYS = int(os.environ.get("CALENDAR_SYNC_PAST_DAYS", 1))  # history kept by the full sync
+CALENDAR_STORE_MAX_USERS = int(os.environ.get("CALENDAR_STORE_MAX_USERS", 1024))
+
+EVENT_FIELDS = 'id,status,summary,description,start,end,attachments'
+
+
+def event_start(event):
+    """Start of an event as an aware datetime (all-day events start at midnight UTC)"""
+    return _parse_time(event.get('start', {}))
+
+
+def event_end(event):
+    """End of an event as an aware datetime"""
+    return _parse_time(event.get('end', {}))
+
+
+def _parse_time(value):
+    if value.get('dateTime'):
+        return datetime.datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+    if value.get('date'):
+        return datetime.datetime.fromisoformat(value['date']).replace(tzinfo=datetime.timezone.utc)
+    return None
+
+
+class _UserCalendar:
+    def __init__(self):
+        self.events = {}  # event id -> event
+        self.sync_token = None
+        self.synced_at = 0.0
+        self.dirty = True
+        self.watched = False
+        self.lock = threading.Lock()
+
+
+class CalendarStore:
+    def __init__(self, refresh_interval=CALENDAR_REFRESH_INTERVAL, past_days=CALENDAR_SYNC_PAST_DAYS,
+                 max_users=CALENDAR_STORE_MAX_USERS, watched_refresh_interval=CALENDAR_WATCHED_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.watched_refresh_interval = watched_refresh_interval
+        self.past_days = past_days
+        self.max_users = max_users
+        self._users = OrderedDict()  # user key -> _UserCalendar
+        self._lock = threading.Lock()
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.reads = 0
+
+    def events(self, user_key, calendar_service, time_min=None, time_max=None, limit=None):
+        """
+        Events from the user's primary calendar, ordered by start time
+
+        Args:
+            user_key: Stable id of the user
+            calendar_service: Calendar API service for that user, used to sync
+            time_min: Only events ending after this aware datetime
+            time_max: Only events starting before this aware datetime
+            limit: Maximum number of events
+
+        Returns:
+            List of event dicts; each is a copy the caller may modify
+        """
+        calendar = self._calendar(user_key)
+        with calendar.lock:
+            interval = self.watched_refresh_interval if calendar.watched else self.refresh_interval
+            if calendar.dirty or time.time() - calendar.synced_at >= interval:
+                try:
+                    self._sync(user_key, calendar, calendar_service)
+                except Exception as e:
+                    if not calendar.synced_at:
+                        raise
+                    # Serve what we have; the next read tries again
+                    print(f"Error syncing calendar: {e}")
+            events = list(calendar.events.values())
+
+        with self._lock:
+            self.reads += 1
+
+        selected = []
+        for event in events:
+            start, end = event_start(event), event_end(event)
+            if start is None or end is None:
+                continue
+            if time_min is not None and end <= time_min:
+                continue
+            if time_max is not None and start >= time_max:
+                continue
+            selected.append((start, event))
+        selected.sort(key=lambda item: item[0])
+        if limit is not None:
+            selected = selected[:limit]
+        return [dict(event) for _, event in selected]
+
+    def current_event(self, user_key, calendar_service, now=None, lookahead=datetime.timedelta(hours=24)):
+        """
+        The event happening now, or else the next one within the lookahead window
+
+        Returns:
+            Event dict with 'status' set to 'in_progress' or 'upcoming', or None
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        events = self.events(user_key, calendar_service, time_min=now, time_max=now + lookahead)
+        for event in events:
+            if event.get('start', {}).get('dateTime') and event_start(event) <= now <= event_end(event):
+                event['status'] = 'in_progress'
+                return event
+        if events:
+            event = events[0]
+            event['status'] = 'upcoming'
+            return event
+        return None
+
+    def cached_event(self, user_key, event_id):
+        """The stored copy of an event, without syncing; None if it is not held"""
+        with self._lock:
+            calendar = self._users.get(user_key)
+        if calendar is None:
+            return None
+        with calendar.lock:
+            event = calendar.events.get(event_id)
+        return dict(event) if event is not None else None
+
+    def set_watched(self, user_key, watched):
+        """Mark whether changes to the user's calendar arrive as push notifications"""
+        self._calendar(user_key).watched = watched
+
+    def invalidate(self, user_key):
+        """Sync on the next read, e.g. after the app created or changed an event"""
+        with self._lock:
+            calendar = self._users.get(user_key)
+        if calendar is not None:
+            calendar.dirty = True
+
+    def drop(self, user_key):
+        """Forget everything stored for a user"""
+        with self._lock:
+            self._users.pop(user_key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'reads': self.reads,
+                'full_syncs': self.full_syncs,
+                'incremental_syncs': self.incremental_syncs,
+            }
+
+    def _calendar(self, user_key):
+        with self._lock:
+            calendar = self._users.get(user_key)
+            if calendar is None:
+                calendar = self._users[user_key] = _UserCalendar()
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_key)
+            return calendar
+
+    def _sync(self, user_key, calendar, calendar_service):
+        if calendar.sync_token:
+            try:
+                sync_token = self._list(user_key, calendar.events, calendar_service, syncToken=calendar.sync_token)
+                self._synced(calendar, sync_token)
+                with self._lock:
+                    self.incremental_syncs += 1
+                self._prune(calendar)
+                return
+            except errors.HttpError as e:
+                # 410 Gone: the sync token expired, start over with a full sync
+                if e.resp.status != 410:
+                    raise
+
+        time_min = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self.past_days)
+        # syncToken cannot be combined with orderBy/timeMax, so the full sync
+        # only bounds the start of the window; ordering is done on read
+        events = {}
+        sync_token = self._list(user_key, events, calendar_service,
+                                timeMin=time_min.isoformat().replace('+00:00', 'Z'))
+        calendar.events = events
+        self._synced(calendar, sync_token)
+        with self._lock:
+            self.full_syncs += 1
+
+    def _list(self, user_key, events, calendar_service, **params):
+        """Apply every page of an events().list to events; returns the next sync token"""
+        page_token = None
+        while True:
+            result = google_calls.execute(calendar_service.events().list(
+                calendarId='primary',
+                singleEvents=True,
+                maxResults=250,
+                pageToken=page_token,
+                fields=f'items({EVENT_FIELDS}),nextPageToken,nextSyncToken',
+                **params
+            ), user=user_key)
+            for event in result.get('items', []):
+                if event.get('status') == 'cancelled':
+                    events.pop(event['id'], None)
+                else:
+                    events[event['id']] = event
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        return result.get('nextSyncToken')
+
+    def _synced(self, calendar, sync_token):
+        calendar.sync_token = sync_token
+        calendar.synced_at = time.time()
+        calendar.dirty = False
+
+    def _prune(self, calendar):
+        # Incremental syncs never drop events that simply ended; do it here
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self.past_days)
+        for event_id in [i for i, e in calendar.events.items() if (event_end(e) or cutoff) < cutoff]:
+            del calendar.events[event_id]
+
+
+calendar_store = CalendarStore()
@@ -0,0 +1,134 @@
+"""
+Per-document index of recent captures.
+
+Every capture processed or saved for a notes document is remembered by its
+perceptual hash. A new capture that is within DUPLICATE_MAX_DISTANCE bits of
+one of the last few captures for the same document is a repeat of that slide,
+so we can answer with the earlier OCR text and skip the Drive upload and Docs
+update instead of running the whole chain again. Blank and dark frames are
+neither remembered nor matched: they all hash alike whatever slide is up.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+
+from image_hash import hamming_distance, is_blank_hash
+
+# Same threshold as OCR_CACHE_MAX_DISTANCE; benchmarks/bench_image_hash.py checks both
+DUPLICATE_MAX_DISTANCE = int(os.environ.get("DUPLICATE_MAX_DISTANCE", 40))
+CAPTURE_INDEX_DEPTH = int(os.environ.get("CAPTURE_INDEX_DEPTH", 8))  # captures remembered per document
+CAPTURE_INDEX_MAX_DOCS = int(os.environ.get("CAPTURE_INDEX_MAX_DOCS", 2048))
+
+
+class CaptureIndex:
+    def __init__(self, max_distance=DUPLICATE_MAX_DISTANCE, depth=CAPTURE_INDEX_DEPTH, max_docs=CAPTURE_INDEX_MAX_DOCS):
+        self.max_distance = max_distance
+        self.depth = depth
+        self.max_docs = max_docs
+        self._docs = OrderedDict()  # (owner, doc_id) -> deque of capture dicts
+        self._lock = threading.Lock()
+        self.skipped_ocr = 0  # repeats answered with earlier OCR text
+        self.skipped_saves = 0  # repeats not written to the document again
+
+    def find(self, owner, doc_id, image_hash):
+        """
+        Find a recent capture of the same slide for a document
+
+        Args:
+            owner: User the document index belongs to
+            doc_id: Google Doc ID
+            image_hash: Perceptual hash of the new capture
+
+        Returns:
+            Copy of the matching capture dict ('text', 'saved', 'saving',
+            'captured_at'), or None if the capture is new or blank. Callers
+            that act on the match report it with count_duplicate()
+        """
+        if is_blank_hash(image_hash):
+            return None
+        with self._lock:
+            captures = self._docs.get((owner, doc_id))
+            if not captures:
+                return None
+            self._docs.move_to_end((owner, doc_id))
+
+            best, best_distance = None, self.max_distance + 1
+            # Newest first, so ties go to the most recent capture
+            for capture in reversed(captures):
+                distance = hamming_distance(capture['hash'], image_hash)
+                if distance < best_distance:
+                    best, best_distance = capture, distance
+
+            if best is None:
+                return None
+            match = dict(best)
+            match['distance'] = best_distance
+            del match['hash']
+            return match
+
+    def record(self, owner, doc_id, image_hash, text=None, saved=False, saving=None):
+        """
+        Remember a capture, merging into an existing entry for the same hash
+
+        Args:
+            text: OCR text, if known
+            saved: The capture has been written to the document
+            saving: The capture is buffered for the document (True) or the
+                write was given up on (False); None leaves it unchanged
+
+        Blank hashes are not recorded.
+        """
+        if is_blank_hash(image_hash):
+            return
+        with self._lock:
+            key = (owner, doc_id)
+            captures = self._docs.get(key)
+            if captures is None:
+                captures = self._docs[key] = deque(maxlen=self.depth)
+            self._docs.move_to_end(key)
+
+            for capture in captures:
+                if capture['hash'] == image_hash:
+                    if text is not None:
+                        capture['text'] = text
+                    capture['saved'] = capture['saved'] or saved
+                    if saving is not None or saved:
+                        capture['saving'] = bool(saving) and not capture['saved']
+                    return
+
+            captures.append({
+                'hash': image_hash,
+                'text': text,
+                'saved': saved,
+                'saving': bool(saving) and not saved,
+                'captured_at': time.time(),
+            })
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+
+    def count_duplicate(self, saving):
+        """
+        Count a match that stopped a repeat from being processed again
+
+        Args:
+            saving: True if the match skipped a save, False if it skipped OCR
+        """
+        with self._lock:
+            if saving:
+                self.skipped_saves += 1
+            else:
+                self.skipped_ocr += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._docs),
+                'duplicates': self.skipped_ocr + self.skipped_saves,
+                'skipped_ocr': self.skipped_ocr,
+                'skipped_saves': self.skipped_saves,
+                'max_distance': self.max_distance,
+            }
+
+
+capture_index = CaptureIndex()
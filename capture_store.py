@@ -0,0 +1,191 @@
+"""
+Server-side store for processed captures.
+
+After OCR the archived rendition of a capture is kept here and the browser
+only gets a capture id and a small preview. /save-to-doc then takes the id
+instead of the browser posting the image back again.
+
+The default store lives in process memory, which is enough for a single
+worker. Set CAPTURE_STORE_DIR to a directory shared by all gunicorn workers
+to keep captures on disk so any worker can pick them up.
+"""
+import os
+import time
+import uuid
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+CAPTURE_STORE_DIR = os.environ.get("CAPTURE_STORE_DIR")
+CAPTURE_STORE_MAX_ENTRIES = int(os.environ.get("CAPTURE_STORE_MAX_ENTRIES", 256))
+CAPTURE_STORE_MAX_BYTES = int(os.environ.get("CAPTURE_STORE_MAX_BYTES", 128 * 1024 * 1024))
+CAPTURE_STORE_TTL = int(os.environ.get("CAPTURE_STORE_TTL", 2 * 3600))  # seconds
+
+
+def _owner_key(owner):
+    return hashlib.sha256(str(owner).encode('utf-8')).hexdigest()[:16]
+
+
+class MemoryCaptureStore:
+    """LRU store bounded by entry count, total bytes and age"""
+
+    def __init__(self, max_entries=CAPTURE_STORE_MAX_ENTRIES, max_bytes=CAPTURE_STORE_MAX_BYTES, ttl=CAPTURE_STORE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # capture_id -> capture dict
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def put(self, owner, data, meta=None):
+        """
+        Store an encoded capture
+
+        Args:
+            owner: User the capture belongs to
+            data: Encoded image bytes
+            meta: Small JSON-serialisable dict kept alongside the image
+
+        Returns:
+            New capture id
+        """
+        capture_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[capture_id] = {
+                'owner': owner,
+                'data': data,
+                'meta': meta or {},
+                'stored_at': time.time(),
+            }
+            self._bytes += len(data)
+            self._evict()
+        return capture_id
+
+    def get(self, capture_id, owner):
+        """Get a capture dict ('data', 'meta'), or None if unknown, expired or not the owner's"""
+        with self._lock:
+            capture = self._entries.get(capture_id)
+            if capture is None or capture['owner'] != owner:
+                return None
+            if time.time() - capture['stored_at'] > self.ttl:
+                self._remove(capture_id)
+                return None
+            self._entries.move_to_end(capture_id)
+            return capture
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, capture_id):
+        capture = self._entries.pop(capture_id)
+        self._bytes -= len(capture['data'])
+
+    def _evict(self):
+        now = time.time()
+        for capture_id in [k for k, c in self._entries.items() if now - c['stored_at'] > self.ttl]:
+            self._remove(capture_id)
+            self.evictions += 1
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+
+class DiskCaptureStore:
+    """
+    Directory-backed store shared between worker processes
+
+    Each capture is an image file plus a JSON sidecar. File names include a
+    hash of the owner, so a capture id alone does not give access to another
+    user's capture. Access time is tracked through the file mtime and the
+    least recently used files are removed once the limits are exceeded.
+    """
+
+    def __init__(self, directory, max_entries=CAPTURE_STORE_MAX_ENTRIES, max_bytes=CAPTURE_STORE_MAX_BYTES, ttl=CAPTURE_STORE_TTL):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, owner, data, meta=None):
+        capture_id = uuid.uuid4().hex
+        base = self._path(capture_id, owner)
+        # Write to temporary names first so readers never see partial files
+        with open(base + '.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta or {}, f)
+        with open(base + '.img.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(base + '.json.tmp', base + '.json')
+        os.replace(base + '.img.tmp', base + '.img')
+        self._evict()
+        return capture_id
+
+    def get(self, capture_id, owner):
+        if not capture_id.isalnum():
+            return None
+        base = self._path(capture_id, owner)
+        try:
+            if time.time() - os.path.getmtime(base + '.img') > self.ttl:
+                self._remove(base)
+                return None
+            with open(base + '.img', 'rb') as f:
+                data = f.read()
+            with open(base + '.json', encoding='utf-8') as f:
+                meta = json.load(f)
+            os.utime(base + '.img')
+        except (OSError, ValueError):
+            return None
+        return {'owner': owner, 'data': data, 'meta': meta}
+
+    def stats(self):
+        files = self._files()
+        return {
+            'backend': 'disk',
+            'entries': len(files),
+            'bytes': sum(size for _, _, size in files),
+            'evictions': self.evictions,
+        }
+
+    def _path(self, capture_id, owner):
+        return os.path.join(self.directory, f"{_owner_key(owner)}_{capture_id}")
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.img'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path[:-len('.img')], stat.st_mtime, stat.st_size))
+        return files
+
+    def _remove(self, base):
+        for suffix in ('.img', '.json'):
+            try:
+                os.remove(base + suffix)
+            except OSError:
+                pass
+
+    def _evict(self):
+        now = time.time()
+        files = sorted(self._files(), key=lambda f: f[1])
+        total = sum(size for _, _, size in files)
+        while files and (len(files) > self.max_entries or total > self.max_bytes or now - files[0][1] > self.ttl):
+            base, _, size = files.pop(0)
+            self._remove(base)
+            total -= size
+            self.evictions += 1
+
+
+capture_store = DiskCaptureStore(CAPTURE_STORE_DIR) if CAPTURE_STORE_DIR else MemoryCaptureStore()
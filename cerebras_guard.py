@@ -0,0 +1,241 @@
+"""
+Guard rails for calls to the Cerebras API.
+
+The Cerebras client used to be called with no deadline and no limit, so
+when the API slowed down every request thread ended up waiting in
+chat.completions.create. CerebrasGuard wraps the SDK client:
+
+- every call has a deadline (CEREBRAS_TIMEOUT) and is not retried by the SDK;
+- at most CEREBRAS_MAX_IN_FLIGHT calls run at once; a call that cannot get a
+  slot within CEREBRAS_QUEUE_TIMEOUT fails with Overloaded;
+- a circuit breaker opens when at least CEREBRAS_BREAKER_THRESHOLD of the last
+  CEREBRAS_BREAKER_WINDOW calls failed. While open, calls fail at once with
+  CircuitOpen; after CEREBRAS_BREAKER_COOLDOWN seconds one trial call is let
+  through and closes the breaker again if it succeeds.
+
+Callers treat CerebrasUnavailable like any other Cerebras failure and fall
+back to the next OCR engine. Every call, and every call turned away, is also
+recorded in the metrics module.
+"""
+import os
+import time
+import threading
+from collections import deque
+
+from metrics import observe_call
+
+CEREBRAS_TIMEOUT = float(os.environ.get("CEREBRAS_TIMEOUT", 15))  # seconds per call
+CEREBRAS_MAX_IN_FLIGHT = int(os.environ.get("CEREBRAS_MAX_IN_FLIGHT", 8))
+CEREBRAS_QUEUE_TIMEOUT = float(os.environ.get("CEREBRAS_QUEUE_TIMEOUT", 2))  # seconds waiting for a slot
+CEREBRAS_BREAKER_WINDOW = int(os.environ.get("CEREBRAS_BREAKER_WINDOW", 20))  # recent calls considered
+CEREBRAS_BREAKER_MIN_CALLS = int(os.environ.get("CEREBRAS_BREAKER_MIN_CALLS", 5))
+CEREBRAS_BREAKER_THRESHOLD = float(os.environ.get("CEREBRAS_BREAKER_THRESHOLD", 0.5))  # failure rate
+CEREBRAS_BREAKER_COOLDOWN = float(os.environ.get("CEREBRAS_BREAKER_COOLDOWN", 30))  # seconds
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CerebrasUnavailable(Exception):
+    """The call was not sent to Cerebras"""
+
+
+class CircuitOpen(CerebrasUnavailable):
+    """Recent calls failed too often; Cerebras is skipped until the cooldown ends"""
+
+
+class Overloaded(CerebrasUnavailable):
+    """All in-flight slots stayed busy for CEREBRAS_QUEUE_TIMEOUT"""
+
+
+class CircuitBreaker:
+    def __init__(self, window=CEREBRAS_BREAKER_WINDOW, min_calls=CEREBRAS_BREAKER_MIN_CALLS,
+                 threshold=CEREBRAS_BREAKER_THRESHOLD, cooldown=CEREBRAS_BREAKER_COOLDOWN):
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = None
+        self.opened = 0
+        self._outcomes = deque(maxlen=window)  # True for a failed call
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go out now; in half-open state only one trial at a time"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+            return True
+
+    def record(self, failed):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_running = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.threshold):
+                self._open()
+
+    def cancel(self):
+        """A call allowed by allow() was never sent; free the half-open trial"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_running = False
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            stats = {
+                'state': self.state,
+                'recent_calls': calls,
+                'recent_failure_rate': round(sum(self._outcomes) / calls, 3) if calls else 0.0,
+                'opened': self.opened,
+            }
+            if self.state == OPEN:
+                stats['retry_in'] = round(max(0.0, self.opened_at + self.cooldown - time.monotonic()), 1)
+            return stats
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.opened += 1
+        self._outcomes.clear()
+
+
+class CerebrasGuard:
+    def __init__(self, client, timeout=CEREBRAS_TIMEOUT, max_in_flight=CEREBRAS_MAX_IN_FLIGHT,
+                 queue_timeout=CEREBRAS_QUEUE_TIMEOUT, breaker=None):
+        # The guard enforces the deadline; SDK retries would multiply it
+        self.client = client.with_options(timeout=timeout, max_retries=0)
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.overloaded = 0
+        self.last_error = None
+
+    def complete(self, **kwargs):
+        """
+        chat.completions.create with a deadline, a concurrency cap and the breaker
+
+        Args:
+            **kwargs: Arguments for chat.completions.create
+
+        Returns:
+            The SDK's completion response
+
+        Raises:
+            CircuitOpen, Overloaded: the call was not sent
+            Any SDK error (including timeouts) from the call itself
+        """
+        started = self._enter('chat.completions.create')
+        try:
+            response = self.client.chat.completions.create(**kwargs)
+        except Exception as e:
+            self._exit('chat.completions.create', started, e)
+            raise
+        self._exit('chat.completions.create', started, None)
+        return response
+
+    def stream(self, **kwargs):
+        """
+        Streaming chat completion under the same limits as complete()
+
+        The in-flight slot is held until the stream is exhausted or closed;
+        the deadline applies to each read, so a stalled stream fails too.
+
+        Yields:
+            Text deltas as they arrive
+        """
+        started = self._enter('chat.completions.stream')
+        error = None
+        try:
+            chunks = self.client.chat.completions.create(stream=True, **kwargs)
+            try:
+                for chunk in chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                chunks.close()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._exit('chat.completions.stream', started, error)
+
+    def _enter(self, operation):
+        """Take an in-flight slot; returns the time the call started"""
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected += 1
+            observe_call('cerebras', operation, 'circuit_open')
+            raise CircuitOpen("Cerebras is failing; using the fallback OCR engine")
+
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+            else:
+                self.overloaded += 1
+        if not acquired:
+            self.breaker.cancel()
+            observe_call('cerebras', operation, 'overloaded')
+            raise Overloaded(f"{self.max_in_flight} Cerebras calls already in flight")
+        return time.perf_counter()
+
+    def _exit(self, operation, started, error):
+        observe_call('cerebras', operation, 'ok' if error is None else type(error).__name__,
+                     time.perf_counter() - started)
+        self.breaker.record(error is not None)
+        with self._lock:
+            self.calls += 1
+            self.in_flight -= 1
+            if error is not None:
+                self.failures += 1
+                if 'Timeout' in type(error).__name__:
+                    self.timeouts += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'max_in_flight': self.max_in_flight,
+                'timeout': self.timeout,
+                'calls': self.calls,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'rejected_open': self.rejected,
+                'rejected_overloaded': self.overloaded,
+                'last_error': self.last_error,
+            }
+        stats['breaker'] = self.breaker.stats()
+        return stats
@@ -1,29 +1,53 @@
 import os
 import base64
 import io
-from PIL import Image
-import numpy as np
-import cv2
+import threading
 from flask import jsonify
 
+from image_hash import perceptual_hash
+from ocr_cache import ocr_cache
+from image_normalization import normalize_image, resize_to_edge, OCR_TARGET, PREVIEW_TARGET
+from preprocessing import Pipeline, register_stage, PREPROCESS_STAGES, OCR_INPUT_STAGE, SOURCE
+from tesseract_ocr import extract_text_with_tesseract, tesseract_available
+from http_transport import transport_pool
+from cerebras_guard import CerebrasGuard
+from startup import lazy_import, deferred
+
+Image = lazy_import('PIL.Image')
+np = lazy_import('numpy')
+cv2 = lazy_import('cv2')
+
+# Which OCR engines to use: 'auto' tries Cerebras and falls back to local
+# Tesseract, 'cerebras' or 'tesseract' use only that engine
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto").lower()
+
 # Check if Cerebras API key is available
 CEREBRAS_API_KEY = os.environ.get("CEREBRAS_API_KEY")
 USE_CEREBRAS = CEREBRAS_API_KEY is not None
 
-# Initialize Cerebras client if API key is available
-if USE_CEREBRAS:
+def _create_cerebras_client():
+    """Cerebras client behind a CerebrasGuard, or None if it cannot be created"""
+    if not USE_CEREBRAS:
+        print("No Cerebras API key found")
+        return None
     try:
         from cerebras.cloud.sdk import Cerebras
-        cerebras_client = Cerebras(api_key=CEREBRAS_API_KEY)
+        # Reuse keep-alive connections to the Cerebras API across requests; the
+        # guard adds deadlines, a concurrency cap and a circuit breaker
+        client = CerebrasGuard(
+            Cerebras(api_key=CEREBRAS_API_KEY, http_client=transport_pool.httpx_client())
+        )
         print("Cerebras client initialized successfully")
+        return client
     except ImportError:
         print("Cerebras SDK not installed")
-        USE_CEREBRAS = False
     except Exception as e:
         print(f"Error initializing Cerebras client: {str(e)}")
-        USE_CEREBRAS = False
-else:
-    print("No Cerebras API key found")
+    return None
+
+# The SDK opens a connection to the API when the client is built, so under
+# lazy startup this happens on first use (or during the worker's warm-up)
+get_cerebras_client = deferred('cerebras_client', _create_cerebras_client)
 
 def enhance_image_with_cerebras(image_array):
     """
@@ -38,7 +62,8 @@ def enhance_image_with_cerebras(image_array):
     # Always perform basic enhancement first
     enhanced = basic_image_enhancement(image_array)
     
-    if not USE_CEREBRAS:
+    cerebras_client = get_cerebras_client()
+    if cerebras_client is None:
         return enhanced
     
     try:
@@ -58,7 +83,7 @@ def enhance_image_with_cerebras(image_array):
         """
         
         # Using simpler API call without response_format parameter
-        response = cerebras_client.chat.completions.create(
+        response = cerebras_client.complete(
             messages=[
                 {"role": "system", "content": prompt},
                 {"role": "user", "content": f"<image>{img_base64}</image>"}
@@ -98,12 +123,13 @@ def extract_text_with_cerebras(image_array):
     Returns:
         Extracted text as string
     """
-    if not USE_CEREBRAS:
+    cerebras_client = get_cerebras_client()
+    if cerebras_client is None:
         return "OCR processing unavailable - Cerebras API key required."
     
     try:
-        # Convert image to base64 for API transmission
-        _, buffer = cv2.imencode('.png', image_array)
+        # Downscale and encode the image for API transmission
+        buffer, _ = normalize_image(image_array, OCR_TARGET)
         img_base64 = base64.b64encode(buffer).decode('utf-8')
         
         # Call Cerebras API for OCR
@@ -116,7 +142,7 @@ def extract_text_with_cerebras(image_array):
         """
         
         # Using simpler API call
-        response = cerebras_client.chat.completions.create(
+        response = cerebras_client.complete(
             messages=[
                 {"role": "system", "content": prompt},
                 {"role": "user", "content": f"<image>{img_base64}</image>"}
@@ -139,81 +165,170 @@ def extract_text_with_cerebras(image_array):
         print(f"Error in Cerebras OCR: {str(e)}")
         return f"OCR processing unavailable - Issue with OCR generated via Cerebras. Error: {str(e)}"
 
+def cerebras_slide_text(image, on_text=None):
+    """
+    Extract slide text with Cerebras
+    
+    Args:
+        image: OpenCV image, already preprocessed for OCR
+        on_text: Optional callable; if given the completion is streamed and
+            on_text receives each piece of text as it arrives
+    
+    Returns:
+        Extracted text, or an empty string if Cerebras is unavailable or fails
+    """
+    cerebras_client = get_cerebras_client()
+    if cerebras_client is None:
+        return ""
+    
+    try:
+        # Downscale and encode the capture for the OCR payload
+        buffer, _ = normalize_image(image, OCR_TARGET)
+        img_base64 = base64.b64encode(buffer).decode('utf-8')
+        
+        # Call Cerebras for text extraction
+        request = dict(
+            messages=[
+                {"role": "system", "content": "Extract all visible text from this whiteboard image. Return only the text in plain format."},
+                {"role": "user", "content": f"<image>{img_base64}</image>"}
+            ],
+            model="llama3.1-8b",
+            max_tokens=1024
+        )
+        if on_text is not None:
+            parts = []
+            for delta in cerebras_client.stream(**request):
+                parts.append(delta)
+                on_text(delta)
+            return "".join(parts)
+        
+        response = cerebras_client.complete(**request)
+        if hasattr(response.choices[0].message, 'content'):
+            return response.choices[0].message.content or ""
+    except Exception as e:
+        print(f"Cerebras OCR error: {e}")
+    return ""
+
+def tesseract_slide_text(image, on_text=None):
+    """
+    Extract slide text locally with Tesseract
+    
+    Args:
+        image: OpenCV image, already preprocessed for OCR
+        on_text: Optional callable receiving the text once it is ready
+    
+    Returns:
+        Extracted text, or an empty string if Tesseract is unavailable
+    """
+    text = extract_text_with_tesseract(resize_to_edge(image, OCR_TARGET.max_edge))
+    if on_text is not None and text:
+        on_text(text)
+    return text
+
+# OCR engines share one interface: image (and an optional text callback) in,
+# text (or "") out
+OCR_ENGINES = {
+    'cerebras': cerebras_slide_text,
+    'tesseract': tesseract_slide_text,
+}
+
+def ocr_engine_order():
+    """Engines to try, in order, for the configured OCR_ENGINE"""
+    if OCR_ENGINE in OCR_ENGINES:
+        return [OCR_ENGINE]
+    engines = []
+    if get_cerebras_client() is not None:
+        engines.append('cerebras')
+    if tesseract_available():
+        engines.append('tesseract')
+    return engines
+
+def cerebras_stats():
+    """Breaker state, in-flight calls and queue depth of the Cerebras client"""
+    if not get_cerebras_client.done:
+        # Not built yet (lazy startup); don't build it just to report on it
+        return {'enabled': USE_CEREBRAS, 'initialized': False}
+    cerebras_client = get_cerebras_client()
+    if cerebras_client is None:
+        return {'enabled': False}
+    return dict(cerebras_client.stats(), enabled=True)
+
+def extract_slide_text(image, on_text=None):
+    """
+    Run OCR engines in order until one returns text
+    
+    Args:
+        image: OpenCV image, already preprocessed for OCR
+        on_text: Optional callable receiving partial text as engines produce
+            it; text from an engine that then fails may be followed by the
+            next engine's text
+    
+    Returns:
+        (text, engine name) or ("", None) if no engine produced text
+    """
+    for engine in ocr_engine_order():
+        text = OCR_ENGINES[engine](image, on_text)
+        if text and text.strip():
+            return text, engine
+    return "", None
+
 # Function to be used in your Flask routes
-def process_slide_with_cerebras(image):
+def process_slide_with_cerebras(image, slide_hash=None, on_text=None):
     """
     Process slide image with enhanced OCR capabilities
     
     Args:
         image: OpenCV image
+        slide_hash: Perceptual hash of the image, computed here if not given
+        on_text: Optional callable receiving partial OCR text as it arrives
     
     Returns:
-        Dict with processed image and extracted text
+        Dict with processed image, extracted text and where the text came from
     """
     try:
-        # Create a copy of the original image
-        original_image = image.copy()
+        # Stages never modify their input, so no defensive copy is needed
+        original_image = image
         
-        # Create an enhanced version for OCR
-        enhanced_for_ocr = image.copy()
+        # Preprocessing stages only run if the OCR consumer asks for them
+        preprocessing_run = get_ocr_pipeline().run(original_image)
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(enhanced_for_ocr, cv2.COLOR_BGR2GRAY)
-        
-        # Increase contrast
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced_gray = clahe.apply(gray)
-        
-        # Apply light thresholding to enhance text
-        _, thresh = cv2.threshold(enhanced_gray, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # Try to extract text directly using Cerebras if available
-        extracted_text = ""
-        try:
-            if 'cerebras_client' in globals():
-                # Convert image to base64
-                _, buffer = cv2.imencode('.jpg', original_image)
-                img_base64 = base64.b64encode(buffer).decode('utf-8')
-                
-                # Call Cerebras for text extraction
-                response = cerebras_client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": "Extract all visible text from this whiteboard image. Return only the text in plain format."},
-                        {"role": "user", "content": f"<image>{img_base64}</image>"}
-                    ],
-                    model="llama3.1-8b",
-                    max_tokens=1024
-                )
-                
-                if hasattr(response.choices[0].message, 'content'):
-                    extracted_text = response.choices[0].message.content
-        except Exception as e:
-            print(f"Cerebras OCR error: {e}")
-            extracted_text = ""
-        
-        # If Cerebras failed, try a manual extraction approach
+        # Reuse text from an earlier capture of the same slide if we have it
+        if slide_hash is None:
+            slide_hash = perceptual_hash(original_image)
+        extracted_text = ocr_cache.get(slide_hash) or ""
+        ocr_source = 'cache' if extracted_text else None
+        
+        # Otherwise run the configured OCR engines on the preprocessed capture
+        if not extracted_text:
+            extracted_text, ocr_source = extract_slide_text(preprocessing_run.output(get_ocr_input_stage()), on_text)
+            if extracted_text and extracted_text.strip():
+                ocr_cache.put(slide_hash, extracted_text)
+        
+        # If every engine failed, tell the user
         if not extracted_text:
             extracted_text = """Facing issues while extracting OCR"""
             
-        # Convert original image to base64 for client display
-        _, buffer = cv2.imencode('.jpg', original_image)
+        # Small preview for client display; the full capture stays on the server
+        buffer, _ = normalize_image(original_image, PREVIEW_TARGET)
         original_b64 = base64.b64encode(buffer).decode('utf-8')
         
         return {
             'success': True,
             'processed_image': f'data:image/jpeg;base64,{original_b64}',
-            'text': extracted_text.strip()
+            'text': extracted_text.strip(),
+            'ocr_source': ocr_source
         }
     except Exception as e:
         print(f"Error in image processing: {str(e)}")
         # Return original image on error
-        _, buffer = cv2.imencode('.jpg', image)
+        buffer, _ = normalize_image(image, PREVIEW_TARGET)
         original_b64 = base64.b64encode(buffer).decode('utf-8')
         
         return {
             'success': True,
             'processed_image': f'data:image/jpeg;base64,{original_b64}',
-            'text': "Error extracting text from image. Please try again with a clearer photo."
+            'text': "Error extracting text from image. Please try again with a clearer photo.",
+            'ocr_source': None
         }
 
 # Basic image enhancement function that works without Cerebras
@@ -247,4 +362,38 @@ def basic_image_enhancement(image):
         
     except Exception as e:
         print(f"Error in basic image enhancement: {str(e)}")
-        return image  # Return original on error
\ No newline at end of file
+        return image  # Return original on error
+
+# Pipeline stages backed by the enhancement helpers above
+register_stage('basic_enhancement', basic_image_enhancement)
+register_stage('cerebras_enhancement', enhance_image_with_cerebras)
+
+_ocr_pipeline = None
+_ocr_input_stage = SOURCE
+_ocr_pipeline_lock = threading.Lock()
+
+def get_ocr_pipeline():
+    """
+    Build the OCR preprocessing pipeline from PREPROCESS_STAGES on first use
+
+    Falls back to an empty pipeline (OCR reads the source image) if the
+    configuration names unknown stages or an OCR_INPUT_STAGE outside the chain.
+    """
+    global _ocr_pipeline, _ocr_input_stage
+    with _ocr_pipeline_lock:
+        if _ocr_pipeline is None:
+            try:
+                pipeline = Pipeline.from_spec(PREPROCESS_STAGES)
+                if OCR_INPUT_STAGE != SOURCE and OCR_INPUT_STAGE not in pipeline.names:
+                    raise ValueError(f"OCR_INPUT_STAGE '{OCR_INPUT_STAGE}' is not in PREPROCESS_STAGES")
+                _ocr_input_stage = OCR_INPUT_STAGE
+            except ValueError as e:
+                print(f"Invalid preprocessing configuration, using source image: {str(e)}")
+                pipeline = Pipeline([])
+            _ocr_pipeline = pipeline
+    return _ocr_pipeline
+
+def get_ocr_input_stage():
+    """Name of the pipeline stage whose output is sent for OCR"""
+    get_ocr_pipeline()
+    return _ocr_input_stage
@@ -0,0 +1,165 @@
+"""
+Per-user cache of notes document names.
+
+The calendar and SlideSync pages show the name of the document linked to each
+event. Names are looked up for all events at once: cached names are used as
+they are, and the rest go to Drive as a single batch HTTP request instead of
+one files().get round trip per event. Documents that cannot be read (deleted,
+unshared, or Drive failing) are cached as DEFAULT_DOC_NAME for
+DOC_NAME_FAILED_TTL seconds, so they are not looked up again on every page.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from google_calls import google_calls
+
+DOC_NAME_TTL = int(os.environ.get("DOC_NAME_TTL", 600))  # seconds
+# Documents with a push channel are invalidated on change, so they can be kept longer
+DOC_NAME_WATCHED_TTL = int(os.environ.get("DOC_NAME_WATCHED_TTL", 24 * 3600))
+DOC_NAME_FAILED_TTL = int(os.environ.get("DOC_NAME_FAILED_TTL", 60))  # seconds for documents that could not be read
+DOC_NAME_MAX_ENTRIES = int(os.environ.get("DOC_NAME_MAX_ENTRIES", 4096))
+DRIVE_BATCH_LIMIT = 100  # Drive accepts at most 100 calls per batch request
+
+DEFAULT_DOC_NAME = 'Linked Document'
+
+
+class DocNameCache:
+    def __init__(self, ttl=DOC_NAME_TTL, max_entries=DOC_NAME_MAX_ENTRIES, watched_ttl=DOC_NAME_WATCHED_TTL,
+                 failed_ttl=DOC_NAME_FAILED_TTL):
+        self.ttl = ttl
+        self.watched_ttl = watched_ttl
+        self.failed_ttl = failed_ttl
+        self._watched = set()  # (owner, doc_id) with a live push channel
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (owner, doc_id) -> (name, stored_at, ttl or None for the default)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.failed = 0
+
+    def lookup(self, owner, drive_service, doc_ids):
+        """
+        Get names for a set of documents
+
+        Args:
+            owner: User the documents are looked up for
+            drive_service: Drive API service for that user
+            doc_ids: Iterable of Drive file ids
+
+        Returns:
+            Dict of doc_id -> name; documents that could not be read get
+            DEFAULT_DOC_NAME
+        """
+        names = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            for doc_id in dict.fromkeys(doc_ids):
+                entry = self._entries.get((owner, doc_id))
+                ttl = self.watched_ttl if (owner, doc_id) in self._watched else self.ttl
+                if entry is not None and now - entry[1] <= (entry[2] or ttl):
+                    self._entries.move_to_end((owner, doc_id))
+                    names[doc_id] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(doc_id)
+                    self.misses += 1
+
+        for start in range(0, len(missing), DRIVE_BATCH_LIMIT):
+            fetched, failed = self._fetch(owner, drive_service, missing[start:start + DRIVE_BATCH_LIMIT])
+            for doc_id, name in fetched.items():
+                self.put(owner, doc_id, name)
+            names.update(fetched)
+            # Remember failures briefly so they are not fetched again on every page view
+            for doc_id in failed:
+                self.put(owner, doc_id, DEFAULT_DOC_NAME, ttl=self.failed_ttl)
+            if failed:
+                with self._lock:
+                    self.failed += len(failed)
+                doc_id, error = next(iter(failed.items()))
+                print(f"Error getting doc info for {len(failed)} document(s), e.g. {doc_id}: {str(error)}")
+
+        for doc_id in missing:
+            names.setdefault(doc_id, DEFAULT_DOC_NAME)
+        return names
+
+    def put(self, owner, doc_id, name, ttl=None):
+        """Remember a document name, e.g. right after creating the document"""
+        with self._lock:
+            self._entries[(owner, doc_id)] = (name, time.time(), ttl)
+            self._entries.move_to_end((owner, doc_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_watched(self, owner, doc_id, watched):
+        """Mark whether changes to a document arrive as push notifications"""
+        with self._lock:
+            if watched:
+                self._watched.add((owner, doc_id))
+            else:
+                self._watched.discard((owner, doc_id))
+
+    def invalidate(self, owner, doc_id=None):
+        """Forget one document's name, or every name cached for a user"""
+        with self._lock:
+            if doc_id is not None:
+                self._entries.pop((owner, doc_id), None)
+                return
+            for key in [key for key in self._entries if key[0] == owner]:
+                del self._entries[key]
+            self._watched = {key for key in self._watched if key[0] != owner}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'batches': self.batches,
+                'failed': self.failed,
+            }
+
+    def _fetch(self, owner, drive_service, doc_ids):
+        """
+        Look up names for up to DRIVE_BATCH_LIMIT documents in one request
+
+        Returns:
+            Dict of doc_id -> name, and dict of doc_id -> error for the
+            documents that could not be read
+        """
+        names, failed = {}, {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failed[request_id] = exception
+                return
+            names[request_id] = response.get('name', DEFAULT_DOC_NAME)
+
+        if len(doc_ids) == 1:
+            # A batch of one costs the same round trip plus multipart overhead
+            try:
+                response = google_calls.execute(drive_service.files().get(fileId=doc_ids[0], fields='name'), user=owner)
+                on_response(doc_ids[0], response, None)
+            except Exception as e:
+                on_response(doc_ids[0], None, e)
+            return names, failed
+
+        batch = drive_service.new_batch_http_request(callback=on_response)
+        for doc_id in doc_ids:
+            batch.add(drive_service.files().get(fileId=doc_id, fields='name'), request_id=doc_id)
+        try:
+            # Only files.get inside, so the batch can be retried like a read
+            google_calls.execute(batch, user=owner, api='drive', cost=len(doc_ids), idempotent=True)
+            with self._lock:
+                self.batches += 1
+        except Exception as e:
+            for doc_id in doc_ids:
+                if doc_id not in names:
+                    failed[doc_id] = e
+        return names, failed
+
+
+doc_names = DocNameCache()
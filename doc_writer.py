@@ -0,0 +1,585 @@
+"""
+Write-behind buffer for notes documents.
+
+During a lecture every capture used to be its own Docs batchUpdate. Captures
+now append their Docs requests to a per-document buffer and the buffer is
+flushed as a single batchUpdate once it holds DOC_WRITE_MAX_BATCH captures,
+once its oldest capture is DOC_WRITE_MAX_DELAY seconds old, or when the
+session ends (logout, the client leaving the SlideSync page, worker exit).
+
+The buffer lives in a SQLite journal, so captures accepted before a worker
+restart are not lost. Only Docs requests are journaled, never OAuth tokens:
+a worker flushes a user's documents with credentials it was handed during one
+of that user's requests, so journaled writes recovered after a restart go
+out on the user's next request. Several workers can share one journal file;
+a flush claims its rows first so two workers never send the same capture.
+
+When Docs rejects a batch outright (a 4xx other than rate limiting, e.g. an
+inline image it cannot fetch or a document that was deleted or unshared),
+each capture is sent on its own and the ones that still fail are moved to a
+dead-letter table instead of being retried forever. status() reports them,
+so the page can tell the user which saves did not make it, and on_outcome()
+listeners hear about every capture that was written or given up on.
+
+A batchUpdate that times out or gets a 5xx may still have been applied, and
+its inserts append, so sending it again could add the captures twice. Its
+captures are marked uncertain in the journal. Before they are sent again the
+document is read once: captures whose text is already in it count as written
+(Docs applies a batchUpdate entirely or not at all) and only the rest go out.
+
+A capture's image is uploaded to Drive while its text is already buffered:
+enqueue() takes a future for the image's Docs requests, and a flush waits for
+it (up to DOC_WRITE_UPLOAD_WAIT seconds) before sending that capture, so the
+image still lands right after its text. Captures queued behind it wait too.
+"""
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import atexit
+from concurrent import futures
+
+from google_calls import google_calls, is_ambiguous, is_permanent
+from google_services import get_discovery_document
+from http_transport import transport_pool
+from sqlite_util import thread_connection
+from startup import lazy_import
+
+discovery = lazy_import('googleapiclient.discovery')
+errors = lazy_import('googleapiclient.errors')
+
+DOC_WRITE_JOURNAL = os.environ.get(
+    "DOC_WRITE_JOURNAL", os.path.join(tempfile.gettempdir(), 'slidesync-doc-writes.sqlite3')
+)
+DOC_WRITE_MAX_BATCH = int(os.environ.get("DOC_WRITE_MAX_BATCH", 5))  # captures per batchUpdate
+DOC_WRITE_MAX_DELAY = float(os.environ.get("DOC_WRITE_MAX_DELAY", 20))  # seconds
+DOC_WRITE_RETRY_DELAY = float(os.environ.get("DOC_WRITE_RETRY_DELAY", 30))  # seconds after a failed flush
+DOC_WRITE_CLAIM_TIMEOUT = 300  # seconds before a claim left by a dead worker expires
+DOC_WRITE_FAILED_KEEP = float(os.environ.get("DOC_WRITE_FAILED_KEEP", 7 * 24 * 3600))  # seconds
+DOC_WRITE_UPLOAD_WAIT = float(os.environ.get("DOC_WRITE_UPLOAD_WAIT", 60))  # seconds a flush waits for an image
+
+# Capture outcomes reported to on_outcome() listeners
+WRITTEN = 'written'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    requests TEXT NOT NULL,
+    meta TEXT,
+    created REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    uncertain REAL,
+    awaiting REAL
+);
+CREATE INDEX IF NOT EXISTS pending_writes_doc ON pending_writes (owner, doc_id, id);
+CREATE TABLE IF NOT EXISTS failed_writes (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    requests TEXT NOT NULL,
+    meta TEXT,
+    created REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    error TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS failed_writes_doc ON failed_writes (owner, doc_id, failed_at);
+"""
+
+
+class DocWriteFailed(Exception):
+    """Docs rejected some captures for good; they were moved to the dead-letter table"""
+
+
+class DocWriteBuffer:
+    def __init__(self, path=DOC_WRITE_JOURNAL, max_batch=DOC_WRITE_MAX_BATCH, max_delay=DOC_WRITE_MAX_DELAY,
+                 retry_delay=DOC_WRITE_RETRY_DELAY):
+        self.path = path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self._credentials = {}  # owner -> google.oauth2 Credentials
+        self._status = {}  # (owner, doc_id) -> last flush outcome
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._listeners = {}  # WRITTEN / FAILED -> callables taking (owner, doc_id, meta)
+        self._attachments = {}  # row id -> future of more Docs requests for that capture
+        self.flushes = 0
+        self.flushed_captures = 0
+        self.failures = 0
+        self.failed_captures = 0
+        self.found_written = 0  # uncertain captures that turned out to be in the document
+        db = thread_connection(self.path)
+        db.executescript(_SCHEMA)
+        # Journals written by earlier versions lack the newer columns
+        columns = [column[1] for column in db.execute("PRAGMA table_info(pending_writes)")]
+        for column, kind in (('meta', 'TEXT'), ('uncertain', 'REAL'), ('awaiting', 'REAL')):
+            if column not in columns:
+                try:
+                    db.execute(f"ALTER TABLE pending_writes ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # another worker added it first
+
+    def on_outcome(self, kind, callback):
+        """Call callback(owner, doc_id, meta) for each capture WRITTEN to its document or FAILED for good"""
+        self._listeners.setdefault(kind, []).append(callback)
+
+    def enqueue(self, owner, doc_id, requests, credentials, meta=None, attachment=None):
+        """
+        Buffer the Docs requests for one capture
+
+        Args:
+            owner: User the document belongs to
+            doc_id: Notes document id
+            requests: Docs batchUpdate requests, using endOfSegmentLocation so
+                they can be concatenated with other captures
+            credentials: The user's current Credentials, used for flushing
+            meta: JSON-serializable details handed back to on_outcome()
+                listeners, e.g. the capture's hash
+            attachment: concurrent.futures.Future of more requests for this
+                capture (its inline image once the upload finishes), appended
+                to requests before the capture is flushed
+
+        Returns:
+            Flush status for the document (see status())
+        """
+        self.attach(owner, credentials)
+        db = thread_connection(self.path)
+        now = time.time()
+        with db:
+            row_id = db.execute(
+                "INSERT INTO pending_writes (owner, doc_id, requests, meta, created, awaiting) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(owner), doc_id, json.dumps(requests), json.dumps(meta), now, now if attachment else None)
+            ).lastrowid
+        if attachment is not None:
+            with self._lock:
+                self._attachments[row_id] = attachment
+        self._ensure_flusher()
+        if self._pending_count(owner, doc_id) >= self.max_batch:
+            self._wakeup.set()
+        return self.status(owner, doc_id)
+
+    def attach(self, owner, credentials):
+        """Remember the credentials to flush this user's documents with"""
+        if credentials is None:
+            return
+        with self._lock:
+            self._credentials[str(owner)] = credentials
+        self._ensure_flusher()
+
+    def detach(self, owner):
+        """Forget a user's credentials (after their final flush at logout)"""
+        with self._lock:
+            self._credentials.pop(str(owner), None)
+
+    def flush(self, owner, doc_id):
+        """
+        Send everything buffered for a document as one batchUpdate
+
+        Captures whose image is still uploading are waited for first. If Docs
+        rejects the batch for good, each capture is retried on its own and
+        those that still fail are dead-lettered. Captures left uncertain by
+        an earlier attempt are only sent if they are not in the document yet.
+
+        Returns:
+            Number of captures written
+
+        Raises:
+            DocWriteFailed: if captures were dead-lettered
+            The batchUpdate's error if it failed transiently; the captures
+            stay buffered and are retried after DOC_WRITE_RETRY_DELAY
+        """
+        owner = str(owner)
+        with self._lock:
+            credentials = self._credentials.get(owner)
+        if credentials is None:
+            return 0
+
+        rows = self._attach(doc_id, self._claim(owner, doc_id))
+        if not rows:
+            return 0
+
+        try:
+            docs_service = discovery.build_from_document(
+                get_discovery_document('docs', 'v1'),
+                http=transport_pool.authorized_http(credentials)
+            )
+            found = self._already_written(docs_service, owner, doc_id, rows)
+        except Exception as e:
+            return self._failed(owner, doc_id, rows, e)
+        if found:
+            self._written(owner, doc_id, found, sent=False)
+            rows = [row for row in rows if row not in found]
+            if not rows:
+                return len(found)
+
+        try:
+            self._batch_update(docs_service, owner, doc_id, rows)
+        except Exception as e:
+            if len(rows) == 1 or not is_permanent(e):
+                return self._failed(owner, doc_id, rows, e)
+            # One bad capture (e.g. an image URI Docs cannot fetch) must not
+            # hold back the others, so find out which ones Docs rejects
+            return len(found) + self._flush_each(docs_service, owner, doc_id, rows)
+
+        self._written(owner, doc_id, rows)
+        return len(found) + len(rows)
+
+    def flush_owner(self, owner):
+        """Flush every document of a user, e.g. when their session ends"""
+        flushed = 0
+        for doc_id in self._pending_docs(owner):
+            try:
+                flushed += self.flush(owner, doc_id)
+            except Exception as e:
+                print(f"Error flushing notes document {doc_id}: {str(e)}")
+        return flushed
+
+    def flush_all(self):
+        """Flush every document this worker holds credentials for"""
+        with self._lock:
+            owners = list(self._credentials)
+        for owner in owners:
+            self.flush_owner(owner)
+
+    def status(self, owner, doc_id):
+        """Pending and dead-lettered captures and the outcome of the last flush for a document"""
+        owner = str(owner)
+        db = thread_connection(self.path)
+        pending, oldest = db.execute(
+            "SELECT COUNT(*), MIN(created) FROM pending_writes WHERE owner = ? AND doc_id = ?",
+            (owner, doc_id)
+        ).fetchone()
+        failed, last_failed_at = db.execute(
+            "SELECT COUNT(*), MAX(failed_at) FROM failed_writes WHERE owner = ? AND doc_id = ?",
+            (owner, doc_id)
+        ).fetchone()
+        with self._lock:
+            last = dict(self._status.get((owner, doc_id), {}))
+        status = {
+            'doc_id': doc_id,
+            'pending': pending,
+            'oldest_pending_age': round(time.time() - oldest, 1) if oldest else None,
+            'last_flush_at': last.get('last_flush_at'),
+            'last_error': last.get('last_error'),
+            'failed': failed,
+        }
+        if failed:
+            status['last_failure'] = db.execute(
+                "SELECT error FROM failed_writes WHERE owner = ? AND doc_id = ? AND failed_at = ?",
+                (owner, doc_id, last_failed_at)
+            ).fetchone()[0]
+            status['last_failed_at'] = last_failed_at
+        if pending and oldest:
+            status['next_flush_in'] = round(max(0.0, oldest + self.max_delay - time.time()), 1)
+        return status
+
+    def stats(self):
+        pending = thread_connection(self.path).execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+        with self._lock:
+            return {
+                'pending_captures': pending,
+                'flushes': self.flushes,
+                'flushed_captures': self.flushed_captures,
+                'failures': self.failures,
+                'failed_captures': self.failed_captures,
+                'found_written': self.found_written,
+                'awaiting_images': len(self._attachments),
+                'max_batch': self.max_batch,
+                'max_delay': self.max_delay,
+            }
+
+    def _batch_update(self, docs_service, owner, doc_id, rows):
+        requests = []
+        for _, payload, _ in rows:
+            requests.extend(json.loads(payload))
+        try:
+            google_calls.execute(docs_service.documents().batchUpdate(
+                documentId=doc_id,
+                body={'requests': requests}
+            ), user=owner)
+        except Exception as e:
+            if is_ambiguous(e):
+                self._mark_uncertain([row_id for row_id, _, _ in rows])
+            raise
+
+    def _attach(self, doc_id, rows):
+        """
+        Add each capture's attachment to its requests, in order
+
+        Stops at the first capture whose attachment is not ready within
+        DOC_WRITE_UPLOAD_WAIT, or is still being produced by another worker;
+        it and the captures after it are released for a later flush.
+        """
+        deadline = time.time() + DOC_WRITE_UPLOAD_WAIT
+        awaiting = self._awaiting([row_id for row_id, _, _ in rows]) if rows else {}
+        ready = []
+        for index, (row_id, payload, meta) in enumerate(rows):
+            if row_id not in awaiting:
+                ready.append((row_id, payload, meta))
+                continue
+            with self._lock:
+                attachment = self._attachments.get(row_id)
+            extra = []
+            if attachment is not None:
+                try:
+                    extra = attachment.result(timeout=max(0.0, deadline - time.time()))
+                except futures.TimeoutError:
+                    self._release([row_id for row_id, _, _ in rows[index:]])
+                    break
+                except Exception as e:
+                    print(f"Attachment for a capture in notes document {doc_id} failed: {str(e)}")
+            elif time.time() - awaiting[row_id] < DOC_WRITE_CLAIM_TIMEOUT:
+                # Another worker is uploading it
+                self._release([row_id for row_id, _, _ in rows[index:]])
+                break
+            payload = json.dumps(json.loads(payload) + (extra or []))
+            db = thread_connection(self.path)
+            with db:
+                db.execute("UPDATE pending_writes SET requests = ?, awaiting = NULL WHERE id = ?", (payload, row_id))
+            with self._lock:
+                self._attachments.pop(row_id, None)
+            ready.append((row_id, payload, meta))
+        return ready
+
+    def _already_written(self, docs_service, owner, doc_id, rows):
+        """Uncertain rows whose text is already in the document"""
+        uncertain = self._uncertain_ids([row_id for row_id, _, _ in rows])
+        if not uncertain:
+            return []
+        document = google_calls.execute(docs_service.documents().get(
+            documentId=doc_id,
+            fields='body(content(paragraph(elements(textRun(content)))))'
+        ), user=owner)
+        text = _body_text(document)
+        found = []
+        for row in rows:
+            marker = _marker(row[1]) if row[0] in uncertain else None
+            if marker and marker in text:
+                found.append(row)
+        if found:
+            with self._lock:
+                self.found_written += len(found)
+            print(f"{len(found)} capture(s) for notes document {doc_id} were already written; not sending them again")
+        return found
+
+    def _flush_each(self, docs_service, owner, doc_id, rows):
+        written, dead = [], []
+        for index, row in enumerate(rows):
+            try:
+                self._batch_update(docs_service, owner, doc_id, [row])
+            except Exception as e:
+                if not is_permanent(e):
+                    # Docs is having trouble, not this capture: keep the rest for later
+                    self._written(owner, doc_id, written)
+                    self._dead_letter(owner, doc_id, dead)
+                    return self._failed(owner, doc_id, rows[index:], e)
+                dead.append((row, _describe(e)))
+                continue
+            written.append(row)
+        self._written(owner, doc_id, written)
+        self._dead_letter(owner, doc_id, dead)
+        if dead:
+            raise DocWriteFailed(f"{len(dead)} capture(s) could not be written: {dead[-1][1]}")
+        return len(written)
+
+    def _written(self, owner, doc_id, rows, sent=True):
+        if not rows:
+            return
+        self._delete([row_id for row_id, _, _ in rows])
+        with self._lock:
+            self.flushes += sent
+            self.flushed_captures += len(rows)
+            self._status[(owner, doc_id)] = {
+                'last_error': None,
+                'last_attempt_at': time.time(),
+                'last_flush_at': time.time(),
+                'last_flush_captures': len(rows),
+            }
+        self._notify(WRITTEN, owner, doc_id, rows)
+
+    def _failed(self, owner, doc_id, rows, error):
+        """Put rows back for a later retry and re-raise error"""
+        self._release([row_id for row_id, _, _ in rows])
+        with self._lock:
+            self.failures += 1
+            self._status[(owner, doc_id)] = {
+                'last_error': str(error),
+                'last_attempt_at': time.time(),
+                'last_flush_at': self._status.get((owner, doc_id), {}).get('last_flush_at'),
+            }
+        raise error
+
+    def _dead_letter(self, owner, doc_id, dead):
+        if not dead:
+            return
+        now = time.time()
+        db = thread_connection(self.path)
+        with db:
+            db.executemany(
+                "INSERT INTO failed_writes (id, owner, doc_id, requests, meta, created, failed_at, error) "
+                "SELECT id, owner, doc_id, requests, meta, created, ?, ? FROM pending_writes WHERE id = ?",
+                [(now, error, row_id) for (row_id, _, _), error in dead]
+            )
+            db.executemany("DELETE FROM pending_writes WHERE id = ?", [(row_id,) for (row_id, _, _), _ in dead])
+            db.execute("DELETE FROM failed_writes WHERE failed_at < ?", (now - DOC_WRITE_FAILED_KEEP,))
+        # Reported through status()'s 'failed' and 'last_failure'. last_error
+        # is for captures still waiting to be retried, and none are left
+        with self._lock:
+            self.failed_captures += len(dead)
+            if (owner, doc_id) in self._status:
+                self._status[(owner, doc_id)]['last_error'] = None
+        print(f"Gave up on {len(dead)} capture(s) for notes document {doc_id}: {dead[-1][1]}")
+        self._notify(FAILED, owner, doc_id, [row for row, _ in dead])
+
+    def _notify(self, kind, owner, doc_id, rows):
+        for _, _, meta in rows:
+            for callback in self._listeners.get(kind, []):
+                try:
+                    callback(owner, doc_id, json.loads(meta) if meta else None)
+                except Exception as e:
+                    print(f"Doc write {kind} listener failed: {str(e)}")
+
+
+    def _claim(self, owner, doc_id):
+        db = thread_connection(self.path)
+        now = time.time()
+        claimer = f"{os.getpid()}:{threading.get_ident()}"
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute(
+                "SELECT id, requests, meta FROM pending_writes WHERE owner = ? AND doc_id = ? "
+                "AND (claimed_at IS NULL OR claimed_at < ?) ORDER BY id",
+                (owner, doc_id, now - DOC_WRITE_CLAIM_TIMEOUT)
+            ).fetchall()
+            if rows:
+                db.executemany(
+                    "UPDATE pending_writes SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                    [(claimer, now, row_id) for row_id, _, _ in rows]
+                )
+        return rows
+
+    def _release(self, ids):
+        db = thread_connection(self.path)
+        with db:
+            db.executemany("UPDATE pending_writes SET claimed_by = NULL, claimed_at = NULL WHERE id = ?",
+                           [(row_id,) for row_id in ids])
+
+    def _mark_uncertain(self, ids):
+        db = thread_connection(self.path)
+        with db:
+            db.executemany("UPDATE pending_writes SET uncertain = ? WHERE id = ?",
+                           [(time.time(), row_id) for row_id in ids])
+
+    def _awaiting(self, ids):
+        """Row id -> time it was queued, for rows whose attachment is not in the journal yet"""
+        placeholders = ', '.join('?' * len(ids))
+        rows = thread_connection(self.path).execute(
+            f"SELECT id, awaiting FROM pending_writes WHERE awaiting IS NOT NULL AND id IN ({placeholders})", ids
+        ).fetchall()
+        return dict(rows)
+
+    def _uncertain_ids(self, ids):
+        placeholders = ', '.join('?' * len(ids))
+        rows = thread_connection(self.path).execute(
+            f"SELECT id FROM pending_writes WHERE uncertain IS NOT NULL AND id IN ({placeholders})", ids
+        ).fetchall()
+        return {row_id for row_id, in rows}
+
+    def _delete(self, ids):
+        db = thread_connection(self.path)
+        with db:
+            db.executemany("DELETE FROM pending_writes WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def _pending_count(self, owner, doc_id):
+        return thread_connection(self.path).execute(
+            "SELECT COUNT(*) FROM pending_writes WHERE owner = ? AND doc_id = ?", (str(owner), doc_id)
+        ).fetchone()[0]
+
+    def _pending_docs(self, owner):
+        rows = thread_connection(self.path).execute(
+            "SELECT DISTINCT doc_id FROM pending_writes WHERE owner = ?", (str(owner),)
+        ).fetchall()
+        return [doc_id for doc_id, in rows]
+
+    def _due(self):
+        """(owner, doc_id) pairs this worker should flush now"""
+        with self._lock:
+            owners = set(self._credentials)
+            status = dict(self._status)
+        if not owners:
+            return []
+        now = time.time()
+        rows = thread_connection(self.path).execute(
+            "SELECT owner, doc_id, COUNT(*), MIN(created) FROM pending_writes "
+            "WHERE claimed_at IS NULL OR claimed_at < ? GROUP BY owner, doc_id",
+            (now - DOC_WRITE_CLAIM_TIMEOUT,)
+        ).fetchall()
+        due = []
+        for owner, doc_id, count, oldest in rows:
+            if owner not in owners:
+                continue
+            last = status.get((owner, doc_id), {})
+            if last.get('last_error') and now - last['last_attempt_at'] < self.retry_delay:
+                continue
+            if count >= self.max_batch or now - oldest >= self.max_delay:
+                due.append((owner, doc_id))
+        return due
+
+    def _ensure_flusher(self):
+        # Started lazily so gunicorn forks workers before any thread exists
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._flush_loop, name='doc-writer', daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(timeout=1.0)
+            self._wakeup.clear()
+            try:
+                for owner, doc_id in self._due():
+                    try:
+                        self.flush(owner, doc_id)
+                    except Exception as e:
+                        print(f"Error flushing notes document {doc_id}: {str(e)}")
+            except Exception as e:
+                print(f"Doc write flusher error: {str(e)}")
+
+
+def _body_text(document):
+    """All text in a document's body, as returned by documents.get"""
+    return ''.join(
+        element.get('textRun', {}).get('content', '')
+        for block in document.get('body', {}).get('content', [])
+        for element in block.get('paragraph', {}).get('elements', [])
+    )
+
+
+def _marker(payload):
+    """Text a capture inserts first (its heading and OCR text), to look for in the document"""
+    for request in json.loads(payload):
+        text = request.get('insertText', {}).get('text', '').strip()
+        if text:
+            return text
+    return None
+
+
+def _describe(error):
+    """Short reason for a capture that could not be written, shown to the user"""
+    if isinstance(error, errors.HttpError):
+        return f"Google Docs returned {error.resp.status}: {error.reason}"
+    return str(error)
+
+
+doc_writer = DocWriteBuffer()
+
+# Last chance to write buffered captures when the worker shuts down cleanly
+atexit.register(doc_writer.flush_all)
@@ -0,0 +1,336 @@
+"""
+Rate limiting and retries for Google API calls.
+
+Every Google request goes through google_calls.execute() instead of a bare
+request.execute():
+
+- Each (user, API) pair has a token bucket sized below Google's per-user
+  quotas, so a burst of captures waits briefly for a token instead of
+  running into 429s. A call that would wait longer than GOOGLE_RATE_MAX_WAIT
+  fails straight away with RateLimited.
+- 429s and rate-limit 403s are retried with exponential backoff and full
+  jitter. A Retry-After header wins over the computed delay, and a 429 also
+  empties the bucket so the user's other calls to that API back off too.
+- 5xx responses, timeouts and dropped connections are ambiguous: Google may
+  have carried out the request before the answer was lost. They are only
+  retried for reads (GET and HEAD) and calls the caller marks idempotent.
+  A write such as documents.batchUpdate (which appends), files.create or
+  events.insert would be applied twice, so for writes only failures to
+  connect, which happen before anything was sent, are retried.
+- stats() counts calls sent, throttled calls, retries (by status), calls
+  that failed for good and writes left unretried, per API. Each attempt is
+  also timed in the metrics module, per API method and outcome.
+
+GOOGLE_RATE_LIMITS overrides the buckets as "api=rate:burst,..." with rate in
+calls per second, e.g. "docs=1:10,drive=10:20".
+"""
+import os
+import json
+import time
+import email.utils
+import random
+import socket
+import threading
+from collections import OrderedDict
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from metrics import observe_call
+from startup import lazy_import
+
+errors = lazy_import('googleapiclient.errors')
+
+# Docs allows 60 writes per minute per user; Calendar and Drive are roomier
+DEFAULT_RATE_LIMITS = "calendar=5:10,drive=10:20,docs=1:10,people=1:5"
+GOOGLE_RATE_LIMITS = os.environ.get("GOOGLE_RATE_LIMITS", DEFAULT_RATE_LIMITS)
+GOOGLE_DEFAULT_RATE_LIMIT = os.environ.get("GOOGLE_DEFAULT_RATE_LIMIT", "5:10")  # APIs not listed above
+GOOGLE_RATE_MAX_WAIT = float(os.environ.get("GOOGLE_RATE_MAX_WAIT", 10))  # seconds
+GOOGLE_RETRY_MAX = int(os.environ.get("GOOGLE_RETRY_MAX", 5))
+GOOGLE_RETRY_BASE = float(os.environ.get("GOOGLE_RETRY_BASE", 0.5))  # seconds
+GOOGLE_RETRY_CAP = float(os.environ.get("GOOGLE_RETRY_CAP", 32))  # seconds
+GOOGLE_RETRY_DEADLINE = float(os.environ.get("GOOGLE_RETRY_DEADLINE", 60))  # seconds for all attempts
+MAX_BUCKETS = 4096
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+TRANSPORT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, socket.timeout,
+                    ConnectionError)
+# HTTP methods that only read, so sending them twice does no harm
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+
+class RateLimited(Exception):
+    """The user's token bucket for an API would not refill within GOOGLE_RATE_MAX_WAIT"""
+
+
+def parse_rate_limits(spec):
+    """Parse "api=rate:burst,..." into {api: (rate, burst)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        api, _, value = item.partition('=')
+        limits[api.strip()] = _parse_limit(value)
+    return limits
+
+
+def _parse_limit(value):
+    rate, _, burst = value.partition(':')
+    rate = float(rate)
+    return rate, float(burst) if burst else max(1.0, rate)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost=1, max_wait=None):
+        """
+        Take tokens, possibly ahead of time
+
+        Returns:
+            Seconds the caller must wait before using its tokens, or None
+            (and nothing taken) if that would be longer than max_wait
+        """
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (cost - self.tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.tokens -= cost
+            return wait
+
+    def drain(self):
+        """Spend whatever is left, e.g. after Google answered 429"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class GoogleCallScheduler:
+    def __init__(self, limits=GOOGLE_RATE_LIMITS, default_limit=GOOGLE_DEFAULT_RATE_LIMIT,
+                 max_wait=GOOGLE_RATE_MAX_WAIT, max_retries=GOOGLE_RETRY_MAX, retry_base=GOOGLE_RETRY_BASE,
+                 retry_cap=GOOGLE_RETRY_CAP, deadline=GOOGLE_RETRY_DEADLINE):
+        self.limits = parse_rate_limits(limits)
+        self.default_limit = _parse_limit(default_limit)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.deadline = deadline
+        self._buckets = OrderedDict()  # (user, api) -> TokenBucket
+        self._counters = {}  # api -> counters
+        self._lock = threading.Lock()
+
+    def execute(self, request, user=None, api=None, cost=1, idempotent=None):
+        """
+        Execute a googleapiclient request within the user's quota, retrying transient errors
+
+        Args:
+            request: HttpRequest or BatchHttpRequest
+            user: Stable id of the user the call is made for ('sub'); None
+                shares one bucket between all anonymous calls
+            api: API name; taken from the request's method id if omitted
+                (required for batch requests)
+            cost: Tokens the call uses, e.g. the number of requests in a batch
+            idempotent: Whether sending the request twice has the same effect
+                as sending it once; by default only GET and HEAD requests
+                are (batch requests are POSTs)
+
+        Returns:
+            The response, as request.execute() would return it
+
+        Raises:
+            RateLimited: if the user's bucket would not refill in time
+            HttpError and transport errors once retries are exhausted
+        """
+        api = api or _api_name(request)
+        operation = getattr(request, 'methodId', None) or f"{api}.batch"
+        if idempotent is None:
+            idempotent = getattr(request, 'method', None) in IDEMPOTENT_METHODS
+        bucket = self._bucket(user, api)
+        cost = min(cost, bucket.burst)  # a large batch waits for a full bucket, not forever
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self._throttle(bucket, api, operation, cost)
+            self._count(api, 'calls')
+            started = time.perf_counter()
+            try:
+                result = request.execute()
+            except Exception as e:
+                observe_call('google', operation, _outcome(e), time.perf_counter() - started)
+                status, retry_after = _retry_info(e)
+                if not idempotent and is_ambiguous(e):
+                    self._count(api, 'writes_not_retried')
+                    print(f"Google {operation} failed with {status}; not retried, the write may have been applied")
+                    status = None
+                if status is None or attempt >= self.max_retries:
+                    self._count(api, 'failures')
+                    raise
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, self.retry_base)
+                else:
+                    delay = random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** attempt))
+                if time.monotonic() + delay > deadline:
+                    self._count(api, 'failures')
+                    raise
+                if status in (429, 403):
+                    bucket.drain()
+                self._count(api, 'retries', status=status)
+                print(f"Google {api} call failed with {status}, retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            observe_call('google', operation, 'ok', time.perf_counter() - started)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buckets': len(self._buckets),
+                'apis': {api: dict(counters, retried_statuses=dict(counters['retried_statuses']))
+                         for api, counters in self._counters.items()},
+            }
+
+    def _throttle(self, bucket, api, operation, cost):
+        wait = bucket.reserve(cost, self.max_wait)
+        if wait is None:
+            self._count(api, 'rate_limited')
+            observe_call('google', operation, 'rate_limited')
+            raise RateLimited(f"Too many {api} calls; try again shortly")
+        if wait > 0:
+            self._count(api, 'throttled', wait=wait)
+            time.sleep(wait)
+
+    def _bucket(self, user, api):
+        key = (user, api)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(*self.limits.get(api, self.default_limit))
+                while len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def _count(self, api, counter, status=None, wait=0.0):
+        with self._lock:
+            counters = self._counters.setdefault(api, {
+                'calls': 0, 'throttled': 0, 'throttle_wait_s': 0.0, 'rate_limited': 0,
+                'retries': 0, 'retried_statuses': {}, 'failures': 0, 'writes_not_retried': 0,
+            })
+            counters[counter] += 1
+            if wait:
+                counters['throttle_wait_s'] = round(counters['throttle_wait_s'] + wait, 3)
+            if status is not None:
+                statuses = counters['retried_statuses']
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+
+def _api_name(request):
+    # HttpRequest.methodId looks like 'docs.documents.batchUpdate'
+    method_id = getattr(request, 'methodId', None)
+    if not method_id:
+        raise ValueError("Pass api= for requests without a method id (batch requests)")
+    return method_id.split('.', 1)[0]
+
+
+def _outcome(error):
+    if isinstance(error, errors.HttpError):
+        return str(error.resp.status)
+    if isinstance(error, TRANSPORT_ERRORS):
+        return 'connection'
+    return type(error).__name__
+
+
+def _retry_info(error):
+    """(status, Retry-After seconds) for a retryable error, or (None, None)"""
+    if isinstance(error, TRANSPORT_ERRORS):
+        return 'connection', None
+    if not isinstance(error, errors.HttpError):
+        return None, None
+
+    status = error.resp.status
+    if status == 403 and _error_reason(error) not in RATE_LIMIT_REASONS:
+        return None, None
+    if status != 403 and status not in RETRY_STATUSES:
+        return None, None
+    return status, _retry_after(error.resp.get('retry-after'))
+
+
+def is_ambiguous(error):
+    """
+    Whether a failed call may still have been carried out by Google
+
+    True for 5xx responses, timeouts and dropped connections. Writes that
+    fail this way are not retried (see GoogleCallScheduler.execute); callers
+    that send them again later must check first whether they went through.
+    """
+    return _retry_info(error)[0] is not None and not _safe_to_resend(error)
+
+
+def _safe_to_resend(error):
+    """
+    Whether a retryable error shows Google did not act on the request
+
+    True for 429 and rate-limit 403 answers, and for transport errors raised
+    while connecting (refused, DNS failure, connect timeout), before any of
+    the request was sent.
+    """
+    if isinstance(error, errors.HttpError):
+        return error.resp.status in (429, 403)  # _retry_info only lets rate-limit 403s through
+    if isinstance(error, (requests.exceptions.ConnectTimeout, ConnectionRefusedError)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # requests wraps urllib3's MaxRetryError, whose reason is the underlying error
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+def is_permanent(error):
+    """
+    Whether Google rejected the request itself, so sending it again cannot succeed
+
+    True for 4xx responses other than 408, 429 and rate-limit 403s, e.g. a
+    malformed request or a document that was deleted or unshared.
+    """
+    if not isinstance(error, errors.HttpError):
+        return False
+    status = error.resp.status
+    if not 400 <= status < 500 or status in (408, 429):
+        return False
+    return not (status == 403 and _error_reason(error) in RATE_LIMIT_REASONS)
+
+
+def _error_reason(error):
+    try:
+        return json.loads(error.content)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def _retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        # HTTP-date form
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+google_calls = GoogleCallScheduler()
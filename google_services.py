@@ -0,0 +1,170 @@
+"""
+Process-wide factory for Google API service objects.
+
+googleapiclient's build() reads and parses the discovery document and wires up
+a fresh Resource tree every time it is called. The routes in app.py need up to
+three services per request, so we keep the parsed discovery documents around
+for the life of the process and reuse authorized service handles per user.
+"""
+import os
+import json
+import time
+import threading
+import hashlib
+from collections import OrderedDict
+
+from http_transport import transport_pool
+from startup import lazy_import
+
+discovery = lazy_import('googleapiclient.discovery')
+discovery_cache = lazy_import('googleapiclient.discovery_cache')
+
+# Pool sizing, overridable from the environment
+SERVICE_POOL_MAX_ENTRIES = int(os.environ.get("SERVICE_POOL_MAX_ENTRIES", 256))
+SERVICE_POOL_TTL = int(os.environ.get("SERVICE_POOL_TTL", 1800))  # seconds idle
+
+# Optional directory with discovery documents pinned by the deployment.
+# Falls back to the documents bundled with google-api-python-client.
+DISCOVERY_DIR = os.environ.get("GOOGLE_DISCOVERY_DIR")
+
+# Send every API call to another host, e.g. tools/fake_google_quota.py
+GOOGLE_API_ROOT = os.environ.get("GOOGLE_API_ROOT")
+
+_discovery_lock = threading.Lock()
+_discovery_docs = {}
+
+
+def get_discovery_document(api_name, api_version):
+    """
+    Load and parse a discovery document once per process
+
+    Args:
+        api_name: Google API name, e.g. 'calendar'
+        api_version: API version, e.g. 'v3'
+
+    Returns:
+        Parsed discovery document as a dict
+    """
+    key = (api_name, api_version)
+    doc = _discovery_docs.get(key)
+    if doc is not None:
+        return doc
+
+    with _discovery_lock:
+        doc = _discovery_docs.get(key)
+        if doc is None:
+            content = None
+            if DISCOVERY_DIR:
+                path = os.path.join(DISCOVERY_DIR, f"{api_name}.{api_version}.json")
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as f:
+                        content = f.read()
+            if content is None:
+                content = discovery_cache.get_static_doc(api_name, api_version)
+            if content is None:
+                raise ValueError(f"No bundled discovery document for {api_name} {api_version}")
+            doc = json.loads(content)
+            if GOOGLE_API_ROOT:
+                root = GOOGLE_API_ROOT.rstrip('/') + '/'
+                doc['rootUrl'] = doc['mtlsRootUrl'] = root
+                doc['baseUrl'] = root + doc.get('servicePath', '')
+            _discovery_docs[key] = doc
+    return doc
+
+
+def token_fingerprint(token):
+    """Short, non-reversible identifier for an OAuth access token"""
+    access_token = (token or {}).get('access_token') or ''
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+
+
+class ServicePool:
+    """
+    LRU pool of authorized service handles keyed by user, API and token
+
+    Entries are evicted when the pool exceeds max_entries (least recently used
+    first) or when they have not been used for ttl seconds. A new access token
+    produces a new key, so refreshed credentials never reuse a stale handle.
+    """
+
+    def __init__(self, max_entries=SERVICE_POOL_MAX_ENTRIES, ttl=SERVICE_POOL_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_key, api_name, api_version, token_key, credentials_factory):
+        """
+        Get a service handle, building it on a miss
+
+        Args:
+            user_key: Stable identifier for the user (e.g. OpenID 'sub')
+            api_name: Google API name
+            api_version: API version
+            token_key: Fingerprint of the access token the handle is bound to
+            credentials_factory: Callable returning Credentials, only called on a miss
+
+        Returns:
+            googleapiclient Resource, or None if no credentials are available
+        """
+        key = (user_key, api_name, api_version, token_key)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries[key] = (entry[0], now)
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        credentials = credentials_factory()
+        if not credentials:
+            return None
+
+        # All handles share the process-wide keep-alive connection pool
+        service = discovery.build_from_document(
+            get_discovery_document(api_name, api_version),
+            http=transport_pool.authorized_http(credentials)
+        )
+
+        with self._lock:
+            self._entries[key] = (service, now)
+            self._entries.move_to_end(key)
+            self._evict(now)
+        return service
+
+    def invalidate_user(self, user_key):
+        """Drop every handle held for a user (e.g. on logout)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_key]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _evict(self, now):
+        # Expired entries first, then least recently used beyond the size cap
+        for key in [k for k, (_, used) in self._entries.items() if now - used > self.ttl]:
+            del self._entries[key]
+            self.evictions += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+service_pool = ServicePool()
@@ -0,0 +1,80 @@
+"""
+Gunicorn configuration for SlideSync (picked up automatically from the
+working directory by `gunicorn app:app`).
+
+Requests spend almost all their time waiting on Google APIs and Cerebras, so
+each worker process serves many requests at once with threads (the gthread
+worker) instead of one at a time (the default sync worker). Everything the
+request threads share (service pool, HTTP transports, caches, stores, OCR
+queue) is guarded by locks, and the Google clients go through the thread-safe
+pooled transport in http_transport.py. Each of these is a module-level
+object (service_pool, ocr_queue, ocr_cache, doc_writer, ...) created when
+app.py imports its module, so there is one per worker process, shared by all
+of that worker's request threads.
+
+Green-thread workers (gevent/eventlet) are not supported: OpenCV, SQLite and
+the Tesseract process pool block the whole hub.
+
+One worker process is the default; scale with GUNICORN_THREADS. OCR jobs,
+the OCR result cache, the duplicate-capture index and (unless
+CAPTURE_STORE_DIR is set) captures live in each worker's memory, and
+gunicorn sends a client's requests to whichever worker is free. With
+several workers, /ocr-jobs/<id> 404s when another worker polls the job,
+saves by capture id fall back to re-uploading, and the cache and duplicate
+hit rates drop. Only raise WEB_CONCURRENCY once that state is shared.
+
+    WEB_CONCURRENCY   worker processes (default 1, see above)
+    GUNICORN_THREADS  request threads per worker (default 16)
+    GUNICORN_TIMEOUT  seconds a worker may go silent before it is restarted
+    METRICS_DIR       where workers share metrics snapshots (default: a new temp dir)
+    STARTUP_MODE      'lazy' (default here) or 'eager' loading of heavy modules, see startup.py
+    STARTUP_WARMUP    0 to skip loading them in the background once a worker is up
+"""
+import os
+import tempfile
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = 'gthread'
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+
+# gthread workers heartbeat from their main loop, so a slow Google or
+# Cerebras call does not count against this; it only catches a wedged worker
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# Time for atexit handlers (buffered notes writes) on restart or deploy
+graceful_timeout = 30
+keepalive = 5
+
+# Let OCR jobs use as many threads as there are request threads: a job
+# mostly waits on Cerebras, and the Tesseract fallback has its own process pool
+os.environ.setdefault("OCR_WORKERS", str(threads))
+
+# Not preloaded: the app starts background threads and pools lazily, and
+# each worker must create its own after the fork
+preload_app = False
+
+# Workers import OpenCV, googleapiclient and the Cerebras client on first use
+# or in the background warm-up below, so a restarted worker is back sooner
+os.environ.setdefault("STARTUP_MODE", "lazy")
+
+# Workers write their metrics snapshots here so /metrics covers every worker;
+# a fresh directory per master, so counts start at zero like any restart
+if not os.environ.get("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix='slidesync-metrics-')
+
+
+def on_starting(server):
+    # A fixed METRICS_DIR may still hold the previous run's snapshots
+    from metrics import clear_snapshots
+    clear_snapshots(os.environ["METRICS_DIR"])
+    if workers > 1:
+        # Some hosts set WEB_CONCURRENCY on their own
+        server.log.warning("WEB_CONCURRENCY=%s: OCR jobs, the OCR cache, the duplicate index and in-memory "
+                           "captures are per worker, so async OCR polls and capture-id saves can miss; "
+                           "see gunicorn.conf.py", workers)
+
+
+def post_worker_init(worker):
+    # The app is imported; load what it deferred while the worker starts serving
+    import startup
+    if startup.STARTUP_WARMUP:
+        startup.warm_up()
@@ -0,0 +1,141 @@
+"""
+Shared keep-alive HTTP transports for Google APIs and Cerebras.
+
+googleapiclient gives every service object its own httplib2.Http, which keeps
+at most one connection per host and is not safe to share between threads, so
+in practice most calls paid for a fresh TLS handshake. Instead, all Google
+API traffic goes through one requests.Session per process, behind a small
+httplib2-compatible adapter. Its urllib3 pools keep up to HTTP_POOL_SIZE
+idle connections per host. The Cerebras SDK gets one shared httpx.Client
+with the same limits.
+
+stats() reports, per host, how many requests were sent and how many new
+connections that took; the difference is the number of reused connections.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from startup import lazy_import
+
+httplib2 = lazy_import('httplib2')
+httpx = lazy_import('httpx')
+google_auth_httplib2 = lazy_import('google_auth_httplib2')
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))  # idle connections kept per host
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", 8))  # hosts with a connection pool
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 60))  # seconds
+
+# httplib2 strips these after decoding the body; requests decodes too
+_DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+
+class PooledHttp:
+    """
+    httplib2.Http stand-in backed by a shared, thread-safe requests.Session
+
+    Implements the subset of the httplib2 interface googleapiclient and
+    google-auth-httplib2 use: request() returning (Response, bytes).
+    """
+
+    def __init__(self, session, timeout=HTTP_TIMEOUT):
+        self.session = session
+        self.timeout = timeout
+        # googleapiclient and google-auth-httplib2 read these attributes
+        self.redirect_codes = httplib2.Http().redirect_codes
+        self.follow_redirects = True
+        self.connections = {}
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        # Only plain reads follow redirects; resumable uploads need the raw 308
+        response = self.session.request(
+            method,
+            uri,
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+            allow_redirects=method in ('GET', 'HEAD'),
+        )
+        info = {k.lower(): v for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS}
+        info['status'] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+    def close(self):
+        # The session is shared; nothing to release per service object
+        pass
+
+
+class TransportPool:
+    def __init__(self, pool_size=HTTP_POOL_SIZE, pool_hosts=HTTP_POOL_HOSTS, timeout=HTTP_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._adapter = adapter
+        self._httpx_client = None
+        self._httpx_counts = {}  # host -> [requests, new connections]
+        self._lock = threading.Lock()
+
+    def authorized_http(self, credentials):
+        """Authorized httplib2-compatible transport for build_from_document(http=...)"""
+        return google_auth_httplib2.AuthorizedHttp(credentials, http=PooledHttp(self.session, self.timeout))
+
+    def httpx_client(self):
+        """Shared httpx.Client for SDKs built on httpx (Cerebras)"""
+        with self._lock:
+            if self._httpx_client is None:
+                self._httpx_client = httpx.Client(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size * 2,
+                        max_keepalive_connections=self.pool_size,
+                    ),
+                    event_hooks={'request': [self._trace_httpx]},
+                )
+            return self._httpx_client
+
+    def stats(self):
+        """Requests and new connections per host since the process started"""
+        hosts = {}
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            self._add(hosts, pool.host, pool.num_requests, pool.num_connections)
+        with self._lock:
+            for host, (sent, connections) in self._httpx_counts.items():
+                self._add(hosts, host, sent, connections)
+        return {
+            'pool_size': self.pool_size,
+            'hosts': hosts,
+        }
+
+    def _add(self, hosts, host, sent, connections):
+        entry = hosts.setdefault(host, {'requests': 0, 'connections': 0})
+        entry['requests'] += sent
+        entry['connections'] += connections
+        entry['reused'] = entry['requests'] - entry['connections']
+        entry['reuse_rate'] = round(entry['reused'] / entry['requests'], 3) if entry['requests'] else 0.0
+
+    def _trace_httpx(self, request):
+        host = request.url.host
+        with self._lock:
+            self._httpx_counts.setdefault(host, [0, 0])[0] += 1
+
+        # httpcore reports connection setup through the trace extension; it
+        # only fires when the pool has no idle connection to reuse
+        def trace(event, info):
+            if event == 'connection.connect_tcp.started':
+                with self._lock:
+                    self._httpx_counts[host][1] += 1
+
+        request.extensions['trace'] = trace
+
+
+# Shared by every Google service and the Cerebras client in this worker process
+transport_pool = TransportPool()
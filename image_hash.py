@@ -0,0 +1,180 @@
+"""
+Perceptual hashing for slide images.
+
+Slides are mostly flat background with text, so the hash is built from where
+the text is rather than from overall brightness. Captures of the same slide
+are rarely framed the same way twice (the phone moves a little, the slide is
+photographed on a wall), so before hashing the capture is aligned:
+
+1. If the slide is a bright quadrilateral inside a darker room, it is located
+   and warped to fill the frame.
+2. The text is binarized with an adaptive threshold. Flat black fill touching
+   the frame (rotation corners, letterboxing) is ignored.
+3. The text is deskewed, and cropped to the box that holds it, so shifts and
+   small changes of scale or rotation drop out.
+4. The crop is reduced to 32x32 and its low-frequency DCT coefficients become
+   the bits (above or below their median).
+
+Two captures of the same slide land a few dozen bits apart while different
+slides are further apart; benchmarks/bench_image_hash.py measures both on a
+jittered corpus and checks the configured thresholds against it. Captures with
+(almost) no text, e.g. a blank or dark frame, hash to 0. They say nothing
+about which slide is showing, so callers must not cache or match them (see
+is_blank_hash).
+"""
+import os
+
+from startup import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Low-frequency DCT coefficients kept; the hash has width * height - 1 bits
+HASH_WIDTH = int(os.environ.get("IMAGE_HASH_WIDTH", 16))
+HASH_HEIGHT = int(os.environ.get("IMAGE_HASH_HEIGHT", 16))
+
+# Hashes with fewer bits set carry too little text to identify a slide.
+# Slides with text have about half their bits set.
+IMAGE_HASH_MIN_BITS = int(os.environ.get("IMAGE_HASH_MIN_BITS", HASH_WIDTH * HASH_HEIGHT // 8))
+
+# Width every capture is reduced to before hashing (the aspect ratio is kept)
+_WORK_WIDTH = 640
+
+# Share of pixels that must be text for the capture to get a hash
+_MIN_INK = 0.002
+
+# Largest skew corrected, in degrees
+_MAX_SKEW = 5.0
+
+# Side of the square the text crop is reduced to before the DCT
+_DCT_SIZE = 32
+
+
+def perceptual_hash(image, width=HASH_WIDTH, height=HASH_HEIGHT):
+    """
+    Compute an aligned text-layout perceptual hash
+
+    Args:
+        image: OpenCV image (BGR or grayscale)
+        width: DCT columns kept
+        height: DCT rows kept
+
+    Returns:
+        Hash as a Python int with width * height - 1 bits, or 0 if the
+        capture holds (almost) no text
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    gray = cv2.resize(gray, (_WORK_WIDTH, max(1, round(h * _WORK_WIDTH / w))), interpolation=cv2.INTER_AREA)
+    gray = _slide_region(gray)
+
+    ink = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+        cv2.THRESH_BINARY_INV, 15, 15
+    )
+    # The outermost pixels and any black fill only carry the frame's edges
+    ink[:4], ink[-4:], ink[:, :4], ink[:, -4:] = 0, 0, 0, 0
+    fill = _black_fill(gray)
+    if fill is not None:
+        ink[fill] = 0
+    if np.count_nonzero(ink) < _MIN_INK * ink.size:
+        return 0
+
+    angle = _skew(ink)
+    if abs(angle) > 0.05:
+        h, w = ink.shape
+        ink = cv2.warpAffine(ink, cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0), (w, h))
+
+    # Crop to the text, ignoring a few stray pixels on each side
+    ys, xs = np.nonzero(ink > 127)
+    x0, x1 = np.percentile(xs, (0.5, 99.5)).astype(int)
+    y0, y1 = np.percentile(ys, (0.5, 99.5)).astype(int)
+    crop = ink[y0:y1 + 1, x0:x1 + 1].astype(np.float32)
+
+    crop = cv2.resize(crop, (_DCT_SIZE, _DCT_SIZE), interpolation=cv2.INTER_AREA)
+    coefficients = cv2.dct(crop)[:height, :width].ravel()[1:]  # skip the DC term (overall ink)
+    bits = coefficients > np.median(coefficients)
+
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+
+def is_blank_hash(image_hash):
+    """True if a hash has too few bits set to identify a slide (blank or dark frames)"""
+    return image_hash is None or bin(image_hash).count('1') < IMAGE_HASH_MIN_BITS
+
+
+def _slide_region(gray):
+    """
+    Warp the slide to fill the frame when it was photographed inside a room
+
+    The room is estimated from the frame's border, as a plane so that light
+    falling off across the wall does not hide a dim slide. The largest region
+    clearly brighter than it is the slide; it is only used when it sits fully
+    inside the frame. Otherwise the capture is assumed to show just the slide.
+    """
+    h, w = gray.shape
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    e = max(2, int(0.03 * min(w, h)))
+    border = np.zeros((h, w), bool)
+    border[:e], border[-e:], border[:, :e], border[:, -e:] = True, True, True, True
+    ys, xs = np.nonzero(border)
+
+    samples = np.column_stack([xs, ys, np.ones(len(xs))])
+    plane, *_ = np.linalg.lstsq(samples, blur[ys, xs].astype(np.float64), rcond=None)
+    room = (plane[0] * np.arange(w, dtype=np.float32)[None, :] +
+            plane[1] * np.arange(h, dtype=np.float32)[:, None] + np.float32(plane[2]))
+    residual = blur - room
+    spread = 1.4826 * np.median(np.abs(residual[ys, xs] - np.median(residual[ys, xs])))
+    bright = (residual > max(12, 3 * spread)).astype(np.uint8) * 255
+
+    contours, _ = cv2.findContours(bright, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return gray
+    slide = max(contours, key=cv2.contourArea)
+    if not 0.15 * w * h < cv2.contourArea(slide) < 0.95 * w * h:
+        return gray
+
+    hull = cv2.convexHull(slide)
+    corners = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True).reshape(-1, 2)
+    if len(corners) != 4:
+        corners = cv2.boxPoints(cv2.minAreaRect(hull))
+    margin = 0.01 * min(w, h)
+    if (corners[:, 0].min() < margin or corners[:, 1].min() < margin or
+            corners[:, 0].max() > w - 1 - margin or corners[:, 1].max() > h - 1 - margin):
+        return gray  # touches the frame: the slide fills it, or is cut off
+
+    # Top-left, top-right, bottom-right, bottom-left
+    sums, diffs = corners.sum(1), np.diff(corners, axis=1).ravel()
+    src = np.float32([corners[sums.argmin()], corners[diffs.argmin()], corners[sums.argmax()], corners[diffs.argmax()]])
+    dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    return cv2.warpPerspective(gray, cv2.getPerspectiveTransform(src, dst), (w, h), borderMode=cv2.BORDER_REPLICATE)
+
+
+def _black_fill(gray):
+    """Mask of near-black areas touching the frame, grown to cover their edges"""
+    h, w = gray.shape
+    _, labels, boxes, _ = cv2.connectedComponentsWithStats((gray <= 8).astype(np.uint8), connectivity=8)
+    touching = ((boxes[:, 0] == 0) | (boxes[:, 1] == 0) |
+                (boxes[:, 0] + boxes[:, 2] == w) | (boxes[:, 1] + boxes[:, 3] == h))
+    touching[0] = False  # label 0 is everything that is not near-black
+    if not touching.any():
+        return None
+    return cv2.dilate(touching[labels].astype(np.uint8), np.ones((9, 9), np.uint8)) > 0
+
+
+def _skew(ink):
+    """Rotation in degrees that lines the text up horizontally"""
+    small = cv2.resize(ink, (ink.shape[1] // 2, ink.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    h, w = small.shape
+
+    def row_contrast(angle):
+        rotated = cv2.warpAffine(small, cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0), (w, h))
+        return rotated.sum(1, dtype=np.float64).var()
+
+    coarse = max(np.arange(-_MAX_SKEW, _MAX_SKEW + 0.01, 0.5), key=row_contrast)
+    return max(np.arange(coarse - 0.5, coarse + 0.51, 0.1), key=row_contrast)
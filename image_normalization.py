@@ -0,0 +1,140 @@
+"""
+Resolution and encoding normalization for captured slides.
+
+Phone cameras hand us anything from 720p to 12-megapixel frames. Neither the
+OCR model nor the notes document needs that much, so every capture is scaled
+down to a target long edge and JPEG-encoded at the highest quality that fits
+the target's byte budget. Captures that are effectively grayscale (black text
+on a white slide or whiteboard) are encoded as a single channel.
+"""
+import os
+
+from startup import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+
+class NormalizationTarget:
+    """Size and encoding limits for one consumer of a capture"""
+
+    def __init__(self, name, max_edge, max_bytes, min_quality=55, max_quality=90):
+        self.name = name
+        self.max_edge = max_edge
+        self.max_bytes = max_bytes
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+
+    def __repr__(self):
+        return f"NormalizationTarget({self.name!r}, max_edge={self.max_edge}, max_bytes={self.max_bytes})"
+
+
+# What we send to Cerebras for text extraction
+OCR_TARGET = NormalizationTarget(
+    'ocr',
+    max_edge=int(os.environ.get("OCR_MAX_EDGE", 1600)),
+    max_bytes=int(os.environ.get("OCR_MAX_BYTES", 350_000)),
+    min_quality=int(os.environ.get("OCR_MIN_QUALITY", 60)),
+)
+
+# What we store in Drive and embed in the notes document
+ARCHIVE_TARGET = NormalizationTarget(
+    'archive',
+    max_edge=int(os.environ.get("ARCHIVE_MAX_EDGE", 2048)),
+    max_bytes=int(os.environ.get("ARCHIVE_MAX_BYTES", 600_000)),
+    min_quality=int(os.environ.get("ARCHIVE_MIN_QUALITY", 70)),
+)
+
+# Thumbnail shown in the browser while the full capture stays on the server
+PREVIEW_TARGET = NormalizationTarget(
+    'preview',
+    max_edge=int(os.environ.get("PREVIEW_MAX_EDGE", 640)),
+    max_bytes=int(os.environ.get("PREVIEW_MAX_BYTES", 60_000)),
+    min_quality=50,
+    max_quality=75,
+)
+
+# Max difference between color channels for a capture to count as grayscale
+GRAYSCALE_TOLERANCE = int(os.environ.get("GRAYSCALE_TOLERANCE", 12))
+
+
+def resize_to_edge(image, max_edge):
+    """Scale an image down so its long edge is at most max_edge (never upscales)"""
+    height, width = image.shape[:2]
+    long_edge = max(height, width)
+    if long_edge <= max_edge:
+        return image
+    scale = max_edge / long_edge
+    return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def is_effectively_grayscale(image, tolerance=GRAYSCALE_TOLERANCE):
+    """
+    Check whether a color image carries no useful color information
+
+    Looks at a strided sample of about 128x128 pixels so the check costs
+    almost nothing even on 12-megapixel frames.
+    """
+    if image.ndim == 2:
+        return True
+    step = max(1, max(image.shape[:2]) // 128)
+    thumb = image[::step, ::step].astype(np.int16)
+    spread = thumb.max(axis=2) - thumb.min(axis=2)
+    # Allow a few colored pixels (a logo, a red underline) before keeping color
+    return bool(np.percentile(spread, 98) <= tolerance)
+
+
+def normalize_image(image, target):
+    """
+    Resize and encode an image for a target
+
+    Args:
+        image: OpenCV image (BGR, BGRA or grayscale)
+        target: NormalizationTarget
+
+    Returns:
+        (jpeg_bytes, info) where info describes the encoded image
+    """
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+    resized = resize_to_edge(image, target.max_edge)
+
+    grayscale = is_effectively_grayscale(resized)
+    if grayscale and resized.ndim == 3:
+        resized = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+
+    # Highest quality first; most slides fit, so this is usually one encode
+    quality = target.max_quality
+    encoded = _encode_jpeg(resized, quality)
+    if len(encoded) > target.max_bytes:
+        low, high = target.min_quality, target.max_quality - 1
+        best_quality, best = low, None
+        while low <= high:
+            mid = (low + high) // 2
+            candidate = _encode_jpeg(resized, mid)
+            if len(candidate) <= target.max_bytes:
+                best_quality, best = mid, candidate
+                low = mid + 1
+            else:
+                high = mid - 1
+        if best is None:
+            # Nothing fits: settle for the lowest allowed quality
+            best_quality = target.min_quality
+            best = _encode_jpeg(resized, best_quality)
+        quality, encoded = best_quality, best
+
+    height, width = resized.shape[:2]
+    return encoded, {
+        'target': target.name,
+        'width': width,
+        'height': height,
+        'quality': quality,
+        'grayscale': grayscale,
+        'bytes': len(encoded),
+    }
+
+
+def _encode_jpeg(image, quality):
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
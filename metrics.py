@@ -0,0 +1,274 @@
+"""
+Request and outbound-call metrics in the Prometheus text format.
+
+Every Flask route and every call to Google or Cerebras is counted and timed
+in memory: counters by outcome (status code, error class) and latency
+histograms per route or API method, so a slow /save-to-doc can be broken
+down into documents.get, the Drive upload and batchUpdate. Recording takes a
+lock and a few additions; nothing is written per request.
+
+Gunicorn runs several worker processes, each with its own counters. When
+METRICS_DIR is set (gunicorn.conf.py points it at a fresh directory), each
+worker writes a snapshot of its counters to its own file there every
+METRICS_FLUSH_INTERVAL seconds and at exit, and /metrics adds up the
+snapshots of all workers, so every scrape sees the whole instance whichever
+worker answers it. Snapshots of workers that have exited are kept, so totals
+never go backwards when a worker is restarted. Without METRICS_DIR, /metrics
+reports the answering process only.
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import bisect
+import tempfile
+import threading
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")  # snapshot directory shared by the workers
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))  # seconds
+# Seconds; from cached reads to slow OCR completions
+METRICS_BUCKETS = os.environ.get("METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30")
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+
+class Metric:
+    def __init__(self, registry, kind, name, help, labels, buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets or ())
+        self.values = {}  # label values -> float, or [bucket counts, sum, count]
+
+    def inc(self, *labels, amount=1):
+        """Add amount to the counter for these label values"""
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+        self.registry.changed()
+
+    def observe(self, seconds, *labels):
+        """Record one duration in the histogram for these label values"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.registry.lock:
+            value = self.values.get(labels)
+            if value is None:
+                value = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                value[0][index] += 1
+            value[1] += seconds
+            value[2] += 1
+        self.registry.changed()
+
+
+class MetricsRegistry:
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._dirty = False
+        self._pid = None
+        self._snapshot_path = None
+        self._flush_lock = threading.Lock()
+
+    def counter(self, name, help, labels):
+        return self._register(Metric(self, COUNTER, name, help, labels))
+
+    def histogram(self, name, help, labels, buckets=None):
+        buckets = buckets or [float(b) for b in METRICS_BUCKETS.split(',')]
+        return self._register(Metric(self, HISTOGRAM, name, help, labels, sorted(buckets)))
+
+    def changed(self):
+        self._dirty = True
+        if self.directory and self._pid != os.getpid():
+            self._start_flusher()
+
+    def snapshot(self):
+        """This process's values as a JSON-safe dict"""
+        with self.lock:
+            return {
+                name: [[list(labels), value] for labels, value in metric.values.items()]
+                for name, metric in self.metrics.items()
+            }
+
+    def flush(self):
+        """Write this process's snapshot to METRICS_DIR (atomically replacing the last one)"""
+        if not self.directory or not self._snapshot_path:
+            return
+        with self._flush_lock:
+            self._dirty = False
+            data = self.snapshot()
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self._snapshot_path)
+
+    def render(self):
+        """All workers' metrics in the Prometheus text exposition format"""
+        totals = {name: {} for name in self.metrics}
+        for snapshot in self._all_snapshots():
+            for name, series in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue  # written by an older release
+                merged = totals[name]
+                for labels, value in series:
+                    key = tuple(labels)
+                    if metric.kind == COUNTER:
+                        merged[key] = merged.get(key, 0) + value
+                    elif key in merged:
+                        counts, total, count = merged[key]
+                        merged[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1], count + value[2]]
+                    else:
+                        merged[key] = [list(value[0]), value[1], value[2]]
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(totals[name].items()):
+                labels = _format_labels(metric.labels, key)
+                if metric.kind == COUNTER:
+                    lines.append(f"{name}{{{labels}}} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{{{_join(labels, _le(bound))}}} {cumulative}")
+                lines.append(f"{name}_bucket{{{_join(labels, _le('+Inf'))}}} {count}")
+                lines.append(f"{name}_sum{{{labels}}} {_format_value(round(total, 6))}")
+                lines.append(f"{name}_count{{{labels}}} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _all_snapshots(self):
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return snapshots
+        own = os.path.basename(self._snapshot_path) if self._snapshot_path and self._pid == os.getpid() else None
+        for name in names:
+            if not name.endswith('.json') or name == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # being replaced right now; picked up on the next scrape
+        return snapshots
+
+    def _start_flusher(self):
+        with self._flush_lock:
+            if self._pid == os.getpid():
+                return
+            # First metric in this process (or in a freshly forked worker):
+            # values inherited from a parent belong to the parent's snapshot
+            if self._pid is not None:
+                with self.lock:
+                    for metric in self.metrics.values():
+                        metric.values.clear()
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            # Unique per process, so a recycled pid never overwrites an exited worker's totals
+            self._snapshot_path = os.path.join(self.directory, f"worker-{self._pid}-{uuid.uuid4().hex[:8]}.json")
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"Could not write metrics snapshot: {e}")
+
+
+def clear_snapshots(directory):
+    """Remove the snapshots of a previous run, e.g. when gunicorn starts with a fixed METRICS_DIR"""
+    if not directory or not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith('worker-') and name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, name))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _le(bound):
+    return f'le="{bound if isinstance(bound, str) else _format_value(bound)}"'
+
+
+def _join(labels, extra):
+    return f"{labels},{extra}" if labels else extra
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+
+http_requests = metrics.counter(
+    'slidesync_http_requests_total', 'HTTP requests by route, method and response status.',
+    ('route', 'method', 'status'))
+http_request_seconds = metrics.histogram(
+    'slidesync_http_request_duration_seconds', 'Time to serve a request, including streamed bodies.',
+    ('route', 'method'))
+external_calls = metrics.counter(
+    'slidesync_external_calls_total', 'Outbound Google and Cerebras calls by operation and outcome.',
+    ('service', 'operation', 'outcome'))
+external_call_seconds = metrics.histogram(
+    'slidesync_external_call_duration_seconds', 'Duration of outbound Google and Cerebras calls (each attempt).',
+    ('service', 'operation'))
+
+
+def observe_request(route, method, status, seconds):
+    http_requests.inc(route, method, str(status))
+    http_request_seconds.observe(seconds, route, method)
+
+
+def observe_call(service, operation, outcome, seconds=None):
+    """
+    Record one outbound call
+
+    Args:
+        service: 'google' or 'cerebras'
+        operation: API method, e.g. 'docs.documents.batchUpdate'
+        outcome: 'ok', an HTTP status, or an error name
+        seconds: Duration; None for calls that were refused before being sent
+    """
+    external_calls.inc(service, operation, str(outcome))
+    if seconds is not None:
+        external_call_seconds.observe(seconds, service, operation)
+
+
+@contextmanager
+def timed_call(service, operation):
+    """Time the block as one outbound call; exceptions count as their class name"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        observe_call(service, operation, type(e).__name__, time.perf_counter() - started)
+        raise
+    observe_call(service, operation, 'ok', time.perf_counter() - started)
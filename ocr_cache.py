@@ -0,0 +1,122 @@
+"""
+Content-addressed cache for OCR results.
+
+Captures of the same slide by different students (or the same student twice)
+hash to nearby perceptual hashes, so the extracted text from the first
+capture can be reused instead of calling Cerebras again. Blank and dark
+frames all hash alike whatever is on screen, so they are never cached.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from image_hash import hamming_distance, is_blank_hash
+
+# Maximum Hamming distance (in bits) for two captures to count as the same slide.
+# Picked with benchmarks/bench_image_hash.py: re-captures that are shifted,
+# rotated or zoomed a little land within it, while different slides (even ones
+# that differ by a single bullet point) have stayed more than 60 bits apart.
+OCR_CACHE_MAX_DISTANCE = int(os.environ.get("OCR_CACHE_MAX_DISTANCE", 40))
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", 1024))
+OCR_CACHE_TTL = int(os.environ.get("OCR_CACHE_TTL", 4 * 3600))  # seconds
+
+
+class OCRCache:
+    """
+    LRU + TTL cache of extracted text keyed by perceptual image hash
+
+    Lookups first try an exact hash match and then fall back to a scan for the
+    closest stored hash within max_distance bits. The scan is bounded by
+    max_entries and each comparison is a single integer popcount.
+    """
+
+    def __init__(self, max_distance=OCR_CACHE_MAX_DISTANCE, max_entries=OCR_CACHE_MAX_ENTRIES, ttl=OCR_CACHE_TTL):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # hash -> (text, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.blank = 0
+        self.evictions = 0
+
+    def get(self, image_hash):
+        """
+        Find cached text for a slide
+
+        Args:
+            image_hash: Perceptual hash of the capture
+
+        Returns:
+            Cached text, or None on a miss or a blank hash
+        """
+        now = time.time()
+        with self._lock:
+            if is_blank_hash(image_hash):
+                self.blank += 1
+                return None
+
+            self._expire(now)
+
+            entry = self._entries.get(image_hash)
+            if entry is not None:
+                self._entries.move_to_end(image_hash)
+                self.hits += 1
+                return entry[0]
+
+            best_key, best_distance = None, self.max_distance + 1
+            for key in self._entries:
+                distance = hamming_distance(key, image_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                self.near_hits += 1
+                return self._entries[best_key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, image_hash, text):
+        """Store extracted text for a slide hash (blank hashes are ignored)"""
+        if is_blank_hash(image_hash):
+            return
+        with self._lock:
+            self._entries[image_hash] = (text, time.time())
+            self._entries.move_to_end(image_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'blank': self.blank,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'max_distance': self.max_distance,
+            }
+
+    def _expire(self, now):
+        # Entries are ordered by last use, but TTL runs from when they were stored
+        expired = [key for key, (_, stored_at) in self._entries.items() if now - stored_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+            self.evictions += 1
+
+
+ocr_cache = OCRCache()
@@ -0,0 +1,159 @@
+"""
+Bounded background pool for OCR jobs.
+
+Routes enqueue a decoded image and get a job id back immediately; a fixed
+number of worker threads run the OCR pipeline. Clients either poll the job
+status or long-poll (subscribe) until it completes. The synchronous routes use
+the same queue and simply wait for their own job.
+"""
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 4))
+OCR_MAX_PENDING = int(os.environ.get("OCR_MAX_PENDING", 64))
+OCR_JOB_TTL = int(os.environ.get("OCR_JOB_TTL", 600))  # seconds a finished job is kept
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised when the OCR queue already holds OCR_MAX_PENDING unfinished jobs"""
+
+
+class OCRJob:
+    def __init__(self, owner):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes or timeout expires; returns True if finished"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+        }
+        if self.status == DONE:
+            data['result'] = self.result
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class OCRJobQueue:
+    def __init__(self, max_workers=OCR_WORKERS, max_pending=OCR_MAX_PENDING, job_ttl=OCR_JOB_TTL):
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ocr')
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.streams = 0
+        self._first_text_ms = 0.0  # summed over streams that produced text
+        self._streams_with_text = 0
+        self._stream_total_ms = 0.0
+
+    def submit(self, fn, *args, owner=None):
+        """
+        Enqueue fn(*args) as an OCR job
+
+        Args:
+            fn: Pipeline callable returning the JSON-serialisable result
+            *args: Arguments for fn
+            owner: Identifier of the submitting user; only they can read the job
+
+        Returns:
+            The queued OCRJob
+
+        Raises:
+            QueueFull: if too many jobs are already waiting or running
+        """
+        job = OCRJob(owner)
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull("OCR queue is full, please retry shortly")
+            self._pending += 1
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id, owner=None):
+        """Look up a job, hiding jobs that belong to someone else"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    def record_stream(self, first_text_ms, total_ms):
+        """Timings of a streamed job: time to first partial text (None if none) and to the result"""
+        with self._lock:
+            self.streams += 1
+            self._stream_total_ms += total_ms
+            if first_text_ms is not None:
+                self._streams_with_text += 1
+                self._first_text_ms += first_text_ms
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'tracked_jobs': len(self._jobs),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'streams': self.streams,
+                'mean_first_text_ms': (round(self._first_text_ms / self._streams_with_text, 1)
+                                       if self._streams_with_text else None),
+                'mean_stream_ms': round(self._stream_total_ms / self.streams, 1) if self.streams else None,
+            }
+
+    def _run(self, job, fn, args):
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            job.result = fn(*args)
+            job.status = DONE
+        except Exception as e:
+            print(f"OCR job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._pending -= 1
+                if job.status == DONE:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            job._done.set()
+
+    def _prune(self):
+        # Forget finished jobs nobody collected within job_ttl
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished is not None and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+ocr_queue = OCRJobQueue()
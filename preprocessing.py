@@ -0,0 +1,195 @@
+"""
+Declarative image preprocessing pipeline.
+
+A pipeline is an ordered list of named stages, configured with a spec string
+such as "grayscale,clahe:clip_limit=3,otsu". Running the pipeline on an image
+does no work by itself: a stage is only evaluated when a consumer asks for its
+output (or the output of a later stage), and each result is kept for the rest
+of the run so several consumers share the work. Every evaluated stage is timed.
+"""
+import os
+import time
+import threading
+
+from startup import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Name of the unprocessed input in every pipeline run
+SOURCE = 'source'
+
+_stage_registry = {}
+
+
+def register_stage(name, fn):
+    """
+    Make a function available as a pipeline stage
+
+    Args:
+        name: Name used in pipeline specs
+        fn: Callable taking the previous stage's image plus keyword parameters
+    """
+    _stage_registry[name] = fn
+
+
+def stage(name):
+    """Decorator form of register_stage"""
+    def decorator(fn):
+        register_stage(name, fn)
+        return fn
+    return decorator
+
+
+def available_stages():
+    return sorted(_stage_registry)
+
+
+@stage('grayscale')
+def grayscale(image):
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+@stage('clahe')
+def clahe(image, clip_limit=2.0, tile_size=8):
+    equalizer = cv2.createCLAHE(clipLimit=float(clip_limit), tileGridSize=(int(tile_size), int(tile_size)))
+    return equalizer.apply(grayscale(image))
+
+
+@stage('otsu')
+def otsu(image):
+    _, thresh = cv2.threshold(grayscale(image), 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+@stage('adaptive_threshold')
+def adaptive_threshold(image, block_size=21, c=5):
+    return cv2.adaptiveThreshold(
+        grayscale(image), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, int(block_size), float(c)
+    )
+
+
+@stage('denoise')
+def denoise(image, kernel=3):
+    kernel = np.ones((int(kernel), int(kernel)), np.uint8)
+    return cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
+
+
+@stage('to_bgr')
+def to_bgr(image):
+    if image.ndim == 3:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+
+def parse_spec(spec):
+    """
+    Parse a pipeline spec string
+
+    Args:
+        spec: Comma separated stages, each 'name' or 'name:key=value:key=value'
+
+    Returns:
+        List of (name, params) tuples
+    """
+    stages = []
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, *pairs = item.split(':')
+        params = {}
+        for pair in pairs:
+            key, _, value = pair.partition('=')
+            params[key.strip()] = value.strip()
+        stages.append((name.strip(), params))
+    return stages
+
+
+class Pipeline:
+    def __init__(self, stages):
+        names = [name for name, _ in stages]
+        unknown = [name for name in names if name not in _stage_registry]
+        if unknown:
+            raise ValueError(f"Unknown preprocessing stage(s): {', '.join(unknown)}")
+        if len(set(names)) != len(names) or SOURCE in names:
+            raise ValueError("Preprocessing stage names must be unique and not 'source'")
+        self.stages = stages
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(parse_spec(spec))
+
+    @property
+    def names(self):
+        return [name for name, _ in self.stages]
+
+    def run(self, image):
+        """Start a lazy run over an image; nothing is computed until requested"""
+        return PipelineRun(self, image)
+
+    def record(self, name, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'count': 0, 'total_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += seconds * 1000
+
+    def stats(self):
+        """Per-stage evaluation counts and mean time across all runs"""
+        with self._lock:
+            return {
+                name: {
+                    'count': s['count'],
+                    'mean_ms': round(s['total_ms'] / s['count'], 3),
+                }
+                for name, s in self._stats.items()
+            }
+
+
+class PipelineRun:
+    def __init__(self, pipeline, image):
+        self.pipeline = pipeline
+        self.timings = {}
+        self._outputs = {SOURCE: image}
+
+    def output(self, name=None):
+        """
+        Get the output of a stage, evaluating it and any earlier stages it needs
+
+        Args:
+            name: Stage name, 'source' for the input, or None for the last stage
+
+        Returns:
+            Image produced by that stage
+        """
+        names = self.pipeline.names
+        if name is None:
+            name = names[-1] if names else SOURCE
+        if name in self._outputs:
+            return self._outputs[name]
+        if name not in names:
+            raise KeyError(f"Stage '{name}' is not part of this pipeline")
+
+        position = names.index(name)
+        previous = names[position - 1] if position > 0 else SOURCE
+        image = self.output(previous)
+
+        stage_name, params = self.pipeline.stages[position]
+        start = time.perf_counter()
+        result = _stage_registry[stage_name](image, **params)
+        elapsed = time.perf_counter() - start
+
+        self.timings[stage_name] = round(elapsed * 1000, 3)
+        self.pipeline.record(stage_name, elapsed)
+        self._outputs[name] = result
+        return result
+
+
+# Deployment configuration: the stage chain and which stage OCR consumes
+PREPROCESS_STAGES = os.environ.get("PREPROCESS_STAGES", "grayscale,clahe,otsu")
+OCR_INPUT_STAGE = os.environ.get("OCR_INPUT_STAGE", SOURCE)
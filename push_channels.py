@@ -0,0 +1,282 @@
+"""
+Google push notification channels for the calendar and doc-name caches.
+
+When PUSH_WEBHOOK_URL is set, the app asks Google to notify
+/notifications/google whenever a user's primary calendar or one of their
+linked notes documents changes (events().watch and files().watch). A
+notification records a change for the (user, resource) pair; the caches then
+refresh only when a change was recorded, instead of on a short timer.
+
+Channels and recorded changes live in a small SQLite database so every
+gunicorn worker sees them: the notification may arrive at a different worker
+than the one that created the channel or serves the user's next page.
+Without PUSH_WEBHOOK_URL nothing is registered and the caches keep their
+regular refresh intervals.
+"""
+import os
+import hmac
+import time
+import uuid
+import secrets
+import tempfile
+import threading
+
+from google_calls import google_calls
+from sqlite_util import thread_connection
+
+PUSH_WEBHOOK_URL = os.environ.get("PUSH_WEBHOOK_URL")  # public https URL of /notifications/google
+PUSH_CHANNEL_DB = os.environ.get(
+    "PUSH_CHANNEL_DB", os.path.join(tempfile.gettempdir(), 'slidesync-push-channels.sqlite3')
+)
+PUSH_CHANNEL_TTL = int(os.environ.get("PUSH_CHANNEL_TTL", 24 * 3600))  # seconds requested from Google
+PUSH_RENEW_MARGIN = int(os.environ.get("PUSH_RENEW_MARGIN", 3600))  # renew channels this close to expiry
+
+CALENDAR = 'calendar'
+DRIVE = 'drive'
+
+_COLUMNS = ('id', 'owner', 'kind', 'target', 'resource_id', 'token', 'expiration')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    resource_id TEXT,
+    token TEXT NOT NULL,
+    expiration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channels_resource ON channels (owner, kind, target);
+CREATE TABLE IF NOT EXISTS changes (
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (owner, kind, target)
+);
+"""
+
+
+class PushChannels:
+    def __init__(self, path=PUSH_CHANNEL_DB, webhook_url=PUSH_WEBHOOK_URL, ttl=PUSH_CHANNEL_TTL,
+                 renew_margin=PUSH_RENEW_MARGIN):
+        self.path = path
+        self.webhook_url = webhook_url
+        self.ttl = ttl
+        self.renew_margin = renew_margin
+        self._listeners = {}  # kind -> callables taking (owner, target)
+        self._seen = {}  # (owner, kind, target) -> version already applied in this process
+        self._lock = threading.Lock()
+        self.notifications = 0
+        self.ignored = 0
+        self.channels_created = 0
+        self.channels_stopped = 0
+        if self.enabled:
+            thread_connection(self.path).executescript(_SCHEMA)
+
+    @property
+    def enabled(self):
+        return bool(self.webhook_url)
+
+    def on_change(self, kind, callback):
+        """Call callback(owner, target) when a change to a watched resource is applied"""
+        self._listeners.setdefault(kind, []).append(callback)
+
+    def watch_calendar(self, owner, calendar_service):
+        """
+        Make sure the user's primary calendar has a live channel
+
+        Returns:
+            True if changes to the calendar are being pushed
+        """
+        return self._ensure(owner, CALENDAR, 'primary', lambda body: google_calls.execute(
+            calendar_service.events().watch(calendarId='primary', body=body), user=owner
+        ))
+
+    def watch_file(self, owner, drive_service, file_id):
+        """Make sure a Drive file has a live channel; returns True if it is watched"""
+        return self._ensure(owner, DRIVE, file_id, lambda body: google_calls.execute(
+            drive_service.files().watch(fileId=file_id, body=body), user=owner
+        ))
+
+    def apply_changes(self, owner):
+        """
+        Run listeners for changes recorded since this process last looked
+
+        Cheap enough to call on every page view: one indexed SQLite query.
+        """
+        if not self.enabled:
+            return
+        rows = thread_connection(self.path).execute(
+            "SELECT kind, target, version FROM changes WHERE owner = ?", (str(owner),)
+        ).fetchall()
+        for kind, target, version in rows:
+            key = (str(owner), kind, target)
+            with self._lock:
+                if self._seen.get(key) == version:
+                    continue
+                self._seen[key] = version
+            for callback in self._listeners.get(kind, []):
+                callback(owner, target)
+
+    def handle_notification(self, headers):
+        """
+        Record the change described by a push notification
+
+        Args:
+            headers: Request headers (X-Goog-Channel-ID, X-Goog-Channel-Token,
+                X-Goog-Resource-State, X-Goog-Changed)
+
+        Returns:
+            'recorded', 'sync', 'unchanged' (nothing cached was affected) or
+            'ignored' (unknown channel or wrong token)
+        """
+        channel_id = headers.get('X-Goog-Channel-ID', '')
+        state = headers.get('X-Goog-Resource-State', '')
+        channel = self._channel(channel_id) if self.enabled else None
+        if channel is None or not hmac.compare_digest(channel['token'], headers.get('X-Goog-Channel-Token', '')):
+            with self._lock:
+                self.ignored += 1
+            return 'ignored'
+
+        with self._lock:
+            self.notifications += 1
+
+        # Sent once when the channel is created; nothing changed yet
+        if state == 'sync':
+            return 'sync'
+
+        # Drive reports every content edit (including our own note inserts);
+        # only metadata changes and removal affect the cached document name
+        if channel['kind'] == DRIVE and state == 'update':
+            changed = headers.get('X-Goog-Changed', '')
+            if 'properties' not in changed.split(','):
+                return 'unchanged'
+
+        db = thread_connection(self.path)
+        with db:
+            db.execute(
+                "INSERT INTO changes (owner, kind, target, version) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (owner, kind, target) DO UPDATE SET version = version + 1",
+                (channel['owner'], channel['kind'], channel['target'])
+            )
+        return 'recorded'
+
+    def stop_owner(self, owner, calendar_service=None, drive_service=None):
+        """Stop every channel of a user, e.g. at logout"""
+        if not self.enabled:
+            return
+        db = thread_connection(self.path)
+        rows = db.execute(
+            "SELECT id, kind, resource_id FROM channels WHERE owner = ?", (str(owner),)
+        ).fetchall()
+        for channel_id, kind, resource_id in rows:
+            service = calendar_service if kind == CALENDAR else drive_service
+            self._stop(owner, service, channel_id, resource_id)
+        with db:
+            db.execute("DELETE FROM channels WHERE owner = ?", (str(owner),))
+            db.execute("DELETE FROM changes WHERE owner = ?", (str(owner),))
+
+    def register(self, owner, kind, target, channel_id=None, resource_id=None, token=None, expiration=None):
+        """Record a channel; used after a watch call and by the local stand-in"""
+        channel_id = channel_id or uuid.uuid4().hex
+        token = token or secrets.token_urlsafe(24)
+        expiration = expiration or time.time() + self.ttl
+        db = thread_connection(self.path)
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO channels (id, owner, kind, target, resource_id, token, expiration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (channel_id, str(owner), kind, target, resource_id, token, expiration)
+            )
+        return channel_id
+
+    def channels(self, owner=None):
+        """Registered channels, optionally for one user"""
+        if owner is None:
+            return self._select("", ())
+        return self._select("WHERE owner = ?", (str(owner),))
+
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        active = thread_connection(self.path).execute(
+            "SELECT COUNT(*) FROM channels WHERE expiration > ?", (time.time(),)
+        ).fetchone()[0]
+        with self._lock:
+            return {
+                'enabled': True,
+                'active_channels': active,
+                'notifications': self.notifications,
+                'ignored': self.ignored,
+                'channels_created': self.channels_created,
+                'channels_stopped': self.channels_stopped,
+            }
+
+    def _ensure(self, owner, kind, target, watch):
+        if not self.enabled:
+            return False
+        now = time.time()
+        db = thread_connection(self.path)
+        rows = db.execute(
+            "SELECT id, resource_id, expiration FROM channels WHERE owner = ? AND kind = ? AND target = ? "
+            "ORDER BY expiration DESC",
+            (str(owner), kind, target)
+        ).fetchall()
+        if rows and rows[0][2] - now > self.renew_margin:
+            return True
+
+        channel_id = uuid.uuid4().hex
+        token = secrets.token_urlsafe(24)
+        try:
+            response = watch({
+                'id': channel_id,
+                'type': 'web_hook',
+                'address': self.webhook_url,
+                'token': token,
+                'params': {'ttl': str(self.ttl)},
+            })
+        except Exception as e:
+            print(f"Error creating push channel for {kind} {target}: {e}")
+            # An older channel may still be live until it expires
+            return bool(rows) and rows[0][2] > now
+
+        # Google may shorten the lifetime; its expiration is in milliseconds
+        expiration = int(response.get('expiration', 0)) / 1000 or now + self.ttl
+        self.register(owner, kind, target, channel_id, response.get('resourceId'), token, expiration)
+        with self._lock:
+            self.channels_created += 1
+
+        # Old channels stay registered until they expire so that notifications
+        # already in flight are still accepted; Google stops sending after that
+        with db:
+            db.execute(
+                "DELETE FROM channels WHERE owner = ? AND kind = ? AND target = ? AND expiration < ?",
+                (str(owner), kind, target, now)
+            )
+        return True
+
+    def _stop(self, owner, service, channel_id, resource_id):
+        if service is None or not resource_id:
+            return
+        try:
+            google_calls.execute(service.channels().stop(body={'id': channel_id, 'resourceId': resource_id}),
+                                 user=owner)
+            with self._lock:
+                self.channels_stopped += 1
+        except Exception as e:
+            print(f"Error stopping push channel {channel_id}: {e}")
+
+    def _channel(self, channel_id):
+        channels = self._select("WHERE id = ?", (channel_id,))
+        return channels[0] if channels else None
+
+    def _select(self, where, params):
+        rows = thread_connection(self.path).execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM channels {where}", params
+        ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+
+
+push_channels = PushChannels()
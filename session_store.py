@@ -0,0 +1,395 @@
+"""
+Server-side sessions and OAuth token refresh.
+
+The session cookie only carries a signed session id; the session itself
+(OAuth token, user profile, OAuth state) is kept in a backend:
+
+    SESSION_BACKEND=sqlite  (default) SQLite file at SESSION_DB, shared by all
+                            gunicorn workers on the node and kept across restarts
+    SESSION_BACKEND=memory  in-process dict, for development and single workers
+
+Access tokens are refreshed shortly before they expire (TOKEN_REFRESH_MARGIN)
+instead of failing mid-request. The refreshed token is written back to the
+backend straight away. Concurrent requests on the same session share one
+refresh: threads wait on a per-session lock, and workers take a short lease
+on the session row.
+
+The backend also keeps each user's latest refresh token, so signing in again
+can reuse the user's existing grant instead of showing Google's consent
+screen every time (see complete_token).
+"""
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+
+from sqlite_util import thread_connection
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite").lower()
+SESSION_DB = os.environ.get("SESSION_DB", os.path.join(tempfile.gettempdir(), 'slidesync-sessions.sqlite3'))
+TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", 300))  # seconds before expiry
+SESSION_TOUCH_INTERVAL = 3600  # seconds between writes that only extend an unchanged session
+REFRESH_LEASE = 30  # seconds a worker may hold a session's refresh lease
+CREDENTIALS_CACHE_SIZE = 1024
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.snapshot = dict(initial or {})  # as loaded, to skip writing unchanged sessions
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.rotate = False
+
+    def clear(self):
+        # A cleared session (login, logout) gets a fresh id so an old cookie
+        # can never be used to reach the new session
+        super().clear()
+        self.rotate = True
+
+
+class MemorySessionBackend:
+    name = 'memory'
+
+    def __init__(self):
+        self._sessions = {}  # sid -> (data json, expires_at)
+        self._refresh_tokens = {}  # user id -> refresh token of their grant
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._sessions[sid]
+                return None
+            return json.loads(entry[0])
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (json.dumps(data), expires_at)
+            if len(self._sessions) % 256 == 0:
+                self._prune()
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def save_refresh_token(self, user, refresh_token):
+        with self._lock:
+            self._refresh_tokens[user] = refresh_token
+
+    def load_refresh_token(self, user):
+        with self._lock:
+            return self._refresh_tokens.get(user)
+
+    def acquire_refresh(self, sid):
+        # Threads of this process are already serialised by the session lock
+        return True
+
+    def release_refresh(self, sid):
+        pass
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _prune(self):
+        now = time.time()
+        for sid in [sid for sid, (_, expires_at) in self._sessions.items() if expires_at < now]:
+            del self._sessions[sid]
+
+
+class SQLiteSessionBackend:
+    name = 'sqlite'
+
+    def __init__(self, path=SESSION_DB):
+        self.path = path
+        thread_connection(self.path).executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                refreshing_until REAL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at);
+            CREATE TABLE IF NOT EXISTS refresh_tokens (
+                user TEXT PRIMARY KEY,
+                refresh_token TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+        """)
+
+    def load(self, sid):
+        row = thread_connection(self.path).execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data, expires_at):
+        db = thread_connection(self.path)
+        with db:
+            db.execute(
+                "INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                (sid, json.dumps(data), expires_at)
+            )
+            # Cheap housekeeping: drop a few expired sessions on each write
+            db.execute(
+                "DELETE FROM sessions WHERE sid IN "
+                "(SELECT sid FROM sessions WHERE expires_at < ? LIMIT 16)", (time.time(),)
+            )
+
+    def delete(self, sid):
+        db = thread_connection(self.path)
+        with db:
+            db.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def save_refresh_token(self, user, refresh_token):
+        db = thread_connection(self.path)
+        with db:
+            db.execute(
+                "INSERT INTO refresh_tokens (user, refresh_token, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (user) DO UPDATE SET refresh_token = excluded.refresh_token, updated = excluded.updated",
+                (user, refresh_token, time.time())
+            )
+
+    def load_refresh_token(self, user):
+        row = thread_connection(self.path).execute(
+            "SELECT refresh_token FROM refresh_tokens WHERE user = ?", (user,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def acquire_refresh(self, sid):
+        """Take the refresh lease for a session; False if another worker holds it"""
+        now = time.time()
+        db = thread_connection(self.path)
+        with db:
+            cursor = db.execute(
+                "UPDATE sessions SET refreshing_until = ? WHERE sid = ? "
+                "AND (refreshing_until IS NULL OR refreshing_until < ?)",
+                (now + REFRESH_LEASE, sid, now)
+            )
+        return cursor.rowcount == 1
+
+    def release_refresh(self, sid):
+        db = thread_connection(self.path)
+        with db:
+            db.execute("UPDATE sessions SET refreshing_until = NULL WHERE sid = ?", (sid,))
+
+    def count(self):
+        return thread_connection(self.path).execute(
+            "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface storing sessions in a backend, keyed by a signed id cookie"""
+
+    salt = 'slidesync-session'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._refresh_locks = {}  # sid -> threading.Lock
+        self._locks_lock = threading.Lock()
+        self._credentials = OrderedDict()  # access token -> Credentials
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.refresh_waits = 0
+
+    def open_session(self, app, request):
+        sid = self._unsign(app, request.cookies.get(self.get_cookie_name(app)))
+        if sid:
+            data = self.backend.load(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=uuid.uuid4().hex, new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.rotate and not session.new:
+            self.backend.delete(session.sid)
+            session.sid = uuid.uuid4().hex
+
+        if not session:
+            if not session.new or session.rotate:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        changed = session.new or session.rotate or dict(session) != session.snapshot
+        # Sliding expiry: re-save an unchanged session at most every SESSION_TOUCH_INTERVAL
+        stale = time.time() - session.get('_saved_at', 0) > SESSION_TOUCH_INTERVAL
+        if not changed and not stale and not self.should_set_cookie(app, session):
+            return
+
+        expires = self.get_expiration_time(app, session)
+        expires_at = expires.timestamp() if expires else time.time() + app.permanent_session_lifetime.total_seconds()
+        if changed or stale:
+            if not session.new:
+                self._keep_newer_token(session)
+            session['_saved_at'] = time.time()
+            self.backend.save(session.sid, dict(session), expires_at)
+        response.set_cookie(
+            name,
+            self._sign(app, session.sid),
+            expires=expires,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def cookie_value(self, app, sid):
+        """Signed cookie value for a session id (used by benchmarks and tools)"""
+        return self._sign(app, sid)
+
+    def fresh_token(self, session, refresh):
+        """
+        Get the session's OAuth token, refreshing it if it is about to expire
+
+        Args:
+            session: The current ServerSession
+            refresh: Callable taking the current token dict and returning the
+                refreshed token dict; it performs the token endpoint call
+
+        Returns:
+            Token dict, or None if the session has no token
+        """
+        token = session.get('oauth_token')
+        if not token or not self._expiring(token) or not token.get('refresh_token'):
+            return token
+
+        with self._session_lock(session.sid):
+            # Another thread may have refreshed while we waited for the lock
+            stored = self.backend.load(session.sid) or {}
+            if stored.get('oauth_token') and not self._expiring(stored['oauth_token']):
+                session['oauth_token'] = stored['oauth_token']
+                return stored['oauth_token']
+
+            if not session.new and not self.backend.acquire_refresh(session.sid):
+                # Another worker is refreshing; wait for it to write the new token
+                self.refresh_waits += 1
+                deadline = time.time() + REFRESH_LEASE
+                while time.time() < deadline:
+                    time.sleep(0.1)
+                    stored = self.backend.load(session.sid) or {}
+                    if stored.get('oauth_token') and not self._expiring(stored['oauth_token']):
+                        session['oauth_token'] = stored['oauth_token']
+                        return stored['oauth_token']
+                return token
+
+            try:
+                refreshed = refresh(token)
+            except Exception as e:
+                print(f"Error refreshing OAuth token: {str(e)}")
+                self.refresh_failures += 1
+                self.backend.release_refresh(session.sid)
+                return token
+
+            self.refreshes += 1
+            session['oauth_token'] = refreshed
+            # Persist right away so other workers pick up the new token
+            lifetime = current_app.permanent_session_lifetime.total_seconds()
+            self.backend.save(session.sid, dict(session), time.time() + lifetime)
+            self.backend.release_refresh(session.sid)
+            return refreshed
+
+    def complete_token(self, user, token):
+        """
+        Give a new login's token the refresh token of the user's earlier grant
+
+        Google only issues a refresh token when the user goes through the
+        consent screen, so logins that reuse an existing grant come back
+        without one. A token that does carry one is remembered for next time.
+
+        Returns:
+            True if the token has a refresh token afterwards
+        """
+        if token.get('refresh_token'):
+            self.backend.save_refresh_token(user, token['refresh_token'])
+            return True
+        refresh_token = self.backend.load_refresh_token(user)
+        if refresh_token:
+            token['refresh_token'] = refresh_token
+            return True
+        return False
+
+    def credentials(self, token, factory):
+        """Reuse one Credentials object per access token instead of rebuilding it per call"""
+        key = token.get('access_token')
+        with self._locks_lock:
+            credentials = self._credentials.get(key)
+            if credentials is not None:
+                self._credentials.move_to_end(key)
+                return credentials
+        credentials = factory(token)
+        with self._locks_lock:
+            self._credentials[key] = credentials
+            while len(self._credentials) > CREDENTIALS_CACHE_SIZE:
+                self._credentials.popitem(last=False)
+        return credentials
+
+    def stats(self):
+        return {
+            'backend': self.backend.name,
+            'sessions': self.backend.count(),
+            'token_refreshes': self.refreshes,
+            'token_refresh_failures': self.refresh_failures,
+            'token_refresh_waits': self.refresh_waits,
+        }
+
+    def _keep_newer_token(self, session):
+        """Take the stored token if another request refreshed it after this one loaded the session"""
+        token = session.get('oauth_token')
+        stored = (self.backend.load(session.sid) or {}).get('oauth_token')
+        if token and stored and float(stored.get('expires_at') or 0) > float(token.get('expires_at') or 0):
+            session['oauth_token'] = stored
+
+    def _expiring(self, token):
+        expires_at = token.get('expires_at')
+        return expires_at is not None and float(expires_at) - time.time() < TOKEN_REFRESH_MARGIN
+
+    def _session_lock(self, sid):
+        with self._locks_lock:
+            lock = self._refresh_locks.get(sid)
+            if lock is None:
+                if len(self._refresh_locks) > CREDENTIALS_CACHE_SIZE:
+                    self._refresh_locks = {k: v for k, v in self._refresh_locks.items() if v.locked()}
+                lock = self._refresh_locks[sid] = threading.Lock()
+            return lock
+
+    def _sign(self, app, sid):
+        return Signer(app.secret_key, salt=self.salt).sign(sid.encode()).decode()
+
+    def _unsign(self, app, value):
+        if not value:
+            return None
+        try:
+            return Signer(app.secret_key, salt=self.salt).unsign(value.encode()).decode()
+        except BadSignature:
+            return None
+
+
+def create_session_interface(backend=SESSION_BACKEND):
+    if backend == 'memory':
+        return ServerSessionInterface(MemorySessionBackend())
+    if backend == 'sqlite':
+        return ServerSessionInterface(SQLiteSessionBackend(SESSION_DB))
+    raise ValueError(f"Unknown SESSION_BACKEND '{backend}' (expected 'sqlite' or 'memory')")
@@ -0,0 +1,29 @@
+"""
+SQLite connections for the stores that keep their state on disk.
+
+The doc-write journal, push channels and server-side sessions each live in a
+SQLite file that several threads, and possibly several workers, use at once.
+"""
+import sqlite3
+import threading
+
+_local = threading.local()
+
+
+def thread_connection(path):
+    """
+    Connection to the database at path for the calling thread
+
+    SQLite connections are not shareable between threads, so each thread
+    opens its own and keeps it. WAL lets readers run alongside a writer, and
+    writers wait up to 10 seconds for a lock instead of failing.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    db = connections.get(path)
+    if db is None:
+        db = sqlite3.connect(path, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        connections[path] = db
+    return db
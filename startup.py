@@ -0,0 +1,207 @@
+"""
+Worker startup: deferred heavy imports, background warm-up and boot timings.
+
+Importing app.py used to load OpenCV, NumPy, Pillow, googleapiclient and the
+HTTP clients, and to build the Cerebras client (which opens a connection to
+the API), before a worker could answer anything. With STARTUP_MODE=lazy
+(the default under gunicorn.conf.py):
+
+- modules get these libraries from lazy_import(), a stand-in module that
+  imports the real one on first attribute access;
+- clients are built by deferred() initializers on first use;
+- warm_up() loads everything still deferred in a background thread once the
+  worker is ready. gunicorn.conf.py starts it from post_worker_init unless
+  STARTUP_WARMUP=0, so the first capture usually finds everything loaded.
+
+With STARTUP_MODE=eager, everything loads while app.py is imported, as
+before. stats() reports how long app.py took to import and, for each
+deferred module or initializer, how long it took and whether the warm-up
+or a request loaded it.
+"""
+import os
+import sys
+import time
+import types
+import importlib
+import threading
+
+# Imported first by app.py, so this is when the app started loading
+_started = time.perf_counter()
+
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "eager").lower()
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1").lower() not in ('0', 'false', 'no')
+LAZY = STARTUP_MODE == 'lazy'
+
+_lock = threading.RLock()  # guards the registries below
+_modules = {}  # name -> LazyModule
+_initializers = {}  # name -> Deferred
+_warm_up_tasks = []  # (name, fn) only run by warm_up()
+_loads = {}  # name -> {'ms', 'loaded_by'}
+_boot = {}
+_warm_up_thread = None
+_warming = None  # thread running _warm_up()
+
+
+class LazyModule(types.ModuleType):
+    """Stands in for a module until one of its attributes is first used"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_loaded'] = False
+        # Per module, so a slow import doesn't hold up unrelated ones
+        self.__dict__['_lazy_lock'] = threading.RLock()
+
+    def __getattr__(self, attr):
+        # Only called for names not in __dict__, i.e. until the module is loaded
+        self._lazy_load()
+        return getattr(sys.modules[self.__name__], attr)
+
+    def _lazy_load(self):
+        with self._lazy_lock:
+            if self._lazy_loaded:
+                return
+            name = self.__name__
+            started = time.perf_counter()
+            module = importlib.import_module(name)
+            _record(name, started)
+            # Later lookups hit the real attributes directly
+            self.__dict__.update(module.__dict__)
+            self.__dict__['_lazy_loaded'] = True
+
+
+class Deferred:
+    """A value built by fn on first call, e.g. an API client"""
+
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.done = False
+        self.value = None
+        self.lock = threading.RLock()
+
+    def __call__(self):
+        if not self.done:
+            with self.lock:
+                if not self.done:
+                    started = time.perf_counter()
+                    self.value = self.fn()
+                    _record(self.name, started)
+                    self.done = True
+        return self.value
+
+
+def lazy_import(name):
+    """
+    Import a module now (eager startup) or on first use (lazy startup)
+
+    Args:
+        name: Dotted module name, e.g. 'cv2' or 'googleapiclient.discovery'
+
+    Returns:
+        The module, or a stand-in that imports it on first attribute access
+    """
+    if not LAZY:
+        return importlib.import_module(name)
+    with _lock:
+        module = _modules.get(name)
+        if module is None:
+            module = _modules[name] = LazyModule(name)
+        return module
+
+
+def deferred(name, fn):
+    """
+    Wrap an expensive initializer so it runs once, on first call
+
+    Under eager startup it runs straight away.
+
+    Returns:
+        Callable returning fn's result
+    """
+    initializer = Deferred(name, fn)
+    with _lock:
+        _initializers[name] = initializer
+    if not LAZY:
+        initializer()
+    return initializer
+
+
+def on_warm_up(name, fn):
+    """Run fn during warm_up(), e.g. to preload data the first request would otherwise load"""
+    with _lock:
+        _warm_up_tasks.append((name, fn))
+
+
+def app_ready():
+    """Called at the end of app.py; records and prints how long the import took"""
+    _boot['app_import_ms'] = round((time.perf_counter() - _started) * 1000, 1)
+    print(f"App loaded in {_boot['app_import_ms']} ms ({STARTUP_MODE} startup)")
+
+
+def warm_up(background=True):
+    """
+    Load every deferred module and initializer, then run the on_warm_up tasks
+
+    Args:
+        background: Run in a daemon thread and return at once
+    """
+    global _warm_up_thread
+    if not background:
+        return _warm_up()
+    with _lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up, name='startup-warm-up', daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def stats():
+    with _lock:
+        return {
+            'mode': STARTUP_MODE,
+            **_boot,
+            'loaded': dict(_loads),
+            'pending': sorted([name for name, module in _modules.items() if not module._lazy_loaded] +
+                              [name for name, initializer in _initializers.items() if not initializer.done]),
+        }
+
+
+def _warm_up():
+    global _warming
+    _warming = threading.current_thread()
+    started = time.perf_counter()
+    with _lock:
+        modules = list(_modules.values())
+        initializers = list(_initializers.values())
+        tasks = list(_warm_up_tasks)
+    for module in modules:
+        _guarded(module.__name__, module._lazy_load)
+    for initializer in initializers:
+        _guarded(initializer.name, initializer)
+    for name, fn in tasks:
+        task_started = time.perf_counter()
+        if _guarded(name, fn):
+            _record(name, task_started)
+    _boot['warm_up_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    _warming = None
+    print(f"Warm-up finished in {_boot['warm_up_ms']} ms")
+
+
+def _guarded(name, fn):
+    # A failure here resurfaces on first use, where the request handles it
+    try:
+        fn()
+        return True
+    except Exception as e:
+        print(f"Warm-up of {name} failed: {str(e)}")
+        return False
+
+
+def _record(name, started):
+    if threading.current_thread() is _warming:
+        loaded_by = 'warm-up'
+    elif 'app_import_ms' not in _boot:
+        loaded_by = 'startup'
+    else:
+        loaded_by = 'request'
+    _loads[name] = {'ms': round((time.perf_counter() - started) * 1000, 1), 'loaded_by': loaded_by}
@@ -4,6 +4,8 @@
 let currentDocId = null;
 let currentStream = null;
 let facingMode = "environment"; // Start with back camera
+let capturedBlob = null; // Binary image of the current capture or upload
+let currentCaptureId = null; // Server-side handle for the processed capture
 
 // Function to show create event modal with default times
 function showCreateEventModal() {
@@ -92,6 +94,133 @@ function showToast(message, type = 'info') {
     });
 }
 
+// Find the notes document the current session is saving into, if any
+function getCurrentDocId() {
+    const docLink = document.querySelector('[data-doc-id]');
+    const docData = document.getElementById('documentData');
+    
+    if (docLink) {
+        return docLink.dataset.docId;
+    } else if (docData) {
+        return docData.dataset.docId;
+    }
+    return currentDocId;
+}
+
+// Wait for an OCR job submitted in async mode and resolve with its result.
+// Responses without a job id (synchronous mode) are passed straight through.
+async function awaitOcrResult(data) {
+    if (!data.job_id) {
+        return data;
+    }
+    
+    while (true) {
+        const response = await fetch(`/ocr-jobs/${data.job_id}?wait=20`);
+        const job = await response.json();
+        
+        if (job.status === 'done') {
+            return job.result;
+        }
+        if (job.status === 'failed' || !job.success) {
+            return { success: false, error: job.error || 'OCR job failed' };
+        }
+    }
+}
+
+// Read a /process-slide/stream response, calling onDelta with each piece of
+// text as it arrives, and resolve with the final result. Responses that are
+// not an event stream (errors such as a full OCR queue) resolve with their JSON.
+async function readOcrStream(response, onDelta) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.startsWith('text/event-stream')) {
+        return awaitOcrResult(await response.json());
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line; keep any partial event for the next read
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            }
+            if (!data) {
+                continue;  // keep-alive comment
+            }
+
+            const payload = JSON.parse(data);
+            if (event === 'text') {
+                onDelta(payload.delta);
+            } else if (event === 'result') {
+                result = payload;
+            } else if (event === 'timing') {
+                console.debug(`OCR first text after ${payload.first_text_ms} ms, result after ${payload.total_ms} ms`);
+            }
+        }
+    }
+
+    return result || { success: false, error: 'OCR stream ended early' };
+}
+
+// Saved slides are written to the notes document in batches after the save
+// request returns. Follow the document until they are written, and tell the
+// user about any that Docs refused, so a failed save does not go unnoticed.
+const docWriteFailures = {}; // doc id -> dead-lettered captures already reported
+let docWriteTimer = null;
+let docWriteError = null;
+
+function reportDocWrites(docId, status) {
+    const reported = docWriteFailures[docId];
+    docWriteFailures[docId] = status.failed || 0;
+    if (reported !== undefined && status.failed > reported) {
+        const count = status.failed - reported;
+        showToast(`${count > 1 ? count + ' slides' : 'A slide'} could not be added to your notes ` +
+            `(${status.last_failure}). Capture ${count > 1 ? 'them' : 'it'} again to retry.`, 'error');
+    }
+    if (status.pending && status.last_error && status.last_error !== docWriteError) {
+        showToast('Your notes could not be updated yet, retrying shortly.', 'warning');
+    }
+    docWriteError = status.last_error;
+}
+
+function watchDocWrites(docId, status) {
+    reportDocWrites(docId, status);
+    clearTimeout(docWriteTimer);
+    if (!status.pending) {
+        return;
+    }
+    const delay = Math.max(5, Math.min(30, status.next_flush_in || 5)) * 1000;
+    docWriteTimer = setTimeout(() => {
+        fetch(`/doc-writes/${encodeURIComponent(docId)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                watchDocWrites(docId, data);
+            }
+        })
+        .catch(error => console.error('Error checking saved slides:', error));
+    }, delay);
+}
+
 // Initialize camera function (defined globally for access by navigation handlers)
 async function initCamera() {
     const video = document.getElementById('video');
@@ -158,6 +287,22 @@ document.addEventListener('DOMContentLoaded', function() {
     const resultsSection = document.getElementById('resultsSection');
     const createEventForm = document.getElementById('createEventForm');
 
+    // Object URL of the capture shown in capturedImage, released once the
+    // image has loaded (or failed to) so each capture's blob can be freed
+    let capturedImageUrl = null;
+
+    function releaseCapturedImageUrl() {
+        if (capturedImageUrl) {
+            URL.revokeObjectURL(capturedImageUrl);
+            capturedImageUrl = null;
+        }
+    }
+
+    if (capturedImage) {
+        capturedImage.addEventListener('load', releaseCapturedImageUrl);
+        capturedImage.addEventListener('error', releaseCapturedImageUrl);
+    }
+
     // Initialize camera on page load if on camera tab
     if (document.getElementById('camera-tab')) {
         document.getElementById('camera-tab').addEventListener('shown.bs.tab', initCamera);
@@ -269,22 +414,31 @@ document.addEventListener('DOMContentLoaded', function() {
             // Draw video frame to canvas
             canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height);
             
-            // Get image data and explicitly set it on the image element
-            const imageData = canvas.toDataURL('image/png');
-            
-            // Set captured image source
-            capturedImage.src = imageData;
-            capturedImage.style.display = 'block';
-            
-            // Make sure results section is visible and properly styled
-            resultsSection.style.display = 'block';
-            
-            // Hide camera view elements
-            document.getElementById('captureTabContent').style.display = 'none';
-            document.querySelector('.nav-tabs').style.display = 'none';
-            
-            // Process image
-            processImage(imageData);
+            // Encode the frame as a binary blob (sent as-is, no base64)
+            canvas.toBlob(blob => {
+                if (!blob) {
+                    showToast("Could not capture the frame. Please try again.", "error");
+                    return;
+                }
+                capturedBlob = blob;
+                currentCaptureId = null;
+                
+                // Set captured image source
+                releaseCapturedImageUrl();
+                capturedImageUrl = URL.createObjectURL(blob);
+                capturedImage.src = capturedImageUrl;
+                capturedImage.style.display = 'block';
+                
+                // Make sure results section is visible and properly styled
+                resultsSection.style.display = 'block';
+                
+                // Hide camera view elements
+                document.getElementById('captureTabContent').style.display = 'none';
+                document.querySelector('.nav-tabs').style.display = 'none';
+                
+                // Process image
+                processImage(blob);
+            }, 'image/jpeg', 0.92);
         });
     }
 
@@ -303,9 +457,18 @@ document.addEventListener('DOMContentLoaded', function() {
             processingOverlay.style.display = 'flex';
             processingMessage.textContent = 'Processing uploaded image...';
             
+            capturedBlob = file;
+            currentCaptureId = null;
+            
             // Create a FormData object
             const formData = new FormData();
             formData.append('image', file);
+            formData.append('mode', 'async');
+            
+            const docId = getCurrentDocId();
+            if (docId) {
+                formData.append('doc_id', docId);
+            }
             
             // Send the image to the server
             fetch('/upload-image', {
@@ -313,13 +476,16 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: formData
             })
             .then(response => response.json())
+            .then(awaitOcrResult)
             .then(data => {
                 // Hide processing overlay
                 processingOverlay.style.display = 'none';
                 
                 if (data.success) {
-                    // Display the processed image
+                    // Display the preview; the full image stays on the server
+                    releaseCapturedImageUrl();
                     capturedImage.src = data.processed_image;
+                    currentCaptureId = data.capture_id || null;
                     
                     // Show results section and hide capture tabs
                     resultsSection.style.display = 'block';
@@ -345,28 +511,52 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Process the captured image
-    function processImage(imageData) {
+    function processImage(imageBlob) {
         // Show processing overlay
         processingOverlay.style.display = 'flex';
         processingMessage.textContent = 'Processing slide...';
         
         // Make sure image is still displayed during processing
-        capturedImage.src = imageData;
         capturedImage.style.display = 'block';
         
-        // Send to server for processing
-        fetch('/process-slide', {
+        // Send the raw image bytes to the server for processing
+        const params = new URLSearchParams();
+        const docId = getCurrentDocId();
+        if (docId) {
+            params.append('doc_id', docId);
+        }
+
+        // Show the text as it is recognised instead of waiting for all of it
+        let streamedText = '';
+        const showPartialText = delta => {
+            if (!streamedText) {
+                processingOverlay.style.display = 'none';
+                resultsSection.style.display = 'block';
+            }
+            streamedText += delta;
+            extractedText.textContent = streamedText;
+        };
+
+        fetch(`/process-slide/stream?${params}`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': imageBlob.type || 'application/octet-stream'
             },
-            body: JSON.stringify({ image: imageData })
+            body: imageBlob
         })
-        .then(response => response.json())
+        .then(response => readOcrStream(response, showPartialText))
         .then(data => {
             // Hide processing overlay
             processingOverlay.style.display = 'none';
             
+            if (data.duplicate) {
+                showToast(data.already_saved
+                    ? 'This slide is already in your notes.'
+                    : data.save_pending
+                        ? 'This slide is already being added to your notes.'
+                        : 'Same slide as your last capture, reusing its text.', 'info');
+            }
+            
             // Display OCR results
             if (data.text) {
                 extractedText.textContent = data.text;
@@ -374,11 +564,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 extractedText.textContent = 'No text could be extracted.';
             }
             
-            // Update image with processed version if available
-            if (data.processed_image) {
-                capturedImage.src = data.processed_image;
-                capturedImage.style.display = 'block';
-            }
+            // The full-size capture is already displayed from the local blob;
+            // the server keeps its own copy under capture_id for saving
+            currentCaptureId = data.capture_id || null;
             
             // Make sure the results section is fully visible
             resultsSection.style.display = 'block';
@@ -418,19 +606,7 @@ document.addEventListener('DOMContentLoaded', function() {
             processingMessage.textContent = 'Saving to document...';
             
             // Get the document ID from data attribute
-            let docId = null;
-            
-            // Check both places where we might store the doc_id
-            const docLink = document.querySelector('[data-doc-id]');
-            const docData = document.getElementById('documentData');
-            
-            if (docLink) {
-                docId = docLink.dataset.docId;
-            } else if (docData) {
-                docId = docData.dataset.docId;
-            } else if (currentDocId) {
-                docId = currentDocId;
-            }
+            const docId = getCurrentDocId();
             
             if (!docId) {
                 // No document yet, create one first
@@ -488,24 +664,48 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Helper function to save image to document
-    function saveImageToDoc(docId) {
+    function saveImageToDoc(docId, resendImage = false) {
         processingMessage.textContent = 'Saving to document...';
         
+        // Refer to the capture kept on the server when we have one; otherwise
+        // send the image as a multipart file part
+        const formData = new FormData();
+        if (currentCaptureId && !resendImage) {
+            formData.append('capture_id', currentCaptureId);
+        } else if (capturedBlob) {
+            formData.append('image', capturedBlob);
+        }
+        formData.append('text', extractedText.textContent);
+        formData.append('doc_id', docId);
+        
         fetch('/save-to-doc', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ 
-                image: capturedImage.src,
-                text: extractedText.textContent,
-                doc_id: docId
-            })
+            body: formData
         })
         .then(response => response.json())
         .then(data => {
+            if (data.error_code === 'capture_expired' && capturedBlob && !resendImage) {
+                // The server dropped the capture, fall back to uploading it
+                saveImageToDoc(docId, true);
+                return;
+            }
             processingOverlay.style.display = 'none';
-            if (data.success) {
+            if (data.success && data.skipped) {
+                showToast(data.pending
+                    ? 'This slide is already being added to your notes, skipped saving it again.'
+                    : 'This slide is already in your notes, skipped saving it again.', 'info');
+                setTimeout(resetToCameraView, 1000);
+            } else if (data.success && data.queued) {
+                // The server writes captures to the document in batches
+                const pending = data.flush ? data.flush.pending : 0;
+                showToast(pending > 1
+                    ? `Slide saved, ${pending} slides will be added to your notes shortly.`
+                    : 'Slide saved, it will be added to your notes shortly.', 'success');
+                if (data.flush) {
+                    watchDocWrites(docId, data.flush);
+                }
+                setTimeout(resetToCameraView, 1000);
+            } else if (data.success) {
                 // Show success message
                 showToast('Slide saved successfully!', 'success');
                 
@@ -702,4 +902,12 @@ document.addEventListener('DOMContentLoaded', function() {
             }, 100);
         });
     });
-});
\ No newline at end of file
+});
+
+// Write any slides the server is still buffering when the user leaves the page
+window.addEventListener('pagehide', function() {
+    const docId = getCurrentDocId();
+    if (docId && navigator.sendBeacon) {
+        navigator.sendBeacon(`/doc-writes/${encodeURIComponent(docId)}/flush`);
+    }
+});
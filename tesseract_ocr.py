@@ -0,0 +1,177 @@
+"""
+Local OCR engine built on Tesseract.
+
+The slide is split into text-line regions (or horizontal bands when line
+detection finds nothing sensible) and the regions are recognized in parallel
+on a process pool. Each region is a small, single-line problem for
+Tesseract, so latency scales with the number of CPU cores rather than with
+the size of the slide, and nothing leaves the machine.
+"""
+import os
+import importlib.util
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from startup import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Imports NumPy and Pillow, so deferred along with them
+pytesseract = lazy_import('pytesseract')
+
+TESSERACT_WORKERS = int(os.environ.get("TESSERACT_WORKERS", os.cpu_count() or 2))
+TESSERACT_LANG = os.environ.get("TESSERACT_LANG", "eng")
+TESSERACT_MAX_REGIONS = int(os.environ.get("TESSERACT_MAX_REGIONS", 80))
+TESSERACT_TILE_HEIGHT = int(os.environ.get("TESSERACT_TILE_HEIGHT", 160))  # px, for the band fallback
+
+_available = None
+_pool = None
+_lock = threading.Lock()  # request threads may race to create the pool
+
+
+def tesseract_available():
+    """Whether pytesseract and the tesseract binary are both installed (checked once)"""
+    global _available
+    if _available is None:
+        with _lock:
+            if _available is None:
+                if importlib.util.find_spec('pytesseract') is None:
+                    _available = False
+                else:
+                    try:
+                        pytesseract.get_tesseract_version()
+                        _available = True
+                    except Exception:
+                        _available = False  # no tesseract binary
+    return _available
+
+
+def _init_worker():
+    # One Tesseract thread per process; parallelism comes from the pool
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn avoids forking a worker process that is already running threads
+            _pool = ProcessPoolExecutor(
+                max_workers=TESSERACT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+    return _pool
+
+
+def find_text_lines(gray):
+    """
+    Locate text lines on a slide
+
+    Args:
+        gray: Grayscale image
+
+    Returns:
+        List of (x, y, w, h) boxes in reading order
+    """
+    height, width = gray.shape[:2]
+
+    # Text strokes stand out in the morphological gradient regardless of
+    # whether the slide is dark-on-light or light-on-dark
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Join characters and words into lines with a wide, flat kernel
+    kernel_width = max(9, width // 40)
+    joined = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_width, 3)))
+
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_height = max(8, height // 100)
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # Drop specks, and shapes taller than a few lines (photos, diagrams)
+        if h < min_height or w < h or h > height // 4:
+            continue
+        pad = max(2, h // 5)
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+
+    # Holes inside a line (counters of letters on dark backgrounds) show up as
+    # separate contours; they are already covered by the enclosing line
+    boxes = [b for b in boxes if not any(o is not b and _contains(o, b) for o in boxes)]
+
+    # Reading order: top to bottom, then left to right within a row
+    boxes.sort(key=lambda b: (b[1] // max(1, min_height), b[0]))
+    return boxes
+
+
+def _contains(outer, inner):
+    ox, oy, ow, oh = outer
+    ix, iy, iw, ih = inner
+    return ox <= ix and oy <= iy and ix + iw <= ox + ow and iy + ih <= oy + oh
+
+
+def horizontal_bands(gray, band_height=TESSERACT_TILE_HEIGHT):
+    """
+    Full-width bands covering the slide
+
+    Each cut is moved to the row with the least ink near the nominal band
+    edge, so bands rarely slice through a line of text.
+    """
+    height, width = gray.shape[:2]
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    row_ink = ink.sum(axis=1)
+
+    bands = []
+    top = 0
+    while top < height:
+        cut = top + band_height
+        if cut >= height:
+            cut = height
+        else:
+            window = band_height // 4
+            lo, hi = max(top + 1, cut - window), min(height, cut + window)
+            cut = lo + int(np.argmin(row_ink[lo:hi]))
+        bands.append((0, top, width, cut - top))
+        top = cut
+    return bands
+
+
+def _recognize_region(crop, psm, lang):
+    return pytesseract.image_to_string(crop, lang=lang, config=f'--psm {psm}').strip()
+
+
+def extract_text_with_tesseract(image):
+    """
+    Extract slide text locally with Tesseract
+
+    Args:
+        image: OpenCV image (BGR or grayscale)
+
+    Returns:
+        Extracted text as string, empty if Tesseract is unavailable or finds nothing
+    """
+    if not tesseract_available():
+        return ""
+
+    try:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+        boxes = find_text_lines(gray)
+        psm = 7  # single text line
+        if not boxes or len(boxes) > TESSERACT_MAX_REGIONS:
+            boxes = horizontal_bands(gray)
+            psm = 6  # uniform block of text
+
+        crops = [np.ascontiguousarray(gray[y:y + h, x:x + w]) for x, y, w, h in boxes]
+        pool = _get_pool()
+        lines = pool.map(_recognize_region, crops, [psm] * len(crops), [TESSERACT_LANG] * len(crops))
+        return "\n".join(line for line in lines if line)
+
+    except Exception as e:
+        print(f"Error in Tesseract OCR: {str(e)}")
+        return ""
@@ -0,0 +1,387 @@
+"""
+Local fake of the Google Calendar, Drive, Docs and People APIs that enforces quotas.
+
+Answers the calls SlideSync makes with plausible JSON, but each (access token,
+API) pair only gets --rate requests per second (burst --burst); anything over
+is refused with 429 (or 403 rateLimitExceeded with --status 403) and a
+Retry-After header. --error-rate adds random 503s, and --latency delays every
+answer, e.g. "0.05" or "0.05,docs=0.3" for a slower Docs API. The primary
+calendar always has a lecture in progress whose description links a notes
+document.
+
+It is also a minimal OpenID Connect provider: the authorization endpoint
+signs in a new user straight away and redirects back with a code, and the
+token and userinfo endpoints answer for that user. Point the app at it with
+GOOGLE_API_ROOT, which replaces the rootUrl of every discovery document, and
+the OAuth settings:
+
+    python tools/fake_google_quota.py --port 8089 --rate 1 --burst 2
+    GOOGLE_API_ROOT=http://127.0.0.1:8089/ \
+    GOOGLE_OAUTH_METADATA_URL=http://127.0.0.1:8089/.well-known/openid-configuration \
+    GOOGLE_TOKEN_URI=http://127.0.0.1:8089/token python app.py
+
+Documents keep the text inserted into them, and documents.get returns it.
+As in Docs, a batchUpdate is applied entirely or not at all; one inserting an
+image from a URL that is not https is refused with 400.
+
+GET /_fake/stats returns what was served, throttled and failed per API.
+POST /_fake/faults with e.g. {"docs": ["applied-timeout"]} makes the next
+calls to that API stall for --stall seconds after being carried out
+('applied-timeout') or without being carried out ('lost-timeout'), so
+clients with a shorter timeout cannot tell which happened.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+LECTURE_DOC_ID = 'fake-lecture-notes'
+
+documents = {}  # document id -> text inserted so far
+documents_lock = threading.Lock()
+
+
+class Quota:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # (token, api) -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, [self.burst, now])
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[key] = [tokens - 1 if allowed else tokens, now]
+            return allowed
+
+
+def parse_latency(spec):
+    """Parse "seconds[,api=seconds...]" into {api: seconds}, with 'default' for the rest"""
+    latency = {'default': 0.0}
+    for item in filter(None, (part.strip() for part in str(spec).split(','))):
+        api, _, value = item.rpartition('=')
+        latency[api.strip() or 'default'] = float(value)
+    return latency
+
+
+def api_of(path):
+    if path in ('/.well-known/openid-configuration', '/o/oauth2/v2/auth', '/token', '/v1/userinfo'):
+        return 'oauth'
+    if path.startswith(('/drive/', '/upload/drive/', '/batch/drive/')):
+        return 'drive'
+    if path.startswith(('/calendar/', '/batch/calendar/')):
+        return 'calendar'
+    if path.startswith('/v1/documents'):
+        return 'docs'
+    if path.startswith('/v1/people'):
+        return 'people'
+    return 'other'
+
+
+def respond(method, path, query, body):
+    """(status, payload) for one API call"""
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    match = re.match(r'^/v1/documents/([^/:]+)(:batchUpdate)?$', path)
+    if match:
+        doc_id = match.group(1)
+        if match.group(2):
+            return batch_update(doc_id, body.get('requests', []))
+        with documents_lock:
+            text = documents.get(doc_id, '')
+        content = [{'paragraph': {'elements': [{'textRun': {'content': text}}]}}] if text else []
+        return 200, {'documentId': doc_id, 'title': 'Fake document', 'body': {'content': content}}
+
+    if path.startswith('/v1/people/'):
+        return 200, {'resourceName': path[4:], 'photos': []}
+
+    match = re.match(r'^/(?:upload/)?drive/v3/files(?:/([^/]+))?(/permissions|/watch)?$', path)
+    if match:
+        file_id, sub = match.groups()
+        if sub == '/permissions':
+            return 200, {'id': 'anyoneWithLink'}
+        if sub == '/watch':
+            return 200, watch_channel(body)
+        if file_id is None and method == 'GET':
+            return 200, {'files': []}
+        if file_id is None:
+            return 200, {'kind': 'drive#file', 'id': uuid.uuid4().hex, 'name': body.get('name', 'Untitled'),
+                         'mimeType': body.get('mimeType', 'application/octet-stream'),
+                         'webContentLink': 'https://drive.google.com/uc?export=download'}
+        return 200, {'id': file_id, 'name': 'Fake document'}
+
+    match = re.match(r'^/calendar/v3/calendars/[^/]+/events(?:/([^/]+))?$', path)
+    if match:
+        event_id = match.group(1)
+        if event_id == 'watch':
+            return 200, watch_channel(body)
+        if event_id is None and method == 'GET':
+            return 200, {'items': [current_lecture()], 'nextSyncToken': uuid.uuid4().hex}
+        if event_id is None:
+            return 200, dict(body, id=uuid.uuid4().hex, status='confirmed', created=now, updated=now)
+        return 200, dict(body or {'summary': 'Fake event', 'start': {'dateTime': now}, 'end': {'dateTime': now}},
+                         id=event_id, status='confirmed', updated=now)
+
+    if path == '/calendar/v3/channels/stop':
+        return 204, None
+    return 404, {'error': {'code': 404, 'message': f'Not found: {path}', 'errors': [{'reason': 'notFound'}]}}
+
+
+def batch_update(doc_id, requests):
+    """Apply a documents.batchUpdate, or refuse all of it like Docs does"""
+    for index, request in enumerate(requests):
+        uri = request.get('insertInlineImage', {}).get('uri')
+        if uri is not None and not uri.startswith('https://'):
+            return 400, error_payload(400, 'badRequest', f'Invalid requests[{index}].insertInlineImage: '
+                                                         'There was a problem retrieving the image.')
+    with documents_lock:
+        for request in requests:
+            documents[doc_id] = documents.get(doc_id, '') + request.get('insertText', {}).get('text', '')
+    return 200, {'documentId': doc_id, 'replies': [{} for _ in requests]}
+
+
+def current_lecture():
+    """An hour-long event around now, with a notes document linked in its description"""
+    hour = int(time.time()) // 3600 * 3600
+    start, end = (time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t)) for t in (hour, hour + 3600))
+    return {
+        'id': f'lecture{hour}', 'status': 'confirmed', 'summary': 'Lecture 5: Dynamic programming',
+        'description': f'Notes: https://docs.google.com/document/d/{LECTURE_DOC_ID}/edit',
+        'start': {'dateTime': start}, 'end': {'dateTime': end}, 'updated': start,
+    }
+
+
+def watch_channel(body):
+    return {'kind': 'api#channel', 'id': body.get('id'), 'resourceId': uuid.uuid4().hex,
+            'expiration': str(int((time.time() + 3600) * 1000))}
+
+
+def error_payload(status, reason, message):
+    return {'error': {'code': status, 'message': message, 'errors': [{'reason': reason, 'message': message}]}}
+
+
+class FakeGoogle(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    quota = None
+    options = None
+    stats = {}
+    stats_lock = threading.Lock()
+    faults = {}  # api -> faults for its next calls
+    uploads = {}  # upload id -> file metadata
+    codes = {}  # authorization code -> user number
+    tokens = {}  # access or refresh token -> user number
+    users = [0]
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_PATCH(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        if url.path == '/_fake/stats':
+            with self.stats_lock:
+                return self._send(200, dict(self.stats))
+        if url.path == '/_fake/faults':
+            with self.stats_lock:
+                for api, faults in json.loads(raw or b'{}').items():
+                    self.faults.setdefault(api, []).extend(faults)
+            return self._send(200, {})
+
+        api = api_of(url.path)
+        time.sleep(self.options.latency.get(api, self.options.latency['default']))
+        if api == 'oauth':
+            self._count(api, 'served')
+            return self._oauth(url, raw)
+
+        token = self.headers.get('Authorization', '')
+        if not self.quota.take((token, api)):
+            self._count(api, 'throttled')
+            status = self.options.status
+            return self._send(status, error_payload(status, 'rateLimitExceeded', 'Rate Limit Exceeded'),
+                              {'Retry-After': str(self.options.retry_after)})
+        if random.random() < self.options.error_rate:
+            self._count(api, 'errors')
+            return self._send(503, error_payload(503, 'backendError', 'Backend Error'))
+        self._count(api, 'served')
+
+        if url.path.startswith('/batch/'):
+            return self._batch(raw)
+
+        query = parse_qs(url.query)
+        upload_type = query.get('uploadType', [None])[0]
+        if upload_type == 'resumable' and self.command == 'POST':
+            # Session start: remember the metadata, hand out the upload URL
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = json.loads(raw or b'{}')
+            location = f"http://{self.headers['Host']}{url.path}?uploadType=resumable&upload_id={upload_id}"
+            return self._send(200, {}, {'Location': location})
+        if upload_type == 'resumable':
+            body = self.uploads.pop(query.get('upload_id', [''])[0], {})
+        elif upload_type == 'multipart':
+            body = json.loads(re.search(rb'\{.*?\}', raw, re.S).group(0)) if b'{' in raw else {}
+        else:
+            body = json.loads(raw) if raw else {}
+
+        with self.stats_lock:
+            fault = self.faults.get(api, []).pop(0) if self.faults.get(api) else None
+        if fault == 'lost-timeout':
+            time.sleep(self.options.stall)
+            return self._send(503, error_payload(503, 'backendError', 'Backend Error'))
+        status, payload = respond(self.command, url.path, query, body)
+        if fault == 'applied-timeout':
+            time.sleep(self.options.stall)
+            try:
+                return self._send(status, payload)
+            except (BrokenPipeError, ConnectionResetError):
+                return  # the client gave up waiting, as intended
+        self._send(status, payload)
+
+    def _oauth(self, url, raw):
+        root = f"http://{self.headers['Host']}"
+        if url.path == '/.well-known/openid-configuration':
+            return self._send(200, {
+                'issuer': root,
+                'authorization_endpoint': f'{root}/o/oauth2/v2/auth',
+                'token_endpoint': f'{root}/token',
+                'userinfo_endpoint': f'{root}/v1/userinfo',
+                'response_types_supported': ['code'],
+                'scopes_supported': ['openid', 'email', 'profile'],
+            })
+
+        if url.path == '/o/oauth2/v2/auth':
+            # Every sign-in is a new user who consents at once
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            with self.stats_lock:
+                self.users[0] += 1
+                code = uuid.uuid4().hex
+                self.codes[code] = (self.users[0], query.get('scope', ''))
+            location = f"{query['redirect_uri']}?{urlencode({'code': code, 'state': query.get('state', '')})}"
+            return self._send(302, None, {'Location': location})
+
+        if url.path == '/token':
+            form = {key: values[0] for key, values in parse_qs(raw.decode()).items()}
+            with self.stats_lock:
+                if form.get('grant_type') == 'refresh_token':
+                    user, scope = self.tokens.get(form.get('refresh_token'), (None, ''))
+                else:
+                    user, scope = self.codes.pop(form.get('code'), (None, ''))
+                if user is not None:
+                    access_token = f'fake-access-{user}-{uuid.uuid4().hex[:8]}'
+                    refresh_token = form.get('refresh_token') or f'fake-refresh-{user}'
+                    self.tokens[access_token] = self.tokens[refresh_token] = (user, scope)
+            if user is None:
+                return self._send(400, {'error': 'invalid_grant'})
+            return self._send(200, {
+                'access_token': access_token, 'refresh_token': refresh_token, 'token_type': 'Bearer',
+                'expires_in': self.options.token_ttl, 'scope': scope,
+            })
+
+        # userinfo
+        token = self.headers.get('Authorization', '').partition(' ')[2]
+        user, _ = self.tokens.get(token, (None, ''))
+        if user is None:
+            return self._send(401, error_payload(401, 'authError', 'Invalid Credentials'))
+        return self._send(200, {'sub': f'fake-user-{user}', 'email': f'student{user}@example.edu',
+                                'name': f'Student {user}', 'picture': ''})
+
+    def _batch(self, raw):
+        # multipart/mixed: each part is an HTTP request with a Content-ID
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', '')).group(1)
+        parts = []
+        for part in raw.split(b'--' + boundary.encode())[1:-1]:
+            head, _, inner = part.partition(b'\r\n\r\n')
+            content_id = re.search(rb'Content-ID: <([^>]+)>', head).group(1).decode()
+            request_line, _, rest = inner.partition(b'\r\n')
+            method, target, _ = request_line.decode().split(' ', 2)
+            headers, _, inner_body = rest.partition(b'\r\n\r\n')
+            target_url = urlsplit(target)
+            status, payload = respond(method, target_url.path, parse_qs(target_url.query),
+                                      json.loads(inner_body) if inner_body.strip() else {})
+            parts.append(
+                f"--batch_fake\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n"
+            )
+        body = (''.join(parts) + '--batch_fake--\r\n').encode()
+        self._send_raw(200, body, 'multipart/mixed; boundary=batch_fake')
+
+    def _send(self, status, payload, headers=None):
+        body = b'' if payload is None else json.dumps(payload).encode()
+        self._send_raw(status, body, 'application/json; charset=UTF-8', headers)
+
+    def _send_raw(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, api, counter):
+        with self.stats_lock:
+            counts = self.stats.setdefault(api, {'served': 0, 'throttled': 0, 'errors': 0})
+            counts[counter] += 1
+
+    def log_message(self, *args):
+        if self.options.verbose:
+            super().log_message(*args)
+
+
+def serve(port=8089, rate=1.0, burst=2.0, status=429, retry_after=1, error_rate=0.0, verbose=False,
+          latency='0', token_ttl=3600, stall=5.0):
+    """Start the fake in a background thread; returns the server (call shutdown() to stop)"""
+    FakeGoogle.quota = Quota(rate, burst)
+    FakeGoogle.options = argparse.Namespace(status=status, retry_after=retry_after, error_rate=error_rate,
+                                            verbose=verbose, latency=parse_latency(latency), token_ttl=token_ttl,
+                                            stall=stall)
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeGoogle)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--rate', type=float, default=1.0, help='requests per second per token and API')
+    parser.add_argument('--burst', type=float, default=2.0)
+    parser.add_argument('--status', type=int, choices=[429, 403], default=429, help='status for throttled calls')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds on throttled calls')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with 503')
+    parser.add_argument('--latency', default='0', help='seconds added to every answer, e.g. "0.05,docs=0.3"')
+    parser.add_argument('--token-ttl', type=int, default=3600, help='lifetime of issued access tokens in seconds')
+    parser.add_argument('--stall', type=float, default=5.0, help='seconds a call stalls for an injected timeout')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    server = serve(args.port, args.rate, args.burst, args.status, args.retry_after, args.error_rate, args.verbose,
+                   args.latency, args.token_ttl, args.stall)
+    print(f"Fake Google APIs on http://127.0.0.1:{server.server_address[1]}/ "
+          f"({args.rate}/s, burst {args.burst} per token and API)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
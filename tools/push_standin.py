@@ -0,0 +1,74 @@
+"""
+Local stand-in for Google push notifications.
+
+Posts synthetic Calendar/Drive channel notifications to a running SlideSync
+server, with the same headers Google sends. Channels are read from the
+server's channel database (PUSH_CHANNEL_DB); with --register a synthetic
+channel is added first, so the flow can be exercised without any Google
+watch call.
+
+Usage:
+    PUSH_WEBHOOK_URL=http://127.0.0.1:5000/notifications/google python app.py
+    python tools/push_standin.py --register --owner <sub> --kind calendar
+    python tools/push_standin.py --owner <sub> --kind drive --state update --changed properties
+"""
+import argparse
+import os
+import sys
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from push_channels import PushChannels, PUSH_CHANNEL_DB, CALENDAR, DRIVE  # noqa: E402
+
+
+def notify(url, channel, state, changed=None, message_number=1):
+    headers = {
+        'X-Goog-Channel-ID': channel['id'],
+        'X-Goog-Channel-Token': channel['token'],
+        'X-Goog-Channel-Expiration': str(channel['expiration']),
+        'X-Goog-Resource-ID': channel['resource_id'] or 'standin-resource',
+        'X-Goog-Resource-URI': f"standin://{channel['kind']}/{channel['target']}",
+        'X-Goog-Resource-State': state,
+        'X-Goog-Message-Number': str(message_number),
+    }
+    if changed:
+        headers['X-Goog-Changed'] = changed
+    request = urllib.request.Request(url, data=b'', headers=headers, method='POST')
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='http://127.0.0.1:5000/notifications/google')
+    parser.add_argument('--db', default=PUSH_CHANNEL_DB, help='channel database shared with the server')
+    parser.add_argument('--owner', help="only channels of this user ('sub')")
+    parser.add_argument('--kind', choices=[CALENDAR, DRIVE], help='only channels of this kind')
+    parser.add_argument('--target', help="calendar id or Drive file id (default 'primary' when registering)")
+    parser.add_argument('--state', default='exists', help='X-Goog-Resource-State: sync, exists, update, trash, ...')
+    parser.add_argument('--changed', help='X-Goog-Changed for Drive updates, e.g. properties or content')
+    parser.add_argument('--register', action='store_true', help='register a synthetic channel first')
+    args = parser.parse_args()
+
+    channels = PushChannels(path=args.db, webhook_url=args.url)
+    if args.register:
+        if not args.owner or not args.kind:
+            parser.error('--register needs --owner and --kind')
+        channels.register(args.owner, args.kind, args.target or 'primary', resource_id='standin-resource')
+
+    selected = [
+        c for c in channels.channels(args.owner)
+        if (args.kind is None or c['kind'] == args.kind) and (args.target is None or c['target'] == args.target)
+    ]
+    if not selected:
+        print('No matching channels')
+        return
+
+    for number, channel in enumerate(selected, start=1):
+        status = notify(args.url, channel, args.state, args.changed, number)
+        print(f"{channel['kind']:<9}{channel['target']:<40}{args.state:<10}HTTP {status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Small dependency-graph executor for multi-call Google workflows.
+
+Routes such as /create-event-and-doc make several API calls where only some
+depend on each other. A Workflow declares each call as a named step with the
+steps it needs; steps whose dependencies are done run concurrently on a
+shared thread pool. Every run reports when each step started and how long it
+took, so the latency breakdown of a request is visible.
+
+Steps run outside the Flask request context: read anything they need from the
+session before building the workflow.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+WORKFLOW_WORKERS = int(os.environ.get("WORKFLOW_WORKERS", 16))
+
+_executor = ThreadPoolExecutor(max_workers=WORKFLOW_WORKERS, thread_name_prefix='workflow')
+
+
+class WorkflowError(Exception):
+    """A required step failed; the original exception is chained"""
+
+    def __init__(self, workflow, step, error, timings):
+        super().__init__(f"{workflow}: step '{step}' failed: {error}")
+        self.step = step
+        self.timings = timings
+
+
+class Workflow:
+    def __init__(self, name):
+        self.name = name
+        self._steps = OrderedDict()  # name -> (fn, dependencies, optional)
+
+    def step(self, name, fn, after=(), optional=False):
+        """
+        Add a step
+
+        Args:
+            name: Step name, also the key of its result
+            fn: Callable receiving the results of its dependencies as keyword
+                arguments (named after the steps) and returning its result
+            after: Names of steps that must finish first
+            optional: If True a failure is logged, the result is None and
+                dependent steps still run
+
+        Returns:
+            The workflow, so steps can be chained
+        """
+        missing = [dep for dep in after if dep not in self._steps]
+        if missing:
+            raise ValueError(f"Step '{name}' depends on unknown step(s): {', '.join(missing)}")
+        self._steps[name] = (fn, tuple(after), optional)
+        return self
+
+    def run(self):
+        """
+        Run all steps, each as soon as its dependencies are done
+
+        Returns:
+            (results, timings): dict of step results, and the breakdown
+            {'total_ms', 'steps': {name: {'start_ms', 'ms'[, 'error']}}}
+
+        Raises:
+            WorkflowError: if a required step failed; steps already running
+                are allowed to finish and nothing depending on it is started
+        """
+        started = time.perf_counter()
+        results = {}
+        timings = {}
+        pending = OrderedDict(self._steps)
+        running = {}
+        failure = None
+
+        def launch(name, fn, after):
+            kwargs = {dep: results[dep] for dep in after}
+
+            def call():
+                step_started = time.perf_counter()
+                try:
+                    return fn(**kwargs)
+                finally:
+                    timings[name] = {
+                        'start_ms': round((step_started - started) * 1000, 1),
+                        'ms': round((time.perf_counter() - step_started) * 1000, 1),
+                    }
+
+            running[_executor.submit(call)] = name
+
+        while pending or running:
+            if failure is None:
+                for name, (fn, after, optional) in list(pending.items()):
+                    if all(dep in results for dep in after):
+                        del pending[name]
+                        launch(name, fn, after)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    timings[name]['error'] = str(e)
+                    if self._steps[name][2]:
+                        print(f"{self.name}: optional step '{name}' failed: {e}")
+                        results[name] = None
+                    elif failure is None:
+                        failure = (name, e)
+
+        breakdown = {
+            'total_ms': round((time.perf_counter() - started) * 1000, 1),
+            'steps': {name: timings[name] for name in self._steps if name in timings},
+        }
+        workflow_stats.record(self.name, breakdown)
+        if failure is not None:
+            raise WorkflowError(self.name, failure[0], failure[1], breakdown) from failure[1]
+        return results, breakdown
+
+
+class WorkflowStats:
+    """Mean total and per-step latency for each workflow in this process"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, workflow, breakdown):
+        with self._lock:
+            stats = self._stats.setdefault(workflow, {'count': 0, 'total_ms': 0.0, 'steps': {}})
+            stats['count'] += 1
+            stats['total_ms'] += breakdown['total_ms']
+            for name, timing in breakdown['steps'].items():
+                step = stats['steps'].setdefault(name, {'count': 0, 'total_ms': 0.0})
+                step['count'] += 1
+                step['total_ms'] += timing['ms']
+
+    def stats(self):
+        with self._lock:
+            return {
+                workflow: {
+                    'count': s['count'],
+                    'mean_ms': round(s['total_ms'] / s['count'], 1),
+                    'steps': {
+                        name: round(step['total_ms'] / step['count'], 1)
+                        for name, step in s['steps'].items()
+                    },
+                }
+                for workflow, s in self._stats.items()
+            }
+
+
+workflow_stats = WorkflowStats()